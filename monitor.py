@@ -5,21 +5,56 @@ Universal HTTP access-log RPS monitor
 Hỗ trợ: aaPanel, Nginx, Apache, LiteSpeed, OpenLiteSpeed, CyberPanel, DirectAdmin, cPanel
 
 Mặc định:
-  - In tổng quan kết nối hệ thống (đọc trực tiếp /proc/net hoặc ss)
+  - In tổng quan kết nối hệ thống (netlink sock_diag, /proc/net hoặc ss)
   - In bảng miền (RPS theo domain) -> có thể tắt bằng --no-domains
 Tùy chọn:
   - --topip [THRESHOLD] : hiện Top IP (dưới bảng miền). Mặc định ngưỡng 5.
+  - --topip-max-ips N   : giữ tối đa ~N IP cho Top IP (Space-Saving), bộ nhớ cố định khi DDoS phân tán
+  - --log-ips           : req/s theo IP client từ log (HTTP/2, keep-alive), Top IP và Top domain + IP
+  - --log-ip-max N      : số IP giữ lại cho --log-ips (bộ nhớ cố định, mặc định 1000)
   - --logfile           : in danh sách file log đang theo dõi
   - --dir PATH          : bổ sung thư mục log (có thể dùng nhiều lần)
-  - --interval SEC      : khoảng đo RPS (mặc định 2s)
+  - --interval SEC      : chu kỳ làm mới (mặc định 2s); RPS trượt 1s/10s/60s + đỉnh theo bucket 1 giây
+  - --net-interval SEC  : chu kỳ lấy mẫu kết nối (mặc định 1s), task riêng không chờ đọc log
   - --rediscover SEC    : chu kỳ tái khám phá log (mặc định 10s)
   - --start-at-begin    : đọc log từ đầu (mặc định từ cuối)
   - --show-zero         : hiển thị domain RPS=0
   - --no-domains        : tắt bảng miền
+  - --no-inotify        : tắt inotify, quay về vòng lặp poll
+  - --binary            : đọc log dạng bytes theo chunk, chỉ decode phần domain
+  - --max-read-mb MB    : ngân sách đọc mỗi file mỗi lượt (mặc định 4MB), round-robin giữa các file
+  - --max-read-lines N  : ngân sách số dòng mỗi file mỗi lượt (mặc định không giới hạn)
+  - --max-open N        : số file log mở cùng lúc tối đa (mặc định nửa ulimit -n), đóng file ít hoạt động (LRU)
+  - --state FILE        : lưu offset các file log, khởi động lại đọc tiếp (kể cả file đã rotate .1)
+  - --by-timestamp      : đếm request vào đúng giây ghi trong log (đọc bù/backlog không tạo đỉnh RPS giả)
+  - --workers N         : chia file log cho N process đọc song song (máy nhiều core, nhiều vhost)
+  - --replay CSV        : batch, dựng lại RPS theo giây/domain từ log đã rotate/nén (--replay-days N, --workers N)
+  - --serve PORT        : headless, phục vụ /metrics (Prometheus) và /json từ snapshot đã thu thập (--bind ADDR)
+  - --net-backend NAME  : auto|netlink|proc|ss (mặc định auto)
+  - --sample-above N    : lũ request: quá N dòng/giây một file thì chỉ parse mẫu dòng, RPS theo domain nhân lên (~)
+  - --self-stats        : bảng chi phí của monitor (ms mỗi stage, dòng/s, byte/s, FD, RSS, CPU); luôn có trong --serve
+  - --profile TICKS     : cProfile mọi luồng trong TICKS lượt làm mới, ghi monitor.prof rồi thoát
 
 Tối ưu:
-  - Đọc trực tiếp /proc/net/* (không cần netstat/ss)
+  - Netlink sock_diag (lọc state/port phía kernel), dự phòng /proc/net/* hoặc ss
+  - Parse /proc/net/* theo cột (NumPy nếu có)
+  - Một snapshot kết nối mỗi lượt render, dùng chung cho thống kê và Top IP
+  - --replay giải nén theo khối lớn trên process pool, đếm ghi ra run đã sắp xếp rồi trộn k-way (bộ nhớ cố định)
+  - Exporter HTTP chỉ trả snapshot render sẵn, request không chạy lại việc thu thập
+  - Vẽ màn hình bằng một lần write mỗi frame, chỉ vẽ lại dòng thay đổi (mã ANSI, không fork clear)
+  - Domain được intern và ánh xạ sang id; RPS là vector array theo id, tổng cửa sổ cộng dồn,
+    màn hình chỉ chọn top MAX_ROWS bằng heap (không sort toàn bộ)
+  - --sample-above: tổng dòng đếm bằng bytes.count(b"\\n"), regex chỉ chạy trên mẫu; file một domain đếm chính xác.
+    Text mode khi flood cũng đọc bytes (preadv/mmap), không decode và tách từng dòng
+  - Text mode đọc bù backlog lớn (--start-at-begin) theo chunk qua mmap, đếm trên bytes như binary mode:
+    không qua decoder, không tạo str từng dòng, RSS không tăng theo kích thước file
   - Pre-compiled regex patterns
+  - Timestamp log được cache theo chuỗi (mỗi giây phân tích một lần, không strptime từng dòng)
+  - Lõi asyncio: đọc log, lấy mẫu kết nối, khám phá log và xuất số liệu là các task độc lập,
+    mỗi task một nhịp riêng; phần chặn I/O chạy trong executor nên nguồn chậm không làm trễ nguồn khác
+  - Khám phá log bằng một os.scandir mỗi thư mục, cache theo mtime thư mục
+  - inotify (qua ctypes) để chỉ đọc file log có thay đổi, poll là dự phòng
+  - Tùy chọn nhiều process đọc log (--workers), process chính chỉ gộp counters
   - Thread pool cho I/O operations
   - Tương thích mọi Linux distro
 
@@ -43,13 +78,47 @@ from __future__ import annotations
 import os
 import sys
 import time
-import glob
+import fnmatch
 import re
+import random
+import resource
+import select
+import struct
+import ctypes
+import ctypes.util
+import signal
+import socket
+import zlib
+import gzip
+import bz2
+import lzma
+import mmap
+import csv
+import tempfile
+import json
 import argparse
-from collections import defaultdict
+import asyncio
+import cProfile
+import pstats
+import calendar
+import multiprocessing
+import threading
+import heapq
+import shutil
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, defaultdict
 from typing import Dict, List, Optional, Tuple, Set
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
+from operator import itemgetter
+
+try:
+    import numpy as np  # optional: parser /proc/net/tcp dạng vector
+except ImportError:
+    np = None
 
 # ======= Defaults =======
 # Danh sách thư mục log theo Control Panel và Web Server
@@ -124,10 +193,46 @@ CANDIDATE_DIRS: List[str] = [
 ]
 
 INTERVAL_SEC: float = 2.0
+NET_INTERVAL_SEC: float = 1.0              # chu kỳ lấy mẫu bảng kết nối
 REDISCOVER_SEC: int = 10
 MAX_ROWS: int = 60
+RATE_WINDOW_SEC: int = 60                  # lịch sử RPS giữ lại (giây)
+RATE_WINDOWS: Tuple[int, ...] = (1, 10, 60)
+RATE_PEAK_VECTOR_MIN: int = 256            # từ số domain này, đỉnh RPS được tính bằng numpy (nếu có)
 POLL_SLEEP: float = 0.1
+WATCH_RETRY_SEC: float = 10.0              # file không watch được (hết max_user_watches...) thử lại sau ngần này
+READ_CHUNK_SIZE: int = 1024 * 1024
+READ_BUDGET_BYTES: int = 4 * 1024 * 1024   # ngân sách đọc mỗi file mỗi lượt
+READ_BUDGET_LINES: int = 0                 # 0 = không giới hạn
+TEXT_READ_HINT: int = 256 * 1024
+MMAP_CATCHUP_BYTES: int = 16 * 1024 * 1024  # text mode: backlog chưa đọc từ mức này thì đọc qua mmap
+MAX_OPEN_TAILS: int = 0                    # 0 = tự động (nửa RLIMIT_NOFILE)
+CHECKPOINT_SEC: float = 5.0                # chu kỳ ghi file trạng thái (--state)
+STATE_VERSION: int = 1
+LAG_MAX_ROWS: int = 10
+WORKER_SLICE_SEC: float = 0.05             # worker kiểm tra lệnh từ process cha mỗi 50ms
 THREAD_POOL_SIZE: int = 4
+LOG_IP_WINDOW_SEC: int = 10                # cửa sổ tính req/s theo IP từ log (--log-ips)
+LOG_IP_CAPACITY: int = 1000                # số IP/cặp (domain, IP) giữ lại mỗi sketch
+LOG_IP_EXPORT_LIMIT: int = 50              # số IP/cặp xuất qua --serve
+TOPIP_LIMIT: int = 5                       # số IP hiện mỗi nhóm Top IP
+TOPIP_MAX_IPS: int = 0                     # 0 = đếm chính xác mọi IP
+SNAPSHOT_TTL: float = 0.5                  # snapshot kết nối dùng chung trong một lượt render
+SERVE_HOST: str = "127.0.0.1"               # địa chỉ bind mặc định cho --serve
+METRIC_PREFIX: str = "httpmon"
+REPLAY_DAYS: float = 7.0                   # --replay: bỏ qua file log cũ hơn số ngày này
+REPLAY_BLOCK_SIZE: int = 8 * 1024 * 1024   # khối đã giải nén mỗi lần đọc
+REPLAY_RUN_KEYS: int = 200000              # số (domain, giây) giữ trong RAM trước khi ghi run ra đĩa
+REPLAY_MERGE_FANIN: int = 256              # số run trộn cùng lúc (giới hạn file mở)
+SELF_STAGES: Tuple[str, ...] = ("tail", "extract", "net", "discover", "render")  # stage đo bởi --self-stats
+STAGE_TAIL, STAGE_EXTRACT, STAGE_NET, STAGE_DISCOVER, STAGE_RENDER = range(len(SELF_STAGES))
+WORKER_STAGES: Tuple[int, ...] = (STAGE_TAIL, STAGE_EXTRACT)  # stage worker --workers đo và gửi về
+SAMPLE_ABOVE_LINES: int = 0                # --sample-above: 0 = luôn đếm đủ mọi dòng
+SAMPLE_LINES: int = 2000                   # số dòng mẫu tối đa mỗi khối khi lấy mẫu
+SAMPLE_STRIDE: int = 8                     # khối nhỏ hơn: parse 1/SAMPLE_STRIDE số dòng
+SAMPLE_WINDOWS: int = 16                   # số đoạn dòng liên tiếp của mẫu trong một khối binary
+PROFILE_OUT: str = "monitor.prof"          # file pstats của --profile
+PROFILE_TOP: int = 30                      # số hàm in ra sau --profile
 
 # ======= Pre-compiled Patterns =======
 # Patterns để tìm file log access
@@ -226,6 +331,77 @@ LOG_LINE_DOMAIN_PATTERNS: Tuple[re.Pattern, ...] = (
     re.compile(r'^([A-Za-z0-9][-A-Za-z0-9.]*\.[A-Za-z]{2,})\s*[-–]\s*\d'),
 )
 
+# Các regex trên gộp thành một regex duy nhất (một group) cho mỗi loại file, dùng bởi DomainExtractor.
+# Bản "\\n" + pattern quét cả khối dòng bằng findall; bản không tiền tố match dòng đầu khối.
+_LOG_LINE_DOMAIN: str = (
+    r'([A-Za-z0-9][-A-Za-z0-9.]*\.[A-Za-z]{2,})(?:[ \t]+\d|[ \t]*[-–][ \t]*\d)'
+)
+_APACHE_VHOST_LINE_DOMAIN: str = (
+    r'[ \t]*([A-Za-z0-9.\-]+\.[A-Za-z]{2,})(?:(?=[\s:])|[ \t]*[-–][ \t]*\d)'
+)
+LOG_LINE_DOMAIN_RE: Tuple[re.Pattern, re.Pattern] = (
+    re.compile(_LOG_LINE_DOMAIN),
+    re.compile("\n" + _LOG_LINE_DOMAIN),
+)
+APACHE_VHOST_LINE_DOMAIN_MERGED_RE: Tuple[re.Pattern, re.Pattern] = (
+    re.compile(_APACHE_VHOST_LINE_DOMAIN),
+    re.compile("\n" + _APACHE_VHOST_LINE_DOMAIN),
+)
+
+# Bản bytes cho TailFile binary mode. findall không tạo match object cho từng dòng; tiền tố literal
+# b"\\n" nhanh hơn nhiều so với "^" + MULTILINE. Dùng [ \t] thay cho \s để không vượt qua ranh giới dòng.
+_LOG_LINE_DOMAIN_B: bytes = (
+    rb'([A-Za-z0-9][-A-Za-z0-9.]*\.[A-Za-z]{2,})(?:[ \t]+\d|[ \t]*(?:-|\xe2\x80\x93)[ \t]*\d)'
+)
+_APACHE_VHOST_LINE_DOMAIN_B: bytes = (
+    rb'[ \t]*([A-Za-z0-9.\-]+\.[A-Za-z]{2,})(?:(?=[\s:])|[ \t]*(?:-|\xe2\x80\x93)[ \t]*\d)'
+)
+LOG_LINE_DOMAIN_RE_B: Tuple[re.Pattern, re.Pattern] = (
+    re.compile(_LOG_LINE_DOMAIN_B),
+    re.compile(rb"\n" + _LOG_LINE_DOMAIN_B),
+)
+APACHE_VHOST_LINE_DOMAIN_RE_B: Tuple[re.Pattern, re.Pattern] = (
+    re.compile(_APACHE_VHOST_LINE_DOMAIN_B),
+    re.compile(rb"\n" + _APACHE_VHOST_LINE_DOMAIN_B),
+)
+
+# Trường bổ sung lấy từ mỗi dòng log (bitmask cho DomainExtractor / read_tail)
+FIELD_TIME: int = 1      # --by-timestamp: khóa counts là (domain, giây epoch ghi trong dòng)
+FIELD_IP: int = 2        # --log-ips: thêm IP client vào cuối khóa, (domain, ip) / (domain, giây, ip)
+
+# Domain đầu dòng (cùng điều kiện như hai regex trên, viết bằng lookahead) rồi bỏ qua phần phân cách,
+# để IP client ngay sau đó (format combined: IP là trường đầu; vhost: trường sau domain[:port]).
+_LOG_LINE_PREFIX: str = (
+    r'([A-Za-z0-9][-A-Za-z0-9.]*\.[A-Za-z]{2,})(?=[ \t]+\d|[ \t]*[-–][ \t]*\d)[ \t]*(?:[-–][ \t]*)?'
+)
+_APACHE_VHOST_LINE_PREFIX: str = (
+    r'[ \t]*([A-Za-z0-9.\-]+\.[A-Za-z]{2,})(?=[\s:]|[ \t]*[-–][ \t]*\d)(?::\d+)?[ \t]*(?:[-–][ \t]*)?'
+)
+_LOG_IP: str = r'((?:\d{1,3}\.){3}\d{1,3}|[0-9A-Fa-f]{0,4}:[0-9A-Fa-f:.]+)(?=\s)'
+_LOG_TIME: str = r'\[(\d\d/[A-Za-z]{3}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4})\]'
+
+
+@lru_cache(maxsize=None)
+def line_fields_re(apache_vhosts: bool, binary: bool, fields: int) -> Tuple[re.Pattern, re.Pattern]:
+    """
+    Per-line regex pair (head, "\\n"-prefixed) for DomainExtractor field modes.
+    Mọi phần đều tùy chọn nên findall trả đúng một tuple (domain, [ip], [timestamp]) cho mỗi dòng.
+    """
+    pattern = "(?:" + (_APACHE_VHOST_LINE_PREFIX if apache_vhosts else _LOG_LINE_PREFIX) + ")?"
+    if fields & FIELD_IP:
+        pattern += "(?:" + _LOG_IP + ")?"
+    if fields & FIELD_TIME:
+        pattern += r"(?:[^\n]*?" + _LOG_TIME + ")?"
+    if binary:
+        pattern_b = pattern.replace("[-–]", r"(?:-|\xe2\x80\x93)").encode("ascii")
+        return re.compile(pattern_b), re.compile(b"\n" + pattern_b)
+    return re.compile(pattern), re.compile("\n" + pattern)
+
+_MONTHS: Dict[str, int] = {
+    m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)
+}
+
 # TCP connection states mapping
 TCP_STATES: Dict[str, str] = {
     "01": "ESTABLISHED",
@@ -258,6 +434,34 @@ class IPCount:
     count: int
 
 
+TOP_IP_LABELS: Tuple[str, str, str] = ("Top IP :80", "Top IP :443", "Top IP ESTABLISHED")
+
+
+@dataclass
+class ConnSnapshot:
+    """
+    One capture of the TCP tables, shared by every view of a render tick.
+    ip_* là dict {ip_key: count} (IP dạng số nguyên), None nếu snapshot không gom theo IP.
+    """
+    stats: ConnectionStats
+    ip_80: Optional[Dict[int, int]] = None
+    ip_443: Optional[Dict[int, int]] = None
+    ip_established: Optional[Dict[int, int]] = None
+    taken_at: float = field(default_factory=time.monotonic)
+
+    def top_ips(self, threshold: int = 5, limit: int = 5) -> Dict[str, List[IPCount]]:
+        """Top IPs by connection count, formatting only the IPs shown."""
+        result: Dict[str, List[IPCount]] = {label: [] for label in TOP_IP_LABELS}
+        for label, counts in zip(TOP_IP_LABELS, (self.ip_80, self.ip_443, self.ip_established)):
+            if not counts:
+                continue
+            # Top-K bằng heap (O(n log k)), không sort toàn bộ bảng IP
+            for ip_key, count in heapq.nlargest(limit, counts.items(), key=itemgetter(1)):
+                if count > threshold:
+                    result[label].append(IPCount(ip=format_ip_key(ip_key), count=count))
+        return result
+
+
 def parse_args() -> argparse.Namespace:
     """Parse command line arguments."""
     p = argparse.ArgumentParser(
@@ -265,13 +469,53 @@ def parse_args() -> argparse.Namespace:
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     p.add_argument("--dir", action="append", help="Thêm thư mục log (có thể lặp)")
-    p.add_argument("--interval", type=float, default=INTERVAL_SEC, help="Khoảng đo RPS (giây)")
+    p.add_argument("--interval", type=float, default=INTERVAL_SEC, help="Chu kỳ làm mới màn hình (giây), độc lập với cửa sổ RPS 1s/10s/60s")
+    p.add_argument("--net-interval", type=float, default=NET_INTERVAL_SEC,
+                   help="Chu kỳ lấy mẫu bảng kết nối (giây), độc lập với chu kỳ làm mới và đọc log")
     p.add_argument("--rediscover", type=float, default=REDISCOVER_SEC, help="Chu kỳ tái khám phá log (giây)")
     p.add_argument("--start-at-begin", action="store_true", help="Đọc từ đầu file thay vì từ cuối")
     p.add_argument("--show-zero", action="store_true", help="Hiển thị cả domain RPS=0")
     p.add_argument("--no-domains", action="store_true", help="Tắt bảng RPS theo miền")
     p.add_argument("--topip", nargs="?", const=5, type=int, help="Hiện Top IP; tùy chọn truyền ngưỡng (vd: --topip 20)")
+    p.add_argument("--topip-max-ips", type=int, default=TOPIP_MAX_IPS,
+                   help="Giới hạn số IP theo dõi cho Top IP (Space-Saving, 0 = đếm chính xác)")
+    p.add_argument("--log-ips", action="store_true",
+                   help="Đếm req/s theo IP client (và theo domain + IP) từ dòng log, hiện cạnh bảng Top IP kết nối "
+                        "(với --by-timestamp tính theo giây ghi trong log)")
+    p.add_argument("--log-ip-max", type=int, default=LOG_IP_CAPACITY,
+                   help=f"Số IP giữ lại cho --log-ips (Space-Saving, mặc định {LOG_IP_CAPACITY})")
     p.add_argument("--logfile", action="store_true", help="In danh sách file log đang theo dõi")
+    p.add_argument("--no-inotify", action="store_true", help="Tắt inotify, dùng vòng lặp poll")
+    p.add_argument("--binary", action="store_true", help="Đọc log dạng bytes theo chunk (nhanh hơn khi lưu lượng lớn)")
+    p.add_argument("--max-read-mb", type=float, default=READ_BUDGET_BYTES / (1024 * 1024),
+                   help="Ngân sách đọc mỗi file mỗi lượt (MB, 0 = không giới hạn)")
+    p.add_argument("--max-read-lines", type=int, default=READ_BUDGET_LINES,
+                   help="Ngân sách số dòng mỗi file mỗi lượt (0 = không giới hạn)")
+    p.add_argument("--net-backend", choices=("auto", "netlink", "proc", "ss"), default="auto",
+                   help="Nguồn thống kê kết nối (mặc định auto: netlink -> /proc -> ss)")
+    p.add_argument("--max-open", type=int, default=MAX_OPEN_TAILS,
+                   help="Số file log mở cùng lúc tối đa (0 = tự động, nửa ulimit -n); file ít hoạt động bị đóng theo LRU")
+    p.add_argument("--state", metavar="FILE",
+                   help="File trạng thái offset: ghi định kỳ, khởi động lại thì đọc tiếp từ vị trí cũ")
+    p.add_argument("--by-timestamp", action="store_true",
+                   help="Đếm request theo timestamp [dd/Mon/yyyy:HH:MM:SS +zone] trong dòng log thay vì thời điểm đọc")
+    p.add_argument("--workers", type=int, default=0,
+                   help="Số process đọc log song song (chia shard file log, mặc định 0 = đọc trong process chính; --replay: 0 = số CPU)")
+    p.add_argument("--replay", metavar="CSV",
+                   help="Chế độ batch: đọc log cũ (.1, .gz, .bz2, .xz, đuôi ngày) và ghi chuỗi request theo giây, theo domain ra CSV")
+    p.add_argument("--replay-days", type=float, default=REPLAY_DAYS,
+                   help=f"--replay: bỏ qua file không ghi trong số ngày này (mặc định {REPLAY_DAYS:g})")
+    p.add_argument("--serve", type=int, metavar="PORT",
+                   help="Chế độ headless: không in màn hình, phục vụ /metrics (Prometheus) và /json qua HTTP")
+    p.add_argument("--bind", default=SERVE_HOST,
+                   help=f"Địa chỉ lắng nghe cho --serve (mặc định {SERVE_HOST})")
+    p.add_argument("--sample-above", type=int, default=SAMPLE_ABOVE_LINES, metavar="LINES",
+                   help="Quá LINES dòng/giây một file: tổng dòng vẫn đếm đủ, domain chỉ lấy từ mẫu dòng và nhân lên "
+                        "(RPS đánh dấu ~); 0 = tắt")
+    p.add_argument("--self-stats", action="store_true",
+                   help="Hiện chi phí của chính monitor: thời gian mỗi stage, dòng/s, byte/s, FD mở, RSS, CPU")
+    p.add_argument("--profile", type=int, metavar="TICKS",
+                   help=f"Chạy cProfile trong TICKS lượt làm mới rồi thoát, ghi {PROFILE_OUT} và in top {PROFILE_TOP} hàm")
     return p.parse_args()
 
 
@@ -281,102 +525,308 @@ def is_excluded(path: str) -> bool:
     return any(pattern.search(normalized) for pattern in _EXCLUDE_PATTERNS)
 
 
+# Một regex cho mọi INCLUDE_GLOBS (thay vì glob từng pattern, mỗi lần liệt kê lại thư mục)
+INCLUDE_RE: re.Pattern = re.compile("|".join(fnmatch.translate(p) for p in INCLUDE_GLOBS))
+LOG_MAX_AGE_SEC: int = 86400               # bỏ qua file log không ghi quá 24h
+DIR_MTIME_SETTLE_SEC: float = 2.0          # mtime thư mục quá mới -> liệt kê lại lần sau (fs mtime thô)
+
+
+def log_key(path: str) -> str:
+    """Build the tail key ("domain:abs_path") for a discovered log file."""
+    base = os.path.basename(path)
+    abs_path = os.path.abspath(path)
+
+    # Determine domain/key from filename
+    if base.startswith("other_vhosts_access.log"):
+        return f"__apache_vhosts__:{abs_path}"
+
+    # Try to extract domain from filename
+    m = FILENAME_DOMAIN_RE.match(base)
+    if m:
+        name = m.group("name")
+    else:
+        # Fallback: try to get domain from parent directory
+        parent = os.path.basename(os.path.dirname(path))
+        if parent and '.' in parent and len(parent) > 3:
+            name = parent
+        else:
+            name = base.replace('.log', '').replace('_log', '').replace('-log', '')
+    return f"{name}:{abs_path}"
+
+
+class _DirListing:
+    """One os.scandir of a directory: subdirectories and matching log files [path, key, mtime]."""
+
+    __slots__ = ('mtime_ns', 'settled', 'subdirs', 'logs')
+
+    def __init__(self, mtime_ns: int, settled: bool, subdirs: List[str], logs: List[list]):
+        self.mtime_ns = mtime_ns
+        self.settled = settled
+        self.subdirs = subdirs
+        self.logs = logs
+
+
+class DiscoveryIndex:
+    """
+    Cached log discovery.
+    Mỗi thư mục chỉ được os.scandir một lần và chỉ liệt kê lại khi mtime của nó đổi;
+    wildcard (/home/*/domains/*/logs) cũng được mở rộng từ cache này.
+    """
+
+    __slots__ = ('_dirs', '_seen', 'scans')
+
+    def __init__(self):
+        self._dirs: Dict[str, _DirListing] = {}
+        self._seen: Set[str] = set()
+        self.scans = 0                      # số lần scandir thật (để đo)
+
+    def _listing(self, d: str) -> Optional[_DirListing]:
+        """Return the cached listing of d, re-scanning only if its mtime changed."""
+        self._seen.add(d)
+        try:
+            mtime_ns = os.stat(d).st_mtime_ns
+        except OSError:
+            self._dirs.pop(d, None)
+            return None
+        cached = self._dirs.get(d)
+        if cached is not None and cached.settled and cached.mtime_ns == mtime_ns:
+            return cached
+
+        subdirs: List[str] = []
+        logs: List[list] = []
+        include = INCLUDE_RE.match
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    name = entry.name
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(name)
+                            continue
+                        # glob không khớp file ẩn với "*"
+                        if name.startswith(".") or not include(name) or not entry.is_file():
+                            continue
+                        path = os.path.join(d, name)
+                        if is_excluded(path):
+                            continue
+                        logs.append([path, log_key(path), entry.stat().st_mtime])
+                    except OSError:
+                        continue
+        except OSError:
+            # Skip directories we can't access
+            self._dirs.pop(d, None)
+            return None
+        self.scans += 1
+        settled = time.time() - mtime_ns / 1e9 > DIR_MTIME_SETTLE_SEC
+        listing = self._dirs[d] = _DirListing(mtime_ns, settled, subdirs, logs)
+        return listing
+
+    def expand(self, pattern: str) -> List[str]:
+        """
+        Expand a directory pattern with wildcards (glob semantics for directories).
+        Thành phần không có wildcard ở cuối không được kiểm tra tồn tại.
+        """
+        if not any(c in pattern for c in "*?["):
+            return [pattern]
+        parts = pattern.split("/")
+        current = ["/"] if pattern.startswith("/") else [""]
+        if pattern.startswith("/"):
+            parts = parts[1:]
+        for part in parts:
+            if not part:
+                continue
+            if not any(c in part for c in "*?["):
+                current = [os.path.join(c, part) for c in current]
+                continue
+            matched = []
+            for c in current:
+                listing = self._listing(c or ".")
+                if listing is None:
+                    continue
+                for name in fnmatch.filter(listing.subdirs, part):
+                    if name.startswith(".") and not part.startswith("."):
+                        continue
+                    matched.append(os.path.join(c, name))
+            current = matched
+        return current
+
+    def discover(self, dir_list: List[str]) -> Dict[str, str]:
+        """Discover log files in dir_list (same result as a full glob scan)."""
+        self._seen = set()
+        found: Dict[str, str] = {}
+        now = time.time()
+        for d in dict.fromkeys(d for pattern in dir_list for d in self.expand(pattern)):
+            listing = self._listing(d)
+            if listing is None:
+                continue
+            for item in listing.logs:
+                path, key, mtime = item
+                if now - mtime > LOG_MAX_AGE_SEC:
+                    # Ghi file không đổi mtime thư mục -> stat lại file từng bị coi là cũ
+                    try:
+                        mtime = item[2] = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    if now - mtime > LOG_MAX_AGE_SEC:
+                        continue
+                # Cùng file (cùng key) thấy qua nhiều thư mục -> giữ đường dẫn đầu tiên
+                found.setdefault(key, path)
+        # Bỏ cache của thư mục không còn nằm trong cây cần quét
+        for d in list(self._dirs):
+            if d not in self._seen:
+                del self._dirs[d]
+        return found
+
+
 def expand_directory_globs(dir_list: List[str]) -> List[str]:
     """
     Expand directory paths containing wildcards.
     Ví dụ: /home/*/logs -> /home/user1/logs, /home/user2/logs, ...
     """
+    index = DiscoveryIndex()
     expanded = []
     for d in dir_list:
         if '*' in d:
-            # Expand glob pattern
-            matches = glob.glob(d)
-            for match in matches:
-                if os.path.isdir(match):
-                    expanded.append(match)
+            expanded.extend(match for match in index.expand(d) if os.path.isdir(match))
         else:
             expanded.append(d)
     return list(dict.fromkeys(expanded))  # Remove duplicates while preserving order
 
 
-def discover_logs(dir_list: List[str]) -> Dict[str, str]:
+def discover_logs(dir_list: List[str], index: Optional[DiscoveryIndex] = None) -> Dict[str, str]:
     """
     Discover log files in given directories.
     Hỗ trợ tất cả control panels và webservers phổ biến.
+    Truyền index (DiscoveryIndex) để các lần tái khám phá chỉ quét lại thư mục có thay đổi.
     """
-    found: Dict[str, str] = {}
+    if index is None:
+        index = DiscoveryIndex()
+    return index.discover(dir_list)
 
-    # Expand any glob patterns in directory paths
-    expanded_dirs = expand_directory_globs(dir_list)
 
-    for d in expanded_dirs:
-        if not os.path.isdir(d):
-            continue
+class BackgroundDiscovery:
+    """
+    Rediscover logs every `period` seconds as an asyncio task (quét thư mục chạy trong executor).
+    Kết quả mới được công bố nguyên khối và task đọc log lấy bằng take() giữa hai bước đọc,
+    nên quét thư mục không bao giờ chặn vòng đếm.
+    """
 
-        for pat in INCLUDE_GLOBS:
+    def __init__(self, dir_list: List[str], period: float, index: Optional[DiscoveryIndex] = None):
+        self.dir_list = dir_list
+        self.period = period
+        self.index = index if index is not None else DiscoveryIndex()
+        self.duration = 0.0                 # thời gian lần khám phá gần nhất (giây)
+        self.count = 0                      # số file log của lần gần nhất
+        self._published: Optional[Dict[str, str]] = None
+
+    def discover_now(self) -> Dict[str, str]:
+        """Run one discovery pass in the calling thread and record its duration."""
+        t0 = time.perf_counter_ns()
+        logs = discover_logs(self.dir_list, self.index)
+        elapsed = time.perf_counter_ns() - t0
+        SELF_STATS.add(STAGE_DISCOVER, elapsed)
+        self.duration = elapsed / 1e9
+        self.count = len(logs)
+        return logs
+
+    async def run(self, executor: Optional[ThreadPoolExecutor] = None) -> None:
+        """Discovery task: one pass per period, published for take()."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.period)
             try:
-                for path in glob.glob(os.path.join(d, pat)):
-                    if not os.path.isfile(path) or is_excluded(path):
-                        continue
-
-                    # Skip files that are too old (> 1 day since last modified)
-                    try:
-                        mtime = os.path.getmtime(path)
-                        if time.time() - mtime > 86400:  # 24 hours
-                            continue
-                    except OSError:
-                        continue
-
-                    base = os.path.basename(path)
-                    abs_path = os.path.abspath(path)
-
-                    # Determine domain/key from filename
-                    if base.startswith("other_vhosts_access.log"):
-                        key = f"__apache_vhosts__:{abs_path}"
-                    else:
-                        # Try to extract domain from filename
-                        m = FILENAME_DOMAIN_RE.match(base)
-                        if m:
-                            name = m.group("name")
-                        else:
-                            # Fallback: try to get domain from parent directory
-                            parent = os.path.basename(os.path.dirname(path))
-                            if parent and '.' in parent and len(parent) > 3:
-                                name = parent
-                            else:
-                                name = base.replace('.log', '').replace('_log', '').replace('-log', '')
-
-                        key = f"{name}:{abs_path}"
-
-                    # Keep the most recently modified file for each domain
-                    old = found.get(key)
-                    if not old:
-                        found[key] = path
-                    else:
-                        try:
-                            if os.path.getmtime(path) > os.path.getmtime(old):
-                                found[key] = path
-                        except OSError:
-                            pass
-            except (OSError, PermissionError):
-                # Skip directories we can't access
+                self._published = await loop.run_in_executor(executor, self.discover_now)
+            except Exception:
                 continue
 
-    return found
+    def take(self) -> Optional[Dict[str, str]]:
+        """Return the latest published log set once (None if nothing new)."""
+        logs, self._published = self._published, None
+        return logs
 
 
 class TailFile:
-    """Efficient file tailer with rotation detection."""
+    """
+    Efficient file tailer with rotation detection.
+    binary=True: đọc chunk lớn vào bytearray tái sử dụng (readblock), không decode từng dòng.
+    Text mode với backlog lớn (--start-at-begin, đọc bù sau khi chậm) đọc theo chunk qua mmap (readmapped).
+    suspend() đóng file descriptor nhưng giữ inode + offset; lần đọc sau tự mở lại nếu file có dữ liệu mới.
+    """
 
-    __slots__ = ('path', '_file', '_inode')
+    __slots__ = ('path', '_file', '_inode', 'binary', '_buf', '_view', '_fill', '_end', '_offset', 'extractor')
 
-    def __init__(self, path: str, start_at_end: bool = True):
+    def __init__(self, path: str, start_at_end: bool = True, binary: bool = False,
+                 resume: Optional[Tuple[int, int]] = None):
         self.path = path
-        self._file = open(path, "r", encoding="utf-8", errors="replace")
+        self.binary = binary
+        self.extractor: Optional[DomainExtractor] = None
+        self._buf = bytearray(READ_CHUNK_SIZE if binary else 0)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+        self._end = 0
+        self._offset = 0
+        self._file = self._open()
         self._inode = self._get_inode()
-        if start_at_end:
+        if resume is not None:
+            self._resume_from(*resume)
+        elif start_at_end:
             self._file.seek(0, os.SEEK_END)
 
+    def _open(self, path: Optional[str] = None):
+        """Open file (mặc định self.path) in the configured mode."""
+        if self.binary:
+            return open(path or self.path, "rb", buffering=0)
+        return open(path or self.path, "r", encoding="utf-8", errors="replace")
+
+    def _find_rotated(self, inode: int) -> Optional[str]:
+        """Find the rotated copy of path (path.1, path-20240101, ...) that still has inode."""
+        candidates = [self.path + ".1"]
+        d, base = os.path.split(self.path)
+        try:
+            candidates += [os.path.join(d, n) for n in sorted(os.listdir(d or "."))
+                           if n.startswith(base) and n != base and n != base + ".1"]
+        except OSError:
+            pass
+        for candidate in candidates:
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _resume_from(self, inode: int, offset: int) -> None:
+        """
+        Continue from a checkpoint (inode, offset) taken before a restart.
+        Cùng inode -> seek tới offset (truncate -> từ đầu). Đã rotate trong lúc dừng -> đọc nốt
+        file cũ (path.1) từ offset trước, _reopen_if_rotated sẽ chuyển sang file mới (từ đầu) khi hết.
+        """
+        if self._inode == inode:
+            if os.fstat(self._file.fileno()).st_size >= offset:
+                self._file.seek(offset)
+            return
+        rotated = self._find_rotated(inode)
+        if rotated is None:
+            return
+        try:
+            f = self._open(rotated)
+            if os.fstat(f.fileno()).st_size >= offset:
+                f.seek(offset)
+        except OSError:
+            return
+        self._close_safe()
+        self._file = f
+        self._inode = inode
+
+    def checkpoint(self) -> Tuple[int, int]:
+        """(inode, offset) of the next unread byte, for the state file."""
+        if self._file is not None:
+            try:
+                return self._inode, self._position()
+            except (OSError, ValueError):
+                pass
+        return self._inode, self._offset
+
     def _get_inode(self) -> int:
         """Get file inode."""
         return os.fstat(self._file.fileno()).st_ino
@@ -390,23 +840,214 @@ class TailFile:
 
         current_inode = getattr(st, "st_ino", None)
         if current_inode and current_inode != self._inode:
+            try:
+                if os.fstat(self._file.fileno()).st_size > self._file.tell():
+                    # File cũ (đã rotate) còn dữ liệu chưa đọc -> đọc nốt rồi mới chuyển
+                    return
+            except (OSError, ValueError):
+                pass
             self._close_safe()
-            self._file = open(self.path, "r", encoding="utf-8", errors="replace")
+            self._file = self._open()
             self._inode = self._get_inode()
+            self._fill = self._end = 0
         elif st.st_size < self._file.tell():
             self._file.seek(0)
+            self._fill = self._end = 0
 
     def _close_safe(self) -> None:
         """Safely close file handle."""
+        if self._file is None:
+            return
         try:
             self._file.close()
         except Exception:
             pass
 
-    def readlines(self) -> List[str]:
-        """Read new lines from file."""
-        self._reopen_if_rotated()
-        return self._file.readlines()
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def _position(self) -> int:
+        """Offset of the first byte not consumed yet (dòng dở trong buffer chưa tính)."""
+        return self._file.tell() - (self._fill - self._end)
+
+    def suspend(self) -> None:
+        """Close the descriptor, remembering inode and offset so resume() continues from there."""
+        if self._file is None:
+            return
+        try:
+            self._offset = self._position()
+        except (OSError, ValueError):
+            pass
+        self._close_safe()
+        self._file = None
+        self._fill = self._end = 0
+        if self.binary:
+            # Không giữ buffer 1MB cho file đang đóng
+            self._view.release()
+            self._buf = bytearray(0)
+            self._view = memoryview(self._buf)
+
+    def resume(self) -> bool:
+        """
+        Reopen a suspended tail; False (không mở) nếu file không đổi từ lúc suspend().
+        Cùng inode -> đọc tiếp từ offset đã lưu; rotate khi đang đóng -> đọc nốt file cũ trước;
+        file mới hoặc bị truncate -> từ đầu.
+        """
+        try:
+            st = os.stat(self.path)
+            if st.st_ino == self._inode and st.st_size == self._offset:
+                return False
+            path = self.path
+            if st.st_ino != self._inode:
+                # Rotate khi đang đóng: đọc nốt file cũ nếu còn dữ liệu
+                rotated = self._find_rotated(self._inode)
+                if rotated is not None and os.stat(rotated).st_size > self._offset:
+                    path = rotated
+            f = self._open(path)
+        except OSError:
+            return False
+        try:
+            st = os.fstat(f.fileno())
+            if st.st_ino == self._inode and st.st_size >= self._offset:
+                f.seek(self._offset)
+        except (OSError, ValueError):
+            f.close()
+            return False
+        self._file = f
+        self._inode = st.st_ino
+        if self.binary:
+            self._buf = bytearray(READ_CHUNK_SIZE)
+            self._view = memoryview(self._buf)
+        return True
+
+    def readlines(self, check_rotation: bool = True, hint: int = -1) -> List[str]:
+        """
+        Read new lines from file.
+        check_rotation=False bỏ qua os.stat() (dùng khi inotify đã báo thay đổi).
+        hint > 0: dừng sau khoảng hint ký tự/bytes (như io.IOBase.readlines).
+        """
+        if self.binary:
+            lines: List[str] = []
+            size = 0
+            while hint <= 0 or size < hint:
+                buf, end = self.readblock(check_rotation)
+                check_rotation = False
+                if not end:
+                    break
+                lines.extend(buf[:end].decode("utf-8", "replace").splitlines(True))
+                size += end
+            return lines
+        if self._file is None and not self.resume():
+            return []
+        if check_rotation:
+            self._reopen_if_rotated()
+        if hint <= 0:
+            return self._file.readlines()
+        # readlines(hint) lặp bằng next() làm tell() bị khóa -> dùng read() + readline()
+        data = self._file.read(hint)
+        if data and data[-1] != "\n":
+            data += self._file.readline()
+        return data.splitlines(True)
+
+    def readblock(self, check_rotation: bool = True) -> Tuple[bytearray, int]:
+        """
+        Binary mode: read one chunk, returns (buffer, end) where buffer[:end] holds only
+        complete lines. Dòng dở dang cuối chunk được giữ lại cho lần đọc sau.
+        Buffer được tái sử dụng: chỉ hợp lệ tới lần gọi kế tiếp. end == 0 nghĩa là hết dữ liệu.
+        """
+        if self._file is None and not self.resume():
+            return self._buf, 0
+        if check_rotation:
+            self._reopen_if_rotated()
+
+        buf = self._buf
+        # Move carried-over partial line (từ lần đọc trước) lên đầu buffer
+        rem = self._fill - self._end
+        if rem and self._end:
+            buf[0:rem] = self._view[self._end:self._fill]
+        self._fill = rem
+        self._end = 0
+
+        while True:
+            if self._fill == len(buf):
+                # Dòng dài hơn buffer -> nới rộng
+                self._view.release()
+                buf.extend(bytes(len(buf)))
+                self._view = memoryview(buf)
+
+            n = self._file.readinto(self._view[self._fill:])
+            if not n:
+                return buf, 0
+            self._fill += n
+            end = buf.rfind(b"\n", 0, self._fill) + 1
+            if end or self._fill < len(buf):
+                self._end = end
+                return buf, end
+
+    def readmapped(self, check_rotation: bool = True, min_backlog: Optional[int] = None) -> Tuple[bytearray, int]:
+        """
+        Text mode catch-up: while the unread backlog is at least MMAP_CATCHUP_BYTES, copy the next
+        chunk of complete lines from an mmap of the file into a reused buffer (như readblock).
+        Không qua decoder và không tạo str cho từng dòng; map chỉ phủ chunk đang đọc và được đóng ngay
+        nên RSS không tăng theo kích thước file. end == 0: backlog nhỏ, đọc tiếp bằng readlines().
+        min_backlog: ngưỡng backlog thay cho MMAP_CATCHUP_BYTES (--sample-above khi file đang bị flood
+        dùng 1: mọi dữ liệu mới đi qua bytes, buffer được giữ lại giữa các lượt; phần mới nhỏ hơn một
+        chunk được đọc bằng os.preadv thay vì mmap).
+        """
+        if self.binary or self._file is None:
+            return self._buf, 0
+        if check_rotation:
+            self._reopen_if_rotated()
+        try:
+            fd = self._file.fileno()
+            pos = self._file.tell()
+            backlog = os.fstat(fd).st_size - pos
+        except (OSError, ValueError):
+            backlog = 0
+        if backlog < (MMAP_CATCHUP_BYTES if min_backlog is None else min_backlog):
+            if self._buf and min_backlog is None:
+                # Hết backlog: không giữ buffer 1MB cho tail text
+                self._view.release()
+                self._buf = bytearray(0)
+                self._view = memoryview(self._buf)
+            return self._buf, 0
+
+        if len(self._buf) < READ_CHUNK_SIZE:
+            self._view.release()
+            self._buf = bytearray(READ_CHUNK_SIZE)
+            self._view = memoryview(self._buf)
+        try:
+            if backlog < READ_CHUNK_SIZE:
+                # Phần mới nhỏ hơn một chunk (đang flood): một preadv rẻ hơn mmap + munmap
+                n = os.preadv(fd, [self._view[:backlog]], pos)
+                end = self._buf.rfind(b"\n", 0, n) + 1
+            else:
+                skip = pos % mmap.ALLOCATIONGRANULARITY
+                with mmap.mmap(fd, skip + READ_CHUNK_SIZE, access=mmap.ACCESS_READ, offset=pos - skip) as mm:
+                    end = mm.rfind(b"\n", skip) + 1 - skip
+                    if end > 0:
+                        with memoryview(mm) as view:
+                            self._view[:end] = view[skip:skip + end]
+        except (OSError, ValueError):
+            return self._buf, 0
+        if end <= 0:
+            # Dòng dài hơn một chunk: để readlines() xử lý
+            return self._buf, 0
+        self._file.seek(pos + end)
+        return self._buf, end
+
+    def lag_bytes(self) -> int:
+        """Bytes written to the file but not yet consumed (fstat, không stat theo path)."""
+        try:
+            if self._file is None:
+                st = os.stat(self.path)
+                return max(0, st.st_size - (self._offset if st.st_ino == self._inode else 0))
+            size = os.fstat(self._file.fileno()).st_size
+            pos = self._position()
+        except (OSError, ValueError):
+            return 0
+        return max(0, size - pos)
 
     def close(self) -> None:
         """Close file handle."""
@@ -419,209 +1060,809 @@ class TailFile:
         self.close()
 
 
-class NetworkMonitor:
+# ======= inotify (Linux) =======
+IN_MODIFY: int = 0x00000002
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE_SELF: int = 0x00000400
+IN_MOVE_SELF: int = 0x00000800
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_NONBLOCK: int = 0o00004000
+IN_CLOEXEC: int = 0o02000000
+
+_INOTIFY_FILE_MASK: int = IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF
+_INOTIFY_DIR_MASK: int = IN_CREATE | IN_MOVED_TO
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+_INOTIFY_READ_SIZE: int = 64 * 1024
+
+
+class InotifyWatcher:
     """
-    Network connection monitor using /proc/net for maximum compatibility.
-    Falls back to ss/netstat if /proc is not available.
+    Event-driven change notification for tailed logs using inotify via ctypes.
+    Theo dõi IN_MODIFY/IN_MOVE_SELF/IN_DELETE_SELF trên từng file và IN_CREATE/IN_MOVED_TO
+    trên thư mục cha để phát hiện rotate ngay lập tức (không cần chờ os.stat()).
     """
 
     def __init__(self):
-        self._use_proc = os.path.exists("/proc/net/tcp")
-        self._executor = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        self._key_wd: Dict[str, int] = {}
+        self._wd_keys: Dict[int, Set[str]] = defaultdict(set)
+        self._dir_wd: Dict[str, int] = {}
+        self._dir_names: Dict[int, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self._key_dir: Dict[str, Tuple[int, str]] = {}
 
     @staticmethod
-    def _hex_to_ip(hex_ip: str) -> str:
-        """Convert hex IP address to dotted decimal."""
+    def available() -> bool:
+        """Check whether inotify can be used on this system."""
+        if not sys.platform.startswith("linux"):
+            return False
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            return False
         try:
-            # Handle IPv4
-            if len(hex_ip) == 8:
-                return ".".join(str(int(hex_ip[i:i+2], 16)) for i in (6, 4, 2, 0))
-            # Handle IPv6 mapped IPv4
-            elif len(hex_ip) == 32 and hex_ip[:24] == "0000000000000000FFFF0000":
-                ipv4_hex = hex_ip[24:]
-                return ".".join(str(int(ipv4_hex[i:i+2], 16)) for i in (6, 4, 2, 0))
-            return hex_ip
-        except (ValueError, IndexError):
-            return hex_ip
-
-    @staticmethod
-    def _hex_to_port(hex_port: str) -> int:
-        """Convert hex port to integer."""
-        try:
-            return int(hex_port, 16)
-        except ValueError:
-            return 0
-
-    def _parse_proc_net(self, filepath: str) -> List[Tuple[str, int, str, int, str]]:
+            libc = ctypes.CDLL(libc_name)
+            return hasattr(libc, "inotify_init1")
+        except OSError:
+            return False
+
+    def _add_watch(self, path: str, mask: int) -> int:
+        """Add inotify watch, returns wd or -1."""
+        return self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+
+    def _rm_file_wd(self, key: str) -> None:
+        """Detach key from its file watch, removing the watch if unused."""
+        wd = self._key_wd.pop(key, None)
+        if wd is None:
+            return
+        keys = self._wd_keys.get(wd)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._wd_keys[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def watch(self, key: str, path: str) -> bool:
+        """
+        Watch a tailed file (and its directory for re-creation).
+        Gọi lại sau khi reopen để gắn watch vào inode mới. Trả về False nếu không watch được.
+        """
+        self._rm_file_wd(key)
+        old_dir = self._key_dir.pop(key, None)
+        if old_dir is not None:
+            self._dir_names[old_dir[0]][old_dir[1]].discard(key)
+
+        wd = self._add_watch(path, _INOTIFY_FILE_MASK)
+        if wd < 0:
+            return False
+        self._key_wd[key] = wd
+        self._wd_keys[wd].add(key)
+
+        parent = os.path.dirname(os.path.abspath(path))
+        dwd = self._dir_wd.get(parent)
+        if dwd is None:
+            dwd = self._add_watch(parent, _INOTIFY_DIR_MASK)
+            if dwd >= 0:
+                self._dir_wd[parent] = dwd
+        if dwd is not None and dwd >= 0:
+            base = os.path.basename(path)
+            self._dir_names[dwd][base].add(key)
+            self._key_dir[key] = (dwd, base)
+        return True
+
+    def unwatch(self, key: str) -> None:
+        """Stop watching a key."""
+        self._rm_file_wd(key)
+        old_dir = self._key_dir.pop(key, None)
+        if old_dir is not None:
+            self._dir_names[old_dir[0]][old_dir[1]].discard(key)
+
+    def is_watched(self, key: str) -> bool:
+        """Check whether key has an active file watch."""
+        return key in self._key_wd
+
+    def wait(self, timeout: float) -> Tuple[Set[str], Set[str]]:
         """
-        Parse /proc/net/tcp or /proc/net/tcp6.
-        Returns list of (local_ip, local_port, remote_ip, remote_port, state).
+        Wait up to timeout seconds for events.
+        Returns (modified_keys, rotated_keys). Khi queue tràn (IN_Q_OVERFLOW) mọi key được
+        coi là rotated để kiểm tra lại bằng stat.
         """
-        connections = []
+        modified: Set[str] = set()
+        rotated: Set[str] = set()
         try:
-            with open(filepath, "r") as f:
-                next(f)  # Skip header
-                for line in f:
-                    parts = line.split()
-                    if len(parts) < 4:
-                        continue
+            ready, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        except InterruptedError:
+            return modified, rotated
+        if not ready:
+            return modified, rotated
 
-                    local_addr = parts[1].split(":")
-                    remote_addr = parts[2].split(":")
-                    state = parts[3]
+        while True:
+            try:
+                buf = os.read(self._fd, _INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            pos = 0
+            size = _INOTIFY_EVENT.size
+            while pos + size <= len(buf):
+                wd, mask, _cookie, name_len = _INOTIFY_EVENT.unpack_from(buf, pos)
+                name = buf[pos + size:pos + size + name_len].rstrip(b"\0")
+                pos += size + name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    rotated.update(self._key_wd)
+                    continue
+                if mask & IN_IGNORED:
+                    # Watch bị kernel gỡ (file đã xóa) -> dọn mapping, kiểm tra lại key
+                    for key in self._wd_keys.pop(wd, ()):
+                        self._key_wd.pop(key, None)
+                        rotated.add(key)
+                    continue
+
+                keys = self._wd_keys.get(wd)
+                if keys:
+                    if mask & (IN_MOVE_SELF | IN_DELETE_SELF):
+                        rotated.update(keys)
+                    elif mask & IN_MODIFY:
+                        modified.update(keys)
+                    continue
 
-                    local_ip = self._hex_to_ip(local_addr[0])
-                    local_port = self._hex_to_port(local_addr[1])
-                    remote_ip = self._hex_to_ip(remote_addr[0])
-                    remote_port = self._hex_to_port(remote_addr[1])
-                    state_name = TCP_STATES.get(state, "UNKNOWN")
+                names = self._dir_names.get(wd)
+                if names and name and mask & (IN_CREATE | IN_MOVED_TO):
+                    rotated.update(names.get(os.fsdecode(name), ()))
+            if len(buf) < _INOTIFY_READ_SIZE:
+                break
 
-                    connections.append((local_ip, local_port, remote_ip, remote_port, state_name))
-        except (IOError, OSError, PermissionError):
+        return modified, rotated
+
+    def close(self) -> None:
+        """Close inotify descriptor."""
+        try:
+            os.close(self._fd)
+        except OSError:
             pass
 
-        return connections
 
-    def get_all_connections(self) -> List[Tuple[str, int, str, int, str]]:
-        """Get all TCP connections from /proc/net/tcp and tcp6."""
-        connections = []
+# ======= /proc/net/tcp parser =======
+# Mỗi dòng: "  sl: LOCAL_IP:PORT REMOTE_IP:PORT ST ..." (hex, IP là các word 32-bit little-endian).
+# Chỉ lấy phần độ rộng cố định sau "sl: " bằng một findall (tiền tố literal ": " chỉ xuất hiện sau sl).
+_PROC_NET_ROW_RE: Dict[bool, re.Pattern] = {
+    False: re.compile(rb": [0-9A-F]{8}:([0-9A-F]{4}) ([0-9A-F]{8}):([0-9A-F]{4}) ([0-9A-F]{2}) "),
+    True: re.compile(rb": [0-9A-F]{32}:([0-9A-F]{4}) ([0-9A-F]{32}):([0-9A-F]{4}) ([0-9A-F]{2}) "),
+}
+_V4_MAPPED_PREFIX: bytes = b"0000000000000000FFFF0000"
+_STATE_ESTABLISHED: int = 0x01
+_STATE_SYN_RECV: int = 0x03
+
+# IP được giữ dạng số nguyên, chỉ format khi hiển thị:
+# IPv4 (kể cả IPv4-mapped) = giá trị 32-bit như trong /proc, IPv6 = IP6_KEY_FLAG | giá trị 128-bit.
+IP6_KEY_FLAG: int = 1 << 128
+_SKIP_IP_KEYS: Set[int] = {
+    0,                                  # 0.0.0.0
+    0x0100007F,                         # 127.0.0.1
+    IP6_KEY_FLAG,                       # ::
+    IP6_KEY_FLAG | 0x01000000,          # ::1
+}
 
-        if self._use_proc:
-            # Read IPv4 and IPv6 connections in parallel
-            futures = []
-            for filepath in ("/proc/net/tcp", "/proc/net/tcp6"):
-                if os.path.exists(filepath):
-                    futures.append(self._executor.submit(self._parse_proc_net, filepath))
 
-            for future in as_completed(futures):
-                try:
-                    connections.extend(future.result())
-                except Exception:
-                    pass
+def proc_hex_ip_key(hex_ip: bytes) -> int:
+    """Convert a /proc/net hex address to an integer IP key."""
+    if len(hex_ip) == 8:
+        return int(hex_ip, 16)
+    if hex_ip[:24] == _V4_MAPPED_PREFIX:
+        return int(hex_ip[24:], 16)
+    return IP6_KEY_FLAG | int(hex_ip, 16)
 
-        return connections
 
-    def get_stats(self) -> ConnectionStats:
-        """Get connection statistics."""
-        stats = ConnectionStats()
+def format_ip_key(key: int) -> str:
+    """Format an integer IP key as dotted IPv4 or IPv6 text."""
+    if key < IP6_KEY_FLAG:
+        return socket.inet_ntoa(struct.pack("<I", key))
+    raw = (key ^ IP6_KEY_FLAG).to_bytes(16, "big")
+    return socket.inet_ntop(socket.AF_INET6, b"".join(raw[i:i + 4][::-1] for i in (0, 4, 8, 12)))
+
+
+class SpaceSaving(dict):
+    """
+    Space-Saving heavy-hitter counter: a dict capped at about 2 * capacity keys.
+    Khi đầy, chỉ giữ các key lớn nhất; key mới bắt đầu từ floor (số đếm lớn nhất có thể đã bị loại)
+    nên IP có số đếm thật > floor luôn còn trong bảng. lower_bounds() trừ sai số của từng key.
+    """
+
+    __slots__ = ('capacity', 'floor', 'errors')
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.capacity = capacity
+        self.floor = 0
+        self.errors: Dict = {}
+
+    def __missing__(self, key) -> int:
+        # Chỉ gọi cho key mới (c[key] += n), key đã có đi thẳng đường dict C
+        if len(self) >= 2 * self.capacity:
+            self.prune()
+        if self.floor:
+            self.errors[key] = self.floor
+        return self.floor
+
+    def prune(self) -> None:
+        """Keep only counts above the capacity-th largest (ties at the cut are dropped)."""
+        cut = sorted(self.values(), reverse=True)[self.capacity - 1]
+        keep = [(k, v) for k, v in self.items() if v > cut]
+        self.clear()
+        self.update(keep)
+        errors = self.errors
+        self.errors = {k: errors[k] for k, _v in keep if k in errors}
+        self.floor = max(self.floor, cut)
+
+    def lower_bounds(self) -> Dict:
+        """Guaranteed counts (estimate - error), dropping keys that may be zero."""
+        errors = self.errors
+        out = {}
+        for k, v in self.items():
+            v -= errors.get(k, 0)
+            if v > 0:
+                out[k] = v
+        return out
+
+
+def new_ip_counter(max_ips: int = 0) -> Dict:
+    """Per-address counter: exact defaultdict(int), or a SpaceSaving sketch when max_ips > 0."""
+    return SpaceSaving(max_ips) if max_ips > 0 else defaultdict(int)
+
+
+class ConnTable(ABC):
+    """
+    Parsed /proc/net/tcp{,6} table, aggregated without building a tuple per socket.
+    counts() -> (port_80, port_443, established, syn_recv);
+    ip_counts() -> 3 dict {ip_key: count} cho :80, :443, ESTABLISHED (đã bỏ IP local).
+    """
+
+    __slots__ = ('size',)
+
+    @abstractmethod
+    def counts(self) -> Tuple[int, int, int, int]:
+        """(port_80, port_443, established, syn_recv)."""
 
-        if self._use_proc:
-            connections = self.get_all_connections()
-            stats.source = "/proc"
-
-            for _, local_port, _, remote_port, state in connections:
-                # Count connections to port 80/443
-                if local_port == 80 or remote_port == 80:
-                    stats.port_80 += 1
-                if local_port == 443 or remote_port == 443:
-                    stats.port_443 += 1
-
-                # Count by state
-                if state == "ESTABLISHED":
-                    stats.established += 1
-                elif state == "SYN_RECV":
-                    stats.syn_recv += 1
+    @abstractmethod
+    def ip_counts(self) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+        """Per-IP counts for :80, :443 and ESTABLISHED (không gồm IP local)."""
+
+    def aggregate(self, max_ips: int = 0) -> Tuple[Tuple[int, int, int, int],
+                                                   Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]]:
+        """
+        counts() and ip_counts() together; subclasses do it in one pass over the table.
+        max_ips > 0: mỗi dict IP giữ tối đa khoảng max_ips IP lớn nhất (bộ nhớ cố định khi flood).
+        """
+        return self.counts(), self.ip_counts()
+
+
+def _ip_key_counts(counters, to_key) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+    """Convert per-raw-address counters to integer IP keys, dropping local IPs."""
+    # Chỉ đổi địa chỉ -> int cho từng IP duy nhất, không phải từng socket
+    keys: Dict[bytes, int] = {}
+    result = []
+    for counter in counters:
+        if isinstance(counter, SpaceSaving):
+            counter = counter.lower_bounds()
+        out: Dict[int, int] = {}
+        for rip, c in counter.items():
+            key = keys.get(rip)
+            if key is None:
+                key = keys[rip] = to_key(rip)
+            if key not in _SKIP_IP_KEYS:
+                out[key] = out.get(key, 0) + c
+        result.append(out)
+    return result[0], result[1], result[2]
+
+
+def _aggregate_rows(rows, port_80, port_443, st_est, st_syn, to_key, max_ips: int = 0):
+    """
+    One pass over (local_port, remote_ip, remote_port, state) rows.
+    Port/state có kiểu giống rows (hex bytes của /proc hoặc int của sock_diag).
+    """
+    p80 = p443 = est = syn = 0
+    c80 = new_ip_counter(max_ips)
+    c443 = new_ip_counter(max_ips)
+    cest = new_ip_counter(max_ips)
+    for lport, rip, rport, st in rows:
+        if lport == port_80 or rport == port_80:
+            p80 += 1
+            c80[rip] += 1
+        if lport == port_443 or rport == port_443:
+            p443 += 1
+            c443[rip] += 1
+        if st == st_est:
+            est += 1
+            cest[rip] += 1
+        elif st == st_syn:
+            syn += 1
+    return (p80, p443, est, syn), _ip_key_counts((c80, c443, cest), to_key)
+
+
+class _PyConnTable(ConnTable):
+    """Pure-Python table: rows là tuple hex (local_port, remote_ip, remote_port, state) từ findall."""
+
+    __slots__ = ('_rows',)
+
+    def __init__(self, rows: List[Tuple[bytes, bytes, bytes, bytes]]):
+        self._rows = rows
+        self.size = len(rows)
+
+    def counts(self) -> Tuple[int, int, int, int]:
+        p80 = p443 = est = syn = 0
+        for lport, _rip, rport, st in self._rows:
+            # So sánh trực tiếp chuỗi hex, không cần int(...,16)
+            if lport == b"0050" or rport == b"0050":
+                p80 += 1
+            if lport == b"01BB" or rport == b"01BB":
+                p443 += 1
+            if st == b"01":
+                est += 1
+            elif st == b"03":
+                syn += 1
+        return p80, p443, est, syn
+
+    def ip_counts(self) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+        return self.aggregate()[1]
+
+    def aggregate(self, max_ips: int = 0):
+        return _aggregate_rows(self._rows, b"0050", b"01BB", b"01", b"03", proc_hex_ip_key, max_ips)
+
+
+class _NumpyConnTable(ConnTable):
+    """
+    NumPy table: tìm vị trí "sl:" của mọi dòng bằng vector, rồi gom và giải mã hex
+    theo cột độ rộng cố định (không regex, không vòng lặp Python theo dòng).
+    """
+
+    __slots__ = ('local_port', 'remote_port', 'state', 'remote_ip', '_v6_rows', '_v6_keys')
+
+    def __init__(self, data: bytes, v6: bool):
+        arr = np.frombuffer(data, dtype=np.uint8)
+        ip_w = 32 if v6 else 8
+        width = 2 * ip_w + 14            # "IP:PORT IP:PORT ST"
+        newlines = np.flatnonzero(arr == 0x0A)
+        starts = newlines[:-1] + 1       # bỏ dòng header
+        starts = starts[starts + 12 + width <= len(arr)]
+        # "%4d:" -> dấu ":" nằm trong 12 byte đầu dòng
+        window = arr[starts[:, None] + np.arange(12)]
+        rec = starts + np.argmax(window == 0x3A, axis=1) + 2
+        # Bỏ dòng không đúng định dạng (kiểm tra các dấu phân cách cố định)
+        ok = ((arr[rec + ip_w] == 0x3A) & (arr[rec + ip_w + 5] == 0x20)
+              & (arr[rec + 2 * ip_w + 6] == 0x3A) & (arr[rec + width] == 0x20))
+        rec = rec[ok]
+        self.size = len(rec)
+
+        rip = ip_w + 6
+        self.local_port = _np_hex(arr, rec, ip_w + 1, 4)
+        self.remote_port = _np_hex(arr, rec, rip + ip_w + 1, 4)
+        self.state = _np_hex(arr, rec, rip + ip_w + 6, 2)
+        if not v6:
+            self.remote_ip = _np_hex(arr, rec, rip, 8)
+            self._v6_rows = np.zeros(self.size, dtype=bool)
+            self._v6_keys: List[int] = []
         else:
-            # Fallback to ss (available on all modern Linux)
-            stats.source = "ss"
-            stats.port_80 = self._count_ss_output("ss -ant sport = :80 or dport = :80 2>/dev/null | wc -l")
-            stats.port_443 = self._count_ss_output("ss -ant sport = :443 or dport = :443 2>/dev/null | wc -l")
-            stats.established = self._count_ss_output("ss -ant state established 2>/dev/null | wc -l")
-            stats.syn_recv = self._count_ss_output("ss -ant state syn-recv 2>/dev/null | wc -l")
+            # IPv4-mapped -> giữ dạng 32-bit như IPv4; IPv6 thật (ít) xử lý bằng Python
+            prefix = arr[rec[:, None] + (rip + np.arange(24))]
+            mapped = np.all(prefix == _NP_V4_MAPPED, axis=1)
+            self.remote_ip = np.where(mapped, _np_hex(arr, rec, rip + 24, 8), 0)
+            self._v6_rows = ~mapped
+            self._v6_keys = [proc_hex_ip_key(data[i + rip:i + rip + 32])
+                             for i in rec[self._v6_rows].tolist()]
+
+    def counts(self) -> Tuple[int, int, int, int]:
+        lp, rp, st = self.local_port, self.remote_port, self.state
+        return (
+            int(np.count_nonzero((lp == 80) | (rp == 80))),
+            int(np.count_nonzero((lp == 443) | (rp == 443))),
+            int(np.count_nonzero(st == _STATE_ESTABLISHED)),
+            int(np.count_nonzero(st == _STATE_SYN_RECV)),
+        )
+
+    def ip_counts(self) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+        lp, rp = self.local_port, self.remote_port
+        return self._ip_counts(((lp == 80) | (rp == 80), (lp == 443) | (rp == 443),
+                                self.state == _STATE_ESTABLISHED))
+
+    def aggregate(self, max_ips: int = 0):
+        lp, rp, st = self.local_port, self.remote_port, self.state
+        masks = ((lp == 80) | (rp == 80), (lp == 443) | (rp == 443), st == _STATE_ESTABLISHED)
+        counts = (int(np.count_nonzero(masks[0])), int(np.count_nonzero(masks[1])),
+                  int(np.count_nonzero(masks[2])), int(np.count_nonzero(st == _STATE_SYN_RECV)))
+        return counts, self._ip_counts(masks, max_ips)
+
+    def _ip_counts(self, masks, max_ips: int = 0) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+        v4_rows = ~self._v6_rows
+        result = []
+        for mask in masks:
+            keys, counts = np.unique(self.remote_ip[mask & v4_rows], return_counts=True)
+            keep = max_ips + len(_SKIP_IP_KEYS)
+            if max_ips > 0 and keep < len(keys):
+                # Chỉ giữ max_ips IP lớn nhất (+ chỗ cho IP local sẽ bị bỏ), chọn bằng argpartition
+                top = np.argpartition(counts, -keep)[-keep:]
+                keys, counts = keys[top], counts[top]
+            out = dict(zip(keys.tolist(), counts.tolist()))
+            if self._v6_keys:
+                for key in (k for k, m in zip(self._v6_keys, mask[self._v6_rows]) if m):
+                    out[key] = out.get(key, 0) + 1
+            for key in _SKIP_IP_KEYS:
+                out.pop(key, None)
+            result.append(out)
+        return result[0], result[1], result[2]
+
+
+if np is not None:
+    _NP_HEX_LUT = np.zeros(256, dtype=np.uint8)
+    for _i, _c in enumerate(b"0123456789ABCDEF"):
+        _NP_HEX_LUT[_c] = _i
+    _NP_V4_MAPPED = np.frombuffer(_V4_MAPPED_PREFIX, dtype=np.uint8)
+
+
+def _np_hex(arr, rec, offset: int, width: int):
+    """Decode the fixed-width hex field at rec + offset for every row."""
+    nib = _NP_HEX_LUT[arr[rec[:, None] + (offset + np.arange(width))]]
+    out = nib[:, 0].astype(np.uint32)
+    for i in range(1, width):
+        out <<= 4
+        out |= nib[:, i]
+    return out
+
+
+def parse_proc_net(data: bytes, v6: bool = False) -> ConnTable:
+    """
+    Parse the contents of /proc/net/tcp (v6=False) or /proc/net/tcp6 (v6=True).
+    Dùng NumPy nếu có, ngược lại dùng đường pure-Python.
+    """
+    if np is not None:
+        return _NumpyConnTable(data, v6)
+    return _PyConnTable(_PROC_NET_ROW_RE[v6].findall(data))
+
+
+# ======= Netlink sock_diag =======
+NETLINK_SOCK_DIAG: int = 4
+SOCK_DIAG_BY_FAMILY: int = 20
+NLM_F_REQUEST: int = 0x1
+NLM_F_DUMP: int = 0x300
+NLMSG_ERROR: int = 2
+NLMSG_DONE: int = 3
+INET_DIAG_REQ_BYTECODE: int = 1
+INET_DIAG_BC_JMP: int = 1
+INET_DIAG_BC_S_GE: int = 2
+INET_DIAG_BC_S_LE: int = 3
+INET_DIAG_BC_D_GE: int = 4
+INET_DIAG_BC_D_LE: int = 5
+TCPF_ALL: int = 0xFFF
+TCPF_COUNTED: int = (1 << _STATE_ESTABLISHED) | (1 << _STATE_SYN_RECV)
+
+_NLMSG_HDR = struct.Struct("=IHHII")                  # len, type, flags, seq, pid
+_INET_DIAG_REQ_V2 = struct.Struct("=BBBBI48x")         # family, protocol, ext, pad, states, sockid
+_RTATTR_HDR = struct.Struct("=HH")
+_INET_DIAG_BC_OP = struct.Struct("=BBH")               # code, yes, no
+_INET_DIAG_PORTS = struct.Struct(">HH")                # sport, dport (network order)
+_NETLINK_RECV_SIZE: int = 256 * 1024
+
+
+def _diag_port_filter(ports: Tuple[int, ...]) -> bytes:
+    """
+    Build inet_diag bytecode: sport == p or dport == p for any p in ports.
+    Kernel kiểm tra bytecode theo chuỗi "yes", nên mỗi điều kiện "== p" là GE, LE (yes = lệnh kế tiếp,
+    no = sang điều kiện sau) rồi JMP tới cuối (chấp nhận). Nhảy quá cuối 4 byte = loại.
+    Dùng cặp GE/LE thay cho S_EQ/D_EQ để tương thích kernel cũ.
+    """
+    conds = [(ge, le, port) for port in ports
+             for ge, le in ((INET_DIAG_BC_S_GE, INET_DIAG_BC_S_LE), (INET_DIAG_BC_D_GE, INET_DIAG_BC_D_LE))]
+    size = 20
+    total = size * len(conds)
+    out = []
+    for i, (ge, le, port) in enumerate(conds):
+        off = size * i
+        next_cond = off + size if i < len(conds) - 1 else total + 4
+        out.append(_INET_DIAG_BC_OP.pack(ge, 8, next_cond - off) + _INET_DIAG_BC_OP.pack(0, 0, port))
+        out.append(_INET_DIAG_BC_OP.pack(le, 8, next_cond - off - 8) + _INET_DIAG_BC_OP.pack(0, 0, port))
+        out.append(_INET_DIAG_BC_OP.pack(INET_DIAG_BC_JMP, 4, total - off - 16))
+    return b"".join(out)
+
+
+_DIAG_WEB_PORTS_BC: bytes = _diag_port_filter((80, 443))
+
+
+def diag_ip_key(raw: bytes) -> int:
+    """Convert a sock_diag address (4 or 16 bytes, network order) to the integer IP key of /proc."""
+    if len(raw) == 4:
+        return int.from_bytes(raw, "little")
+    if raw[:12] == b"\0" * 10 + b"\xff\xff":
+        return int.from_bytes(raw[12:], "little")
+    return IP6_KEY_FLAG | int.from_bytes(b"".join(raw[i:i + 4][::-1] for i in (0, 4, 8, 12)), "big")
+
+
+class _NetlinkConnTable(ConnTable):
+    """Table from sock_diag (hoặc ss): rows (local_port, remote_addr_raw, remote_port, state)."""
+
+    __slots__ = ('_rows',)
+
+    def __init__(self, rows: List[Tuple[int, bytes, int, int]]):
+        self._rows = rows
+        self.size = len(rows)
+
+    def counts(self) -> Tuple[int, int, int, int]:
+        p80 = p443 = est = syn = 0
+        for lport, _rip, rport, st in self._rows:
+            if lport == 80 or rport == 80:
+                p80 += 1
+            if lport == 443 or rport == 443:
+                p443 += 1
+            if st == _STATE_ESTABLISHED:
+                est += 1
+            elif st == _STATE_SYN_RECV:
+                syn += 1
+        return p80, p443, est, syn
+
+    def ip_counts(self) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int]]:
+        return self.aggregate()[1]
+
+    def aggregate(self, max_ips: int = 0):
+        return _aggregate_rows(self._rows, 80, 443, _STATE_ESTABLISHED, _STATE_SYN_RECV, diag_ip_key, max_ips)
+
+
+class NetlinkDiag:
+    """
+    TCP socket dump qua NETLINK_SOCK_DIAG (không đọc /proc, không gọi ss).
+    Lọc phía kernel: một lần dump các state ESTABLISHED/SYN_RECV (mọi port) và một lần dump
+    các state còn lại chỉ với sport/dport 80/443, nên kernel chỉ trả về socket cần đếm.
+    """
 
-        return stats
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        self._seq = 0
 
     @staticmethod
-    def _count_ss_output(cmd: str) -> int:
-        """Execute ss command and return count."""
+    def available() -> bool:
+        """Check whether a sock_diag dump works on this system."""
+        if not hasattr(socket, "AF_NETLINK"):
+            return False
         try:
-            import subprocess
-            result = subprocess.run(
-                cmd, shell=True, capture_output=True, text=True, timeout=5
-            )
-            count = int(result.stdout.strip()) - 1  # Subtract header line
-            return max(0, count)
-        except Exception:
-            return 0
+            diag = NetlinkDiag()
+        except OSError:
+            return False
+        try:
+            diag.dump(socket.AF_INET, 1 << _STATE_SYN_RECV)
+            return True
+        except OSError:
+            return False
+        finally:
+            diag.close()
+
+    def dump(self, family: int, states: int, bytecode: bytes = b"") -> List[Tuple[int, bytes, int, int]]:
+        """Dump TCP sockets of one address family matching states (+ bytecode filter)."""
+        self._seq += 1
+        seq = self._seq
+        payload = _INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 0, 0, states)
+        if bytecode:
+            payload += _RTATTR_HDR.pack(_RTATTR_HDR.size + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+        hdr = _NLMSG_HDR.pack(_NLMSG_HDR.size + len(payload), SOCK_DIAG_BY_FAMILY,
+                              NLM_F_REQUEST | NLM_F_DUMP, seq, 0)
+        self._sock.send(hdr + payload)
+
+        addr_len = 4 if family == socket.AF_INET else 16
+        hdr_size = _NLMSG_HDR.size
+        rows: List[Tuple[int, bytes, int, int]] = []
+        append = rows.append
+        unpack_hdr = _NLMSG_HDR.unpack_from
+        unpack_ports = _INET_DIAG_PORTS.unpack_from
+        while True:
+            buf = self._sock.recv(_NETLINK_RECV_SIZE)
+            off = 0
+            while off + hdr_size <= len(buf):
+                msg_len, msg_type, _flags, msg_seq, _pid = unpack_hdr(buf, off)
+                if msg_len < hdr_size:
+                    return rows
+                if msg_seq == seq:
+                    if msg_type == NLMSG_DONE:
+                        return rows
+                    if msg_type == NLMSG_ERROR:
+                        err = -struct.unpack_from("=i", buf, off + hdr_size)[0]
+                        raise OSError(err, os.strerror(err))
+                    if msg_type == SOCK_DIAG_BY_FAMILY:
+                        # inet_diag_msg: family, state, timer, retrans, sockid(sport, dport, src, dst, ...)
+                        base = off + hdr_size
+                        sport, dport = unpack_ports(buf, base + 4)
+                        dst = buf[base + 24:base + 24 + addr_len]
+                        append((sport, dst, dport, buf[base + 1]))
+                off += (msg_len + 3) & ~3
+
+    def table(self) -> ConnTable:
+        """Dump counted sockets of both families into one table."""
+        rows: List[Tuple[int, bytes, int, int]] = []
+        for family in (socket.AF_INET, socket.AF_INET6):
+            rows.extend(self.dump(family, TCPF_COUNTED))
+            rows.extend(self.dump(family, TCPF_ALL & ~TCPF_COUNTED, _DIAG_WEB_PORTS_BC))
+        return _NetlinkConnTable(rows)
 
-    def get_top_ips(self, threshold: int = 5, limit: int = 5) -> Dict[str, List[IPCount]]:
-        """Get top IPs by connection count."""
-        result: Dict[str, List[IPCount]] = {
-            "Top IP :80": [],
-            "Top IP :443": [],
-            "Top IP ESTABLISHED": [],
-        }
+    def close(self) -> None:
+        """Close netlink socket."""
+        try:
+            self._sock.close()
+        except OSError:
+            pass
 
-        if self._use_proc:
-            connections = self.get_all_connections()
 
-            # Count IPs by category
-            ip_counts_80: Dict[str, int] = defaultdict(int)
-            ip_counts_443: Dict[str, int] = defaultdict(int)
-            ip_counts_established: Dict[str, int] = defaultdict(int)
+# ss -tan: State Recv-Q Send-Q Local:Port Peer:Port
+_SS_STATES: Dict[str, int] = {"ESTAB": _STATE_ESTABLISHED, "SYN-RECV": _STATE_SYN_RECV}
 
-            for _, local_port, remote_ip, remote_port, state in connections:
-                # Skip invalid/local IPs
-                if remote_ip in ("0.0.0.0", "127.0.0.1", "", "::1"):
-                    continue
 
-                if local_port == 80 or remote_port == 80:
-                    ip_counts_80[remote_ip] += 1
-                if local_port == 443 or remote_port == 443:
-                    ip_counts_443[remote_ip] += 1
-                if state == "ESTABLISHED":
-                    ip_counts_established[remote_ip] += 1
-
-            # Sort and filter
-            for label, counts in [
-                ("Top IP :80", ip_counts_80),
-                ("Top IP :443", ip_counts_443),
-                ("Top IP ESTABLISHED", ip_counts_established),
-            ]:
-                sorted_ips = sorted(counts.items(), key=lambda x: x[1], reverse=True)
-                for ip, count in sorted_ips[:limit]:
-                    if count > threshold:
-                        result[label].append(IPCount(ip=ip, count=count))
-        else:
-            # Fallback to ss
-            result = self._get_top_ips_ss(threshold, limit)
+def _ss_addr(text: str) -> Tuple[bytes, int]:
+    """Split an ss address ("1.2.3.4:80", "[::1]:443", "*:80") into raw address and port."""
+    host, _, port = text.rpartition(":")
+    host = host.strip("[]").split("%", 1)[0]
+    try:
+        raw = socket.inet_pton(socket.AF_INET6 if ":" in host else socket.AF_INET, host)
+    except OSError:
+        raw = b"\0\0\0\0"
+    return raw, int(port) if port.isdigit() else 0
+
+
+def parse_ss_output(text: str) -> ConnTable:
+    """Parse `ss -tan` output into the same row table as sock_diag."""
+    rows: List[Tuple[int, bytes, int, int]] = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 5 or parts[0] == "State":
+            continue
+        _laddr, lport = _ss_addr(parts[3])
+        raddr, rport = _ss_addr(parts[4])
+        rows.append((lport, raddr, rport, _SS_STATES.get(parts[0], 0)))
+    return _NetlinkConnTable(rows)
 
-        return result
 
-    def _get_top_ips_ss(self, threshold: int, limit: int) -> Dict[str, List[IPCount]]:
-        """Get top IPs using ss command."""
-        import subprocess
+class NetworkMonitor:
+    """
+    Network connection monitor.
+    Backend: netlink sock_diag (mặc định nếu có) -> /proc/net -> ss.
+    Mỗi lượt render chỉ đọc bảng kết nối một lần (snapshot có TTL ngắn dùng chung cho mọi view).
+    """
 
-        result: Dict[str, List[IPCount]] = {
-            "Top IP :80": [],
-            "Top IP :443": [],
-            "Top IP ESTABLISHED": [],
-        }
+    def __init__(self, backend: str = "auto", with_ips: bool = True, max_ips: int = 0):
+        self._executor = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
+        self._diag: Optional[NetlinkDiag] = None
+        if backend == "auto":
+            if NetlinkDiag.available():
+                backend = "netlink"
+            elif os.path.exists("/proc/net/tcp"):
+                backend = "proc"
+            else:
+                backend = "ss"
+        if backend == "netlink":
+            try:
+                self._diag = NetlinkDiag()
+            except OSError:
+                backend = "proc" if os.path.exists("/proc/net/tcp") else "ss"
+        self.backend = backend
+        self.source = {"netlink": "netlink", "proc": "/proc", "ss": "ss"}[backend]
+        self.with_ips = with_ips
+        self.max_ips = max_ips
+        self._snapshot: Optional[ConnSnapshot] = None
 
-        commands = {
-            "Top IP :80": "ss -ant '( sport = :80 or dport = :80 )' 2>/dev/null | awk 'NR>1 {print $5}' | cut -d':' -f1 | sort | uniq -c | sort -rn",
-            "Top IP :443": "ss -ant '( sport = :443 or dport = :443 )' 2>/dev/null | awk 'NR>1 {print $5}' | cut -d':' -f1 | sort | uniq -c | sort -rn",
-            "Top IP ESTABLISHED": "ss -ant state established 2>/dev/null | awk 'NR>1 {print $4}' | cut -d':' -f1 | sort | uniq -c | sort -rn",
-        }
+    @staticmethod
+    def _parse_proc_net(filepath: str) -> Optional[ConnTable]:
+        """Parse /proc/net/tcp or /proc/net/tcp6 into a ConnTable."""
+        try:
+            with open(filepath, "rb") as f:
+                data = f.read()
+        except (IOError, OSError, PermissionError):
+            return None
+        return parse_proc_net(data, v6=filepath.endswith("6"))
 
-        for label, cmd in commands.items():
+    @staticmethod
+    def _ss_table() -> Optional[ConnTable]:
+        """Run ss once and parse all TCP sockets."""
+        try:
+            import subprocess
+            result = subprocess.run(
+                ["ss", "-tan"], capture_output=True, text=True, timeout=5
+            )
+        except Exception:
+            return None
+        return parse_ss_output(result.stdout)
+
+    def get_all_connections(self) -> List[ConnTable]:
+        """Get TCP connection tables (netlink, /proc/net/tcp and tcp6, or ss)."""
+        tables: List[ConnTable] = []
+
+        if self._diag is not None:
             try:
-                proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-                for line in proc.stdout.strip().split("\n")[:limit]:
-                    parts = line.split()
-                    if len(parts) >= 2 and parts[0].isdigit():
-                        count = int(parts[0])
-                        ip = parts[1]
-                        if count > threshold and ip not in ("0.0.0.0", "127.0.0.1", "*"):
-                            result[label].append(IPCount(ip=ip, count=count))
+                return [self._diag.table()]
+            except OSError:
+                # sock_diag lỗi lúc chạy -> chuyển hẳn sang /proc
+                self._diag.close()
+                self._diag = None
+                self.backend = "proc"
+                self.source = "/proc"
+
+        if self.backend == "ss":
+            table = self._ss_table()
+            return [table] if table is not None else []
+
+        # Read IPv4 and IPv6 connections in parallel
+        futures = []
+        for filepath in ("/proc/net/tcp", "/proc/net/tcp6"):
+            if os.path.exists(filepath):
+                futures.append(self._executor.submit(self._parse_proc_net, filepath))
+
+        for future in as_completed(futures):
+            try:
+                table = future.result()
             except Exception:
-                pass
+                continue
+            if table is not None:
+                tables.append(table)
 
-        return result
+        return tables
+
+    def snapshot(self, max_age: float = SNAPSHOT_TTL) -> ConnSnapshot:
+        """
+        Capture counters (and per-IP counts if with_ips) in one pass over the tables.
+        Snapshot trẻ hơn max_age giây được dùng lại thay vì đọc bảng kết nối lần nữa.
+        """
+        snap = self._snapshot
+        if (snap is not None and time.monotonic() - snap.taken_at < max_age
+                and (snap.ip_80 is not None or not self.with_ips)):
+            return snap
+
+        stats = ConnectionStats()
+        snap = ConnSnapshot(stats)
+        tables = self.get_all_connections()
+        if self.with_ips:
+            # Bảng IP của từng ConnTable đã bị giới hạn theo max_ips, gộp chính xác là đủ
+            snap.ip_80, snap.ip_443, snap.ip_established = (defaultdict(int) for _ in range(3))
+        for table in tables:
+            if self.with_ips:
+                (p80, p443, est, syn), ip_counts = table.aggregate(self.max_ips)
+                if len(tables) == 1:
+                    snap.ip_80, snap.ip_443, snap.ip_established = ip_counts
+                else:
+                    for merged, counts in zip((snap.ip_80, snap.ip_443, snap.ip_established), ip_counts):
+                        for ip_key, c in counts.items():
+                            merged[ip_key] += c
+            else:
+                p80, p443, est, syn = table.counts()
+            stats.port_80 += p80
+            stats.port_443 += p443
+            stats.established += est
+            stats.syn_recv += syn
+        stats.source = self.source
+        self._snapshot = snap
+        return snap
+
+    def get_stats(self) -> ConnectionStats:
+        """Get connection statistics."""
+        return self.snapshot().stats
+
+    def get_top_ips(self, threshold: int = 5, limit: int = 5) -> Dict[str, List[IPCount]]:
+        """Get top IPs by connection count."""
+        self.with_ips = True
+        return self.snapshot().top_ips(threshold, limit)
 
     def shutdown(self) -> None:
-        """Shutdown thread pool."""
+        """Shutdown thread pool and netlink socket."""
         self._executor.shutdown(wait=False)
+        if self._diag is not None:
+            self._diag.close()
 
 
 def extract_domain(line: str, key: str, is_apache_vhosts: bool) -> str:
@@ -642,6 +1883,12 @@ def extract_domain(line: str, key: str, is_apache_vhosts: bool) -> str:
             return m.group(1).lower()
 
     # Fallback: extract domain from key (filename-based)
+    return key_domain(key)
+
+
+@lru_cache(maxsize=4096)
+def key_domain(key: str) -> str:
+    """Derive domain from a tail key (filename-based)."""
     file_domain = key.split(":", 1)[0]
 
     # Clean up common suffixes
@@ -654,9 +1901,276 @@ def extract_domain(line: str, key: str, is_apache_vhosts: bool) -> str:
     return file_domain
 
 
-def clear_screen() -> None:
-    """Clear terminal screen."""
-    os.system("clear" if os.name != "nt" else "cls")
+_DOMAIN_DECODE_CACHE: Dict[bytes, str] = {}
+_DOMAIN_DECODE_CACHE_MAX: int = 10000
+
+
+def decode_domain(raw: bytes) -> str:
+    """Decode and lowercase a raw domain token, cached (domain là ASCII)."""
+    dom = _DOMAIN_DECODE_CACHE.get(raw)
+    if dom is None:
+        if len(_DOMAIN_DECODE_CACHE) >= _DOMAIN_DECODE_CACHE_MAX:
+            _DOMAIN_DECODE_CACHE.clear()
+        dom = sys.intern(raw.decode("ascii").lower())
+        _DOMAIN_DECODE_CACHE[raw] = dom
+    return dom
+
+
+_LOG_TIME_CACHE: Dict = {}
+_LOG_TIME_CACHE_MAX: int = 4096
+
+
+def parse_log_time(raw) -> int:
+    """
+    Epoch second of a "dd/Mon/yyyy:HH:MM:SS +zzzz" log timestamp (str hoặc bytes), 0 nếu sai định dạng.
+    Cache theo chuỗi: mỗi giây chỉ phân tích một lần, không gọi strptime cho từng dòng.
+    """
+    sec = _LOG_TIME_CACHE.get(raw)
+    if sec is None:
+        s = raw.decode("ascii") if isinstance(raw, bytes) else raw
+        try:
+            offset = int(s[22:24]) * 3600 + int(s[24:26]) * 60
+            year, month, day = int(s[7:11]), _MONTHS[s[3:6]], int(s[0:2])
+            hour, minute, second = int(s[12:14]), int(s[15:17]), int(s[18:20])
+            # timegm tự "chuẩn hóa" 32/Oct hay 25:00 sang ngày khác: từ chối như strptime
+            if not (1 <= day <= calendar.monthrange(year, month)[1] and hour < 24 and minute < 60
+                    and second < 62 and len(s) == 26 and s[21] in "+-"):
+                raise ValueError(s)
+            sec = calendar.timegm((year, month, day, hour, minute, second))
+            sec += offset if s[21] == "-" else -offset
+        except (KeyError, ValueError, OverflowError):
+            sec = 0
+        if len(_LOG_TIME_CACHE) >= _LOG_TIME_CACHE_MAX:
+            _LOG_TIME_CACHE.clear()
+        _LOG_TIME_CACHE[raw] = sec
+    return sec
+
+
+class DomainExtractor:
+    """
+    Per-tail domain extractor, chosen once when the tail is opened.
+    Regex gộp theo loại file (apache vhosts / thường) và domain lấy từ key được tính sẵn,
+    nên mỗi khối dòng chỉ cần một lần findall thay vì chuỗi regex + xử lý key cho từng dòng.
+    sample_above > 0: quá số dòng này trong một giây, tổng dòng vẫn đếm đủ (đếm "\n") nhưng regex chỉ
+    chạy trên một mẫu dòng và số đếm theo domain được nhân lên; domain ước lượng được ghi vào `sampled`.
+    """
+
+    __slots__ = ('key', 'key_domain', 'is_apache_vhosts', 'fields', 'undated_sec', 'sample_above', 'sampled',
+                 '_tick_sec', '_tick_lines',
+                 '_head_re', '_nl_re', '_head_re_b', '_nl_re_b', '_fields_re', '_fields_re_b')
+
+    def __init__(self, key: str, fields: int = 0, sample_above: int = 0):
+        self.key = key
+        self.key_domain = key_domain(key)
+        self.is_apache_vhosts = key.startswith("__apache_vhosts__:")
+        self.fields = fields
+        self.undated_sec: Optional[int] = None  # FIELD_TIME: giây cho dòng không có timestamp (None = lúc đọc)
+        self.sample_above = sample_above
+        self.sampled: Set[str] = set()          # domain có số đếm ước lượng từ mẫu kể từ lần lấy trước
+        self._tick_sec = 0
+        self._tick_lines = 0
+        if self.is_apache_vhosts:
+            self._head_re, self._nl_re = APACHE_VHOST_LINE_DOMAIN_MERGED_RE
+            self._head_re_b, self._nl_re_b = APACHE_VHOST_LINE_DOMAIN_RE_B
+        else:
+            self._head_re, self._nl_re = LOG_LINE_DOMAIN_RE
+            self._head_re_b, self._nl_re_b = LOG_LINE_DOMAIN_RE_B
+        if fields:
+            self._fields_re = line_fields_re(self.is_apache_vhosts, False, fields)
+            self._fields_re_b = line_fields_re(self.is_apache_vhosts, True, fields)
+
+    def extract(self, line: str) -> str:
+        """Extract domain from a single line."""
+        m = self._head_re.match(line)
+        return m.group(1).lower() if m else self.key_domain
+
+    def _add_found(self, found: List, total: int, counts: Dict[str, int], decode) -> None:
+        matched = len(found)
+        if matched:
+            for raw, c in Counter(found).items():
+                counts[decode(raw)] += c
+        if total > matched:
+            counts[self.key_domain] += total - matched
+
+    def _add_fields(self, data, start: int, end: int, total: int, counts: Dict, binary: bool) -> None:
+        # Một tuple (domain, [ip], [timestamp]) cho mỗi dòng; tuple thừa sau "\n" cuối khối bị cắt bỏ
+        head_re, nl_re = self._fields_re_b if binary else self._fields_re
+        found = nl_re.findall(data, start, end)
+        found.append(head_re.match(data, start, end).groups())
+        del found[total - 1:-1]
+        decode = decode_domain if binary else str.lower
+        key_domain = self.key_domain
+        timed, with_ip = self.fields & FIELD_TIME, self.fields & FIELD_IP
+        now = int(time.time())
+        undated = now if self.undated_sec is None else self.undated_sec
+        for groups, c in Counter(found).items():
+            raw = groups[0]
+            key = decode(raw) if raw else key_domain
+            if timed:
+                sec = parse_log_time(groups[-1]) if groups[-1] else 0
+                key = (key, min(sec, now) if sec else undated)
+            if with_ip:
+                ip = groups[1]
+                ip = (ip.decode("ascii") if binary else ip) if ip else ""
+                key = (*key, ip) if timed else (key, ip)
+            counts[key] += c
+
+    def _sampling(self, total: int) -> bool:
+        # Ngưỡng tính theo số dòng của file trong giây hiện tại; khối nhỏ không đáng lấy mẫu
+        if not self.sample_above:
+            return False
+        sec = int(time.time())
+        if sec != self._tick_sec:
+            self._tick_sec, self._tick_lines = sec, 0
+        self._tick_lines += total
+        return self._tick_lines > self.sample_above and total >= SAMPLE_STRIDE * SAMPLE_WINDOWS
+
+    def flooding(self) -> bool:
+        """True while the file is past sample_above lines in the current second (--sample-above)."""
+        return (self.sample_above > 0 and self._tick_lines > self.sample_above
+                and self._tick_sec == int(time.time()))
+
+    def _scale(self, part: Dict, sampled: int, total: int, counts: Dict) -> None:
+        """Scale counts of `sampled` lines up to `total` lines (chia phần dư lớn nhất, tổng vẫn đúng)."""
+        if not self.fields and not self.is_apache_vhosts and set(part) == {self.key_domain}:
+            # File một domain, mẫu không có dòng ghi host: mọi dòng thuộc domain của key, đếm chính xác
+            counts[self.key_domain] += total
+            return
+        keys = list(part)
+        shares = [part[k] * total / sampled for k in keys]
+        scaled = [int(x) for x in shares]
+        rest = sorted(range(len(keys)), key=lambda i: shares[i] - scaled[i], reverse=True)
+        for i in rest[:total - sum(scaled)]:
+            scaled[i] += 1
+        for k, n in zip(keys, scaled):
+            if n:
+                counts[k] += n
+        self.sampled.update(k if isinstance(k, str) else k[0] for k in keys)
+
+    def _count_text(self, lines: List[str], counts: Dict) -> None:
+        data = "".join(lines)
+        if self.fields:
+            self._add_fields(data, 0, len(data), len(lines), counts, False)
+            return
+        found = self._nl_re.findall(data)
+        m = self._head_re.match(data)
+        if m:
+            found.append(m.group(1))
+        self._add_found(found, len(lines), counts, str.lower)
+
+    def _count_bytes(self, buf: bytearray, start: int, end: int, total: int, counts: Dict) -> None:
+        if self.fields:
+            self._add_fields(buf, start, end, total, counts, True)
+            return
+        found = self._nl_re_b.findall(buf, start, end)
+        m = self._head_re_b.match(buf, start, end)
+        if m:
+            found.append(m.group(1))
+        self._add_found(found, total, counts, decode_domain)
+
+    def count_lines(self, lines: List[str], counts: Dict[str, int]) -> int:
+        """
+        Count text lines per domain. Returns line count.
+        Với fields (FIELD_TIME/FIELD_IP), khóa của counts là tuple (domain, [giây], [ip]).
+        """
+        if not lines:
+            return 0
+        if self._sampling(len(lines)):
+            # Mẫu cách đều theo dòng
+            sample = lines[::max(SAMPLE_STRIDE, len(lines) // SAMPLE_LINES)]
+            part: Dict = defaultdict(int)
+            self._count_text(sample, part)
+            self._scale(part, len(sample), len(lines), counts)
+        else:
+            self._count_text(lines, counts)
+        return len(lines)
+
+    def count_block(self, buf: bytearray, end: int, counts: Dict[str, int]) -> int:
+        """
+        Count complete lines in buf[:end] per domain (binary mode). Returns line count.
+        Dòng không khớp được tính cho domain lấy từ key qua bytes.count(b"\n").
+        """
+        total = buf.count(b"\n", 0, end)
+        if end and buf[end - 1] != 0x0A:
+            total += 1
+        if not self._sampling(total):
+            self._count_bytes(buf, 0, end, total, counts)
+            return total
+        # Mẫu: tối đa SAMPLE_WINDOWS đoạn dòng liên tiếp rải đều trong khối (khối nhỏ ít đoạn hơn),
+        # mỗi đoạn bắt đầu/kết thúc ở ranh giới dòng; domain của mọi đoạn gộp vào một lần đếm
+        want = min(SAMPLE_LINES, total // SAMPLE_STRIDE)
+        windows = min(SAMPLE_WINDOWS, max(1, want // SAMPLE_STRIDE))
+        part: Dict = defaultdict(int)
+        found: List[bytes] = []
+        sampled = 0
+        span = end // windows
+        width = end * want // (total * windows) + 1
+        # Lệch ngẫu nhiên trong mỗi khoảng: khối lặp theo chu kỳ không bị lấy mẫu cùng vị trí mãi
+        phase = random.randrange(max(1, span - width))
+        stop = 0
+        for w in range(windows):
+            start = max(w * span + phase, stop)
+            if start:
+                start = buf.find(b"\n", start - 1, end) + 1
+                if not start or start >= end:
+                    break
+            stop = buf.find(b"\n", min(start + width, end - 1), end) + 1 or end
+            n = buf.count(b"\n", start, stop) + (stop == end and buf[end - 1] != 0x0A)
+            if self.fields:
+                self._add_fields(buf, start, stop, n, part, True)
+            else:
+                found += self._nl_re_b.findall(buf, start, stop)
+                m = self._head_re_b.match(buf, start, stop)
+                if m:
+                    found.append(m.group(1))
+            sampled += n
+        if not self.fields:
+            self._add_found(found, sampled, part, decode_domain)
+        self._scale(part, sampled, total, counts)
+        return total
+
+
+class ScreenRenderer:
+    """
+    Flicker-free frame renderer: mỗi frame dựng thành một buffer và ghi bằng một lần write.
+    Trên TTY chỉ vẽ lại các dòng khác frame trước (đặt con trỏ + xóa cuối dòng bằng mã ANSI);
+    stdout không phải TTY (pipe, file) thì in nguyên frame dạng văn bản thường.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.tty = self.stream.isatty()
+        self._prev: List[str] = []
+        self._size: Optional[os.terminal_size] = None
+
+    def frame(self, text: str) -> None:
+        """Write one frame (các dòng phân tách bởi "\\n")."""
+        lines = text.split("\n")
+        if not self.tty:
+            self.stream.write(text + "\n\n")
+            self.stream.flush()
+            return
+
+        size = shutil.get_terminal_size()
+        # Dòng dài hơn màn hình sẽ xuống dòng và làm lệch vị trí -> cắt theo số cột, bỏ phần tràn số hàng
+        lines = [line[:size.columns] for line in lines[:max(1, size.lines - 1)]]
+        prev = self._prev
+        if size != self._size:
+            # Lần đầu hoặc terminal đổi kích thước: xóa và vẽ lại toàn bộ
+            out = ["\033[H\033[2J\033[3J"]
+            prev = []
+            self._size = size
+        else:
+            out = []
+        for i, line in enumerate(lines):
+            if i >= len(prev) or prev[i] != line:
+                out.append(f"\033[{i + 1};1H{line}\033[K")
+        if len(lines) < len(prev):
+            out.append(f"\033[{len(lines) + 1};1H\033[J")
+        out.append(f"\033[{len(lines) + 1};1H")
+        self._prev = lines
+        self.stream.write("".join(out))
+        self.stream.flush()
 
 
 def print_banner() -> None:
@@ -667,140 +2181,1634 @@ def print_banner() -> None:
     print("          cPanel, DirectAdmin, CyberPanel, Plesk, VestaCP")
     print("=" * 60)
 
-def main() -> None:
-    """Main entry point."""
-    args = parse_args()
-    dir_list = list(dict.fromkeys((args.dir or []) + CANDIDATE_DIRS))
-    interval = args.interval
-    rediscover = args.rediscover
-    start_at_end = not args.start_at_begin
-    show_domains = not args.no_domains
+def process_usage(pids: List[int]) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    """(open FDs, RSS bytes, CPU seconds) summed over pids from /proc; không có /proc thì chỉ process này."""
+    if not os.path.isdir("/proc/self/fd"):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return None, usage.ru_maxrss * 1024, usage.ru_utime + usage.ru_stime
+    fds = rss = 0
+    cpu = 0.0
+    page = os.sysconf("SC_PAGE_SIZE")
+    tick = os.sysconf("SC_CLK_TCK")
+    for pid in pids:
+        try:
+            fds += len(os.listdir(f"/proc/{pid}/fd"))
+            with open(f"/proc/{pid}/statm", "rb") as f:
+                rss += int(f.read().split()[1]) * page
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                # utime, stime: trường 14, 15 (sau tên process trong ngoặc, có thể chứa dấu cách)
+                stat = f.read().rsplit(b")", 1)[1].split()
+            cpu += (int(stat[11]) + int(stat[12])) / tick
+        except (OSError, ValueError, IndexError):
+            # Worker vừa thoát
+            continue
+    return fds, rss, cpu
+
+
+class SelfStats:
+    """
+    Self-instrumentation: thời gian (perf_counter_ns) và số lượt theo stage (SELF_STAGES), số dòng/byte log
+    đã đọc, đếm tích lũy trong mảng cấp sẵn (không cấp phát trên hot path). Mỗi stage chỉ do một luồng ghi
+    (ingest, net, discovery, output) nên không cần khóa; worker --workers gửi phần của nó về qua flush và
+    luồng ingest chỉ cộng vào các stage của worker (WORKER_STAGES) và io, là các ô chỉ nó ghi.
+    """
+
+    __slots__ = ('ns', 'calls', 'io', '_prev', '_prev_at', '_prev_cpu')
+
+    def __init__(self):
+        self.ns = array('Q', [0]) * len(SELF_STAGES)
+        self.calls = array('Q', [0]) * len(SELF_STAGES)
+        self.io = array('Q', [0, 0])             # [dòng, byte] log đã đọc
+        self._prev: Tuple[List[int], List[int], List[int]] = ([0] * len(SELF_STAGES), [0] * len(SELF_STAGES), [0, 0])
+        self._prev_at = time.monotonic()
+        self._prev_cpu: Optional[float] = None
+
+    def add(self, stage: int, ns: int) -> None:
+        """Record one call of stage that took ns nanoseconds."""
+        self.ns[stage] += ns
+        self.calls[stage] += 1
+
+    def take(self) -> Tuple[List[int], List[int], List[int]]:
+        """Return the counters and zero them in place (worker gửi phần tích lũy về process cha)."""
+        part = (self.ns.tolist(), self.calls.tolist(), self.io.tolist())
+        for vec in (self.ns, self.calls, self.io):
+            for i in range(len(vec)):
+                vec[i] = 0
+        return part
+
+    def merge(self, part: Tuple[List[int], List[int], List[int]]) -> None:
+        """Add counters taken from a worker process (chỉ WORKER_STAGES và io)."""
+        ns, calls, io = part
+        for i in WORKER_STAGES:
+            self.ns[i] += ns[i]
+            self.calls[i] += calls[i]
+        for i, v in enumerate(io):
+            self.io[i] += v
+
+    def sample(self, pids: List[int]) -> Dict:
+        """
+        Cost since the previous sample (mỗi lượt xuất một lần): ms và tỉ lệ thời gian mỗi stage,
+        dòng/s, byte/s, cộng FD mở, RSS và CPU của mọi process trong pids.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._prev_at, 1e-9)
+        cur = (self.ns.tolist(), self.calls.tolist(), self.io.tolist())
+        (prev_ns, prev_calls, prev_io), self._prev, self._prev_at = self._prev, cur, now
+        fds, rss, cpu = process_usage(pids)
+        cpu_pct = None
+        if cpu is not None and self._prev_cpu is not None:
+            cpu_pct = (cpu - self._prev_cpu) / elapsed * 100
+        self._prev_cpu = cpu
+        return {
+            "interval_seconds": elapsed,
+            "stages": {
+                name: {
+                    "ms": (cur[0][i] - prev_ns[i]) / 1e6,
+                    "share": (cur[0][i] - prev_ns[i]) / 1e9 / elapsed,
+                    "calls": cur[1][i] - prev_calls[i],
+                    "seconds_total": cur[0][i] / 1e9,
+                }
+                for i, name in enumerate(SELF_STAGES)
+            },
+            "lines_per_sec": (cur[2][0] - prev_io[0]) / elapsed,
+            "bytes_per_sec": (cur[2][1] - prev_io[1]) / elapsed,
+            "lines_total": cur[2][0],
+            "bytes_total": cur[2][1],
+            "processes": len(pids),
+            "open_fds": fds,
+            "rss_bytes": rss,
+            "cpu_seconds_total": cpu,
+            "cpu_percent": cpu_pct,
+        }
+
 
-    # Initialize network monitor
-    net_monitor = NetworkMonitor()
+SELF_STATS = SelfStats()
+
+
+class DomainRegistry:
+    """
+    Persistent domain -> integer id map (tên domain được intern).
+    Id của domain đã bị dọn được tái sử dụng, nên số id tỉ lệ với số domain hoạt động cùng lúc.
+    """
 
-    # Initialize log tails
-    tails: Dict[str, TailFile] = {}
-    last_rediscover: Optional[float] = None
+    __slots__ = ('ids', 'names', '_free')
 
-    if show_domains:
-        logs = discover_logs(dir_list)
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[Optional[str]] = []
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, name: str) -> int:
+        """Return the id of name, registering it if new."""
+        i = self.ids.get(name)
+        if i is None:
+            name = sys.intern(name)
+            if self._free:
+                i = self._free.pop()
+                self.names[i] = name
+            else:
+                i = len(self.names)
+                self.names.append(name)
+            self.ids[name] = i
+        return i
+
+    def release(self, i: int) -> None:
+        """Forget the domain with id i (id được cấp lại cho domain mới)."""
+        del self.ids[self.names[i]]
+        self.names[i] = None
+        self._free.append(i)
+
+
+class RateRing:
+    """
+    Sliding-window request rates over 1-second buckets (bucket theo giây epoch).
+    Mỗi giây là một vector array('I') đánh số theo id domain (DomainRegistry), được xóa tại chỗ khi ring
+    quay lại (chỉ các ô đã ghi). Tổng của từng cửa sổ được cộng/trừ dần khi một giây trọn vào/ra cửa sổ,
+    nên rows() không phải cộng lại cả ring và chỉ chọn top-N bằng heap thay vì sort toàn bộ.
+    Giây hiện tại (chưa trọn) không tính vào tốc độ; giây đầu tiên có dữ liệu được tính như giây trọn
+    (start là giây ngay trước nó) để backlog đọc trong giây đầu không bị mất. Domain không còn request
+    nào trong ring được trả id, nên bộ nhớ chỉ tỉ lệ với domain đang hoạt động.
+    """
+
+    __slots__ = ('size', 'windows', 'head', 'start', 'registry', '_cap', '_buckets', '_touched',
+                 '_totals', '_last', '_sampled')
+
+    def __init__(self, seconds: int = RATE_WINDOW_SEC, windows: Tuple[int, ...] = RATE_WINDOWS):
+        self.size = seconds + 1              # +1 cho giây hiện tại
+        self.windows = windows
+        self.head: Optional[int] = None      # giây mới nhất
+        self.start: Optional[int] = None
+        self.registry = DomainRegistry()
+        self._cap = 0
+        self._buckets: List[array] = [array('I') for _ in range(self.size)]
+        self._touched: List[List[int]] = [[] for _ in range(self.size)]  # id đã ghi của mỗi giây
+        self._totals: List[array] = [array('I') for _ in windows]
+        self._last = array('q')              # giây gần nhất có request của mỗi id
+        self._sampled = array('q')           # giây gần nhất có số đếm ước lượng từ mẫu (--sample-above)
+
+    def __len__(self) -> int:
+        return len(self.registry)
+
+    def _grow(self, need: int) -> None:
+        cap = max(64, need + need // 4)
+        pad = array('I', [0]) * (cap - self._cap)
+        for vec in self._buckets + self._totals:
+            vec.extend(pad)
+        self._last.extend(array('q', [0]) * (cap - self._cap))
+        self._sampled.extend(array('q', [0]) * (cap - self._cap))
+        self._cap = cap
+
+    def _fold(self, sec: int, windows, sign: int) -> None:
+        # Cộng (sign=1) / trừ (sign=-1) vector của giây sec vào tổng của các cửa sổ đã chọn
+        i = sec % self.size
+        bucket = self._buckets[i]
+        touched = self._touched[i]
+        for k in windows:
+            total = self._totals[k]
+            if sign > 0:
+                for d in touched:
+                    total[d] += bucket[d]
+            else:
+                for d in touched:
+                    total[d] -= bucket[d]
+
+    def advance(self, sec: int) -> None:
+        """Move the head to sec: giây vừa trọn vào tổng cửa sổ, giây quá cũ ra khỏi tổng và bị xóa."""
+        if self.head is None:
+            # start: giây cuối cùng không tính vào tốc độ (các giây > start mới được tính)
+            self.head, self.start = sec, sec - 1
+            return
+        steps = sec - self.head
+        if steps <= 0:
+            return
+        size, start = self.size, self.start
+        all_windows = range(len(self.windows))
+        if steps > size:
+            # Mọi giây cũ đã ra khỏi các cửa sổ: xóa tại chỗ
+            for touched, bucket in zip(self._touched, self._buckets):
+                for d in touched:
+                    bucket[d] = 0
+                    for total in self._totals:
+                        total[d] = 0
+                touched.clear()
+        else:
+            for t in range(self.head + 1, sec + 1):
+                if t - 1 > start:
+                    self._fold(t - 1, all_windows, 1)
+                for k, w in enumerate(self.windows):
+                    if t - 1 - w > start:
+                        self._fold(t - 1 - w, (k,), -1)
+                i = t % size
+                bucket = self._buckets[i]
+                for d in self._touched[i]:
+                    bucket[d] = 0
+                self._touched[i].clear()
+        if self.head // size != sec // size:
+            # Mỗi vòng ring mới trả id của domain không còn request nào trong ring
+            last, oldest = self._last, sec - size
+            registry = self.registry
+            for d in [d for d in registry.ids.values() if last[d] <= oldest]:
+                registry.release(d)
+                self._sampled[d] = 0
+        self.head = sec
+
+    def add(self, counts: Dict[str, int], sec: int) -> None:
+        """Add per-domain counts to second sec (giây cũ còn trong cửa sổ vẫn được cộng)."""
+        self.advance(sec)
+        head = self.head
+        if not counts or head - sec > self.size - 1:
+            return
+        if len(self.registry.names) + len(counts) > self._cap:
+            self._grow(len(self.registry.names) + len(counts))
+        i = sec % self.size
+        bucket, touched, last = self._buckets[i], self._touched[i], self._last
+        ids, get = self.registry.ids, self.registry.get
+        for name, c in counts.items():
+            d = ids.get(name)
+            if d is None:
+                d = get(name)
+            v = bucket[d]
+            if not v:
+                touched.append(d)
+            bucket[d] = v + c
+            if last[d] < sec:
+                last[d] = sec
+        # Giây đã trọn (giây trễ từ --by-timestamp) cộng thẳng vào tổng các cửa sổ chứa nó
+        if self.start < sec < head:
+            for k, w in enumerate(self.windows):
+                if sec >= head - w:
+                    total = self._totals[k]
+                    for name, c in counts.items():
+                        total[ids[name]] += c
+
+    def add_timed(self, counts: Dict[Tuple[str, int], int], now: Optional[int] = None) -> None:
+        """
+        Add (domain, second) counts from --by-timestamp, oldest second first.
+        now: giây lớn hơn now (đồng hồ log lệch, ghi trước) bị kẹp về now, không đẩy head vượt đồng hồ.
+        """
+        by_sec: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for (d, sec), c in counts.items():
+            if now is not None and sec > now:
+                sec = now
+            by_sec[sec][d] += c
+        if not by_sec:
+            return
+        secs = sorted(by_sec)
+        self.advance(secs[-1])
+        # Backlog có timestamp trước lúc bắt đầu chạy: các giây đó là giây trọn, đưa vào tốc độ
+        start = max(secs[0], self.head - self.size + 1) - 1
+        if start < self.start:
+            for s in range(start + 1, min(self.start, self.head - 1) + 1):
+                self._fold(s, [k for k, w in enumerate(self.windows) if s >= self.head - w], 1)
+            self.start = start
+        for sec in secs:
+            self.add(by_sec[sec], sec)
+
+    def mark_sampled(self, domains: Set[str], sec: int) -> None:
+        """Flag domains whose counts at sec were scaled up from a sample."""
+        ids = self.registry.ids
+        for name in domains:
+            d = ids.get(name)
+            if d is not None:
+                self._sampled[d] = sec
+
+    def sampled(self) -> Set[str]:
+        """Domains with sampled (ước lượng) counts anywhere in the ring."""
+        if self.head is None:
+            return set()
+        oldest, marks, names = self.head - self.size, self._sampled, self.registry.names
+        return {names[d] for d in self.registry.ids.values() if marks[d] > oldest}
+
+    def rows(self, limit: int = 0, nonzero: bool = False, by: int = 1) -> List[Tuple[str, List[float], int]]:
+        """
+        Rates of complete seconds: [(domain, [rps per window...], peak)], giảm dần theo cửa sổ `by`.
+        limit > 0: chỉ chọn top-N (heap, không sort toàn bộ); nonzero: bỏ domain không có request trong
+        cửa sổ `by`. Khi mới chạy (chưa đủ giây), chia cho số giây đã có thay vì cả cửa sổ.
+        """
+        if self.head is None:
+            return []
+        size, head = self.size, self.head
+        avail = min(size - 1, max(0, head - self.start - 1))
+        key = self._totals[by]
+        ids = [d for d in self.registry.ids.values() if key[d]] if nonzero else list(self.registry.ids.values())
+        if limit and len(ids) > limit:
+            ids = heapq.nlargest(limit, ids, key=key.__getitem__)
+        else:
+            ids.sort(key=key.__getitem__, reverse=True)
+        names = self.registry.names
+        if not avail:
+            return [(names[d], [0.0] * len(self.windows), 0) for d in ids]
+        spans = [(self._totals[k], max(1, min(w, avail))) for k, w in enumerate(self.windows)]
+        recent = [self._buckets[(head - k) % size] for k in range(1, avail + 1)]
+        if np is not None and len(ids) > RATE_PEAK_VECTOR_MIN:
+            # Xuất đầy đủ nhiều domain: đỉnh của mọi id tính một lần bằng vector
+            peaks = np.maximum.reduce([np.frombuffer(b, dtype=np.uintc) for b in recent]).tolist()
+        else:
+            peaks = None
+        return [(names[d], [total[d] / n for total, n in spans],
+                 peaks[d] if peaks is not None else max([b[d] for b in recent])) for d in ids]
+
+
+def split_ip_counts(counts: Dict, fields: int) -> Tuple[Dict, Dict[Tuple, int]]:
+    """
+    Split FIELD_IP counts into (counts keyed như khi không có FIELD_IP, {(domain, ip): count}).
+    Với FIELD_TIME, bảng IP giữ cả giây trong log: {(domain, ip, giây): count}.
+    Dòng không có IP vẫn được tính cho domain nhưng không vào bảng IP.
+    """
+    rate_counts: Dict = defaultdict(int)
+    ip_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    timed = fields & FIELD_TIME
+    for key, c in counts.items():
+        rate_counts[key[:2] if timed else key[0]] += c
+        if key[-1]:
+            ip_counts[(key[0], key[-1], key[1]) if timed else (key[0], key[-1])] += c
+    return rate_counts, ip_counts
+
+
+class LogIPRates:
+    """
+    Requests/sec per client IP and per (domain, IP) from access-log lines (--log-ips).
+    Đếm theo cửa sổ cố định `window` giây bằng hai sketch SpaceSaving (bộ nhớ tối đa ~2*capacity key
+    mỗi bảng); tốc độ lấy từ cửa sổ trọn gần nhất, khi chưa có thì từ cửa sổ đang đếm.
+    """
+
+    __slots__ = ('window', 'capacity', 'epoch', 'started', 'current', 'previous', 'previous_span')
+
+    def __init__(self, window: int = LOG_IP_WINDOW_SEC, capacity: int = LOG_IP_CAPACITY):
+        self.window = window
+        self.capacity = capacity
+        self.epoch: Optional[int] = None
+        self.started: Optional[int] = None
+        self.current: Tuple[SpaceSaving, SpaceSaving] = (SpaceSaving(capacity), SpaceSaving(capacity))
+        self.previous: Optional[Tuple[SpaceSaving, SpaceSaving]] = None
+        self.previous_span = 0
+
+    def _rotate(self, sec: int) -> None:
+        epoch = sec // self.window
+        if self.epoch is None:
+            self.epoch, self.started = epoch, sec
+        elif epoch > self.epoch:
+            # Cửa sổ vừa kết thúc chỉ dùng được nếu liền kề; lần chạy đầu chia cho số giây thực đã đếm
+            if epoch == self.epoch + 1:
+                self.previous = self.current
+                self.previous_span = epoch * self.window - self.started
+            else:
+                self.previous = None
+            self.current = (SpaceSaving(self.capacity), SpaceSaving(self.capacity))
+            self.epoch, self.started = epoch, epoch * self.window
+
+    def add(self, ip_counts: Dict[Tuple[str, str], int], sec: int) -> None:
+        """Add {(domain, ip): count} read during second sec."""
+        self._rotate(sec)
+        by_ip, by_pair = self.current
+        for pair, c in ip_counts.items():
+            by_ip[pair[1]] += c
+            by_pair[pair] += c
+
+    def add_timed(self, ip_counts: Dict[Tuple[str, str, int], int], now: int) -> None:
+        """
+        Add {(domain, ip, sec): count} bucketed by the log's own second (--by-timestamp).
+        Giây tương lai tính là now; giây thuộc cửa sổ trước vào cửa sổ đó, cũ hơn nữa bị bỏ (không dồn
+        backlog vào cửa sổ đang đếm).
+        """
+        by_sec: Dict[int, Dict[Tuple[str, str], int]] = defaultdict(lambda: defaultdict(int))
+        for (domain, ip, sec), c in ip_counts.items():
+            by_sec[min(sec, now)][(domain, ip)] += c
+        for sec in sorted(by_sec):
+            epoch = sec // self.window
+            if self.epoch is None or epoch >= self.epoch:
+                self.add(by_sec[sec], sec)
+            elif epoch == self.epoch - 1 and self.previous is not None:
+                by_ip, by_pair = self.previous
+                for pair, c in by_sec[sec].items():
+                    by_ip[pair[1]] += c
+                    by_pair[pair] += c
+
+    def top(self, limit: int, now: Optional[float] = None) -> Tuple[List[Tuple[str, float]],
+                                                                  List[Tuple[Tuple[str, str], float]]]:
+        """
+        Top IPs and top (domain, IP) by requests/sec: ([(ip, rps)], [((domain, ip), rps)]).
+        Xếp hạng theo lower_bounds() của sketch: IP vào bảng muộn không được tính phần floor thừa hưởng.
+        """
+        now = time.time() if now is None else now
+        self._rotate(int(now))
+        if self.previous is not None:
+            (by_ip, by_pair), span = self.previous, self.previous_span
+        else:
+            (by_ip, by_pair), span = self.current, max(1.0, now - self.started)
+        by_ip, by_pair = by_ip.lower_bounds(), by_pair.lower_bounds()
+        return ([(ip, c / span) for ip, c in heapq.nlargest(limit, by_ip.items(), key=itemgetter(1))],
+                [(pair, c / span) for pair, c in heapq.nlargest(limit, by_pair.items(), key=itemgetter(1))])
+
+
+def read_tail(key: str, tf: TailFile, counts: Dict, check_rotation: bool = True,
+              max_bytes: int = 0, max_lines: int = 0, fields: int = 0, sample_above: int = 0) -> Tuple[int, bool]:
+    """
+    Read new data from one tail and count it.
+    max_bytes/max_lines (0 = không giới hạn) là ngân sách mềm cho mỗi lượt đọc.
+    fields: FIELD_TIME/FIELD_IP, đếm theo tuple (domain, [giây], [ip]) thay vì theo domain.
+    sample_above: ngưỡng dòng/giây của file để lấy mẫu (xem DomainExtractor), 0 = đếm đủ.
+    Returns (number of lines, True nếu dừng vì hết ngân sách và còn dữ liệu chưa đọc).
+    """
+    ex = tf.extractor
+    if ex is None or ex.key != key or ex.fields != fields or ex.sample_above != sample_above:
+        ex = tf.extractor = DomainExtractor(key, fields, sample_above)
+
+    total_lines = 0
+    total_bytes = 0
+    more = False
+    clock = time.perf_counter_ns
+    ns = SELF_STATS.ns
+    while True:
+        t0 = clock()
+        # Text mode với backlog lớn, hoặc đang lấy mẫu vì flood, cũng nhận chunk bytes (từ mmap) và đếm
+        # như binary mode: tổng dòng từ bytes.count, không decode/tách từng dòng. Khi flood, dòng dở
+        # cuối file để lại cho lượt sau thay vì readlines()
+        raw = tf.binary or ex.flooding()
+        if tf.binary:
+            buf, end = tf.readblock(check_rotation)
+        else:
+            buf, end = tf.readmapped(check_rotation, 1 if raw else None)
+        if end or raw:
+            t1 = clock()
+            ns[STAGE_TAIL] += t1 - t0
+            if not end:
+                break
+            total_lines += ex.count_block(buf, end, counts)
+            total_bytes += end
+        else:
+            hint = max_bytes - total_bytes if max_bytes else -1
+            if max_lines:
+                hint = min(hint, TEXT_READ_HINT) if hint > 0 else TEXT_READ_HINT
+            lines = tf.readlines(check_rotation and not tf.is_open, hint)  # readmapped đã kiểm tra rotate
+            t1 = clock()
+            ns[STAGE_TAIL] += t1 - t0
+            if not lines:
+                break
+            total_lines += ex.count_lines(lines, counts)
+            total_bytes += sum(map(len, lines))
+            if not max_bytes and not max_lines:
+                ns[STAGE_EXTRACT] += clock() - t1
+                break
+        ns[STAGE_EXTRACT] += clock() - t1
+        check_rotation = False
+
+        if (max_bytes and total_bytes >= max_bytes) or (max_lines and total_lines >= max_lines):
+            more = True
+            break
+    SELF_STATS.calls[STAGE_TAIL] += 1
+    SELF_STATS.calls[STAGE_EXTRACT] += total_lines > 0
+    SELF_STATS.io[0] += total_lines
+    SELF_STATS.io[1] += total_bytes
+    return total_lines, more
+
+
+class TailReader:
+    """
+    Reads a set of tails until a deadline with per-file read budget and round-robin fairness.
+    Dùng inotify nếu có watcher, nếu không thì poll mỗi POLL_SLEEP. File còn dữ liệu chưa đọc
+    (hết ngân sách) được đưa về cuối hàng đợi và đọc tiếp ở lượt sau, không chờ sự kiện mới.
+    """
+
+    def __init__(self, tails: Dict[str, TailFile], watcher: Optional[InotifyWatcher] = None,
+                 max_bytes: int = READ_BUDGET_BYTES, max_lines: int = READ_BUDGET_LINES,
+                 manager: Optional[TailManager] = None, fields: int = 0, sample_above: int = 0):
+        self.tails = tails
+        self.watcher = watcher
+        self.manager = manager
+        self.fields = fields
+        self.sample_above = sample_above
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.lag: Dict[str, int] = {}
+        self._pending: Dict[str, bool] = {}  # key -> check_rotation, giữ thứ tự round-robin
+        self._next_poll = 0.0
+        self._watch_retry: Dict[str, float] = {}  # key watch thất bại -> lúc được thử lại (monotonic)
+
+    def add(self, key: str) -> None:
+        """Watch and schedule a newly opened tail (đọc backlog nếu --start-at-begin)."""
+        tf = self.tails.get(key)
+        if tf is not None and self.watcher is not None:
+            self._watch(key, tf.path, time.monotonic())
+        self._queue((key,), True)
+
+    def remove(self, key: str) -> None:
+        """Forget a tail that was closed (không watch, không còn trong hàng đợi/lag)."""
+        self._pending.pop(key, None)
+        self.lag.pop(key, None)
+        self._watch_retry.pop(key, None)
+        if self.watcher is not None:
+            self.watcher.unwatch(key)
+
+    def _watch(self, key: str, path: str, now: float) -> None:
+        # Watch thất bại thì chỉ thử lại sau WATCH_RETRY_SEC (trong lúc đó file được poll)
+        if self.watcher.watch(key, path):
+            self._watch_retry.pop(key, None)
+        else:
+            self._watch_retry[key] = now + WATCH_RETRY_SEC
+
+    def take_sampled(self) -> Set[str]:
+        """Domains whose counts were estimated from a sample since the last call (--sample-above)."""
+        sampled: Set[str] = set()
+        for tf in self.tails.values():
+            ex = tf.extractor
+            if ex is not None and ex.sampled:
+                sampled |= ex.sampled
+                ex.sampled = set()
+        return sampled
+
+    def _queue(self, keys, check_rotation: bool) -> None:
+        pending = self._pending
+        for key in keys:
+            if key in pending:
+                pending[key] = pending[key] or check_rotation
+            else:
+                pending[key] = check_rotation
+
+    def _read_pending(self, deadline: float, counts: Dict[str, int]) -> None:
+        """One round-robin pass over the pending queue."""
+        pending = self._pending
+        for _ in range(len(pending)):
+            if time.monotonic() >= deadline:
+                break
+            key = next(iter(pending))
+            check_rotation = pending.pop(key)
+            tf = self.tails.get(key)
+            if tf is None:
+                self.lag.pop(key, None)
+                continue
+            try:
+                n, more = read_tail(key, tf, counts, check_rotation, self.max_bytes, self.max_lines, self.fields,
+                                   self.sample_above)
+                if not n and not more and not check_rotation and self.watcher is not None:
+                    # Có thể bị truncate (copytruncate) -> kiểm tra bằng stat
+                    n, more = read_tail(key, tf, counts, True, self.max_bytes, self.max_lines, self.fields,
+                                        self.sample_above)
+            except Exception:
+                continue
+            if self.manager is not None:
+                self.manager.touch(key, n > 0)
+            if more:
+                pending[key] = False
+                self.lag[key] = tf.lag_bytes()
+            else:
+                self.lag.pop(key, None)
+
+    def _drain_rotated(self, key: str, counts: Dict[str, int]) -> None:
+        """Đọc nốt phần còn lại của file cũ rồi mở file mới."""
+        tf = self.tails.get(key)
+        if tf is None:
+            return
+        try:
+            while read_tail(key, tf, counts, False, self.max_bytes, self.max_lines, self.fields,
+                            self.sample_above)[1]:
+                pass
+        except Exception:
+            pass
+        if self.manager is not None:
+            self.manager.touch(key, True)
+        self._queue((key,), True)
+
+    def read_until(self, deadline: float, counts: Dict[str, int]) -> None:
+        """Read tails and count lines until deadline (time.monotonic())."""
+        watcher = self.watcher
+        while True:
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                break
+
+            # Poll mode: mọi file; inotify mode: chỉ file không watch được
+            # (hết max_user_watches, file tạm mất). Poll mỗi POLL_SLEEP như cũ.
+            if watcher is None:
+                polled = list(self.tails)
+            else:
+                polled = [k for k in self.tails if not watcher.is_watched(k)]
+            if polled and now >= self._next_poll:
+                self._next_poll = now + POLL_SLEEP
+                self._queue(polled, True)
+
+            if watcher is None:
+                if self._pending:
+                    self._read_pending(deadline, counts)
+                else:
+                    time.sleep(min(remaining, max(0.0, self._next_poll - now)))
+                continue
+
+            if self._pending:
+                timeout = 0.0
+            elif polled:
+                timeout = min(remaining, max(0.0, self._next_poll - now))
+            else:
+                timeout = remaining
+            modified, rotated = watcher.wait(timeout)
+
+            self._queue((k for k in modified if k not in rotated), False)
+            for key in rotated:
+                self._drain_rotated(key, counts)
+            self._read_pending(deadline, counts)
+
+            # File vừa rotate gắn watch lại ngay; file đang poll chỉ thử lại khi hết hạn back-off
+            now = time.monotonic()
+            retry = self._watch_retry
+            for key in set(rotated).union(k for k in polled if retry.get(k, 0.0) <= now):
+                tf = self.tails.get(key)
+                if tf is not None:
+                    self._watch(key, tf.path, now)
+
+
+def load_state(path: str) -> Dict[str, Tuple[str, int, int]]:
+    """Load the offset checkpoint: {key: (path, inode, offset)}; {} if missing or invalid."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != STATE_VERSION:
+            return {}
+        return {k: (str(v[0]), int(v[1]), int(v[2])) for k, v in data.get("tails", {}).items()}
+    except (OSError, ValueError, TypeError, AttributeError, IndexError):
+        return {}
+
+
+def save_state(path: str, tails: Dict[str, Tuple[str, int, int]]) -> None:
+    """Write the offset checkpoint atomically (file tạm + fsync + os.replace)."""
+    tmp = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "saved_at": time.time(),
+                       "tails": {k: list(v) for k, v in tails.items()}}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+class TailManager:
+    """
+    Owns the TailFile set: opens new logs, closes replaced/vanished ones and keeps at most
+    max_open file descriptors (đóng tail lâu không có dữ liệu nhất theo LRU, đọc tiếp từ offset khi mở lại).
+    """
+
+    def __init__(self, start_at_end: bool, binary: bool, max_open: int = 0,
+                 resume: Optional[Dict[str, Tuple[str, int, int]]] = None):
+        self.start_at_end = start_at_end
+        self.binary = binary
+        self.max_open = max_open if max_open > 0 else default_max_open()
+        self.tails: Dict[str, TailFile] = {}
+        self._lru: Dict[str, None] = {}     # tail đang mở, cũ nhất trước (dict giữ thứ tự)
+        self._resume: Dict[str, Tuple[str, int, int]] = dict(resume or {})
+
+    @property
+    def open_count(self) -> int:
+        return len(self._lru)
+
+    def sync(self, logs: Dict[str, str], reader: 'TailReader') -> None:
+        """Apply a discovered log set: close vanished/replaced tails, open new ones."""
+        for k in [k for k in self.tails if k not in logs]:
+            self.remove(k, reader)
         for k, p in logs.items():
+            tf = self.tails.get(k)
+            if tf is not None and tf.path == p:
+                continue
+            if tf is not None:
+                self.remove(k, reader)
+            saved = self._resume.pop(k, None)
             try:
-                tails[k] = TailFile(p, start_at_end)
+                tf = TailFile(p, self.start_at_end, binary=self.binary,
+                              resume=saved[1:] if saved is not None and saved[0] == p else None)
             except Exception:
+                continue
+            self.tails[k] = tf
+            self.touch(k, True)
+            reader.add(k)
+
+    def remove(self, key: str, reader: 'TailReader') -> None:
+        """Close and forget one tail."""
+        tf = self.tails.pop(key, None)
+        self._lru.pop(key, None)
+        reader.remove(key)
+        if tf is not None:
+            tf.close()
+
+    def touch(self, key: str, active: bool) -> None:
+        """Record a read of key; active = có dữ liệu mới (đưa lên cuối LRU)."""
+        tf = self.tails.get(key)
+        if tf is None or not tf.is_open:
+            self._lru.pop(key, None)
+            return
+        lru = self._lru
+        if key in lru:
+            if not active:
+                return
+            del lru[key]
+        lru[key] = None
+        while len(lru) > self.max_open:
+            oldest = next(iter(lru))
+            if oldest == key:
+                break
+            del lru[oldest]
+            victim = self.tails.get(oldest)
+            if victim is not None:
+                victim.suspend()
+
+    def offsets(self) -> Dict[str, Tuple[str, int, int]]:
+        """Checkpoint of every tail {key: (path, inode, offset)} (kèm mục chưa dùng từ file trạng thái)."""
+        out = dict(self._resume)
+        for k, tf in self.tails.items():
+            out[k] = (tf.path,) + tf.checkpoint()
+        return out
+
+    def close(self) -> None:
+        for tf in self.tails.values():
+            tf.close()
+        self.tails.clear()
+        self._lru.clear()
+
+
+def default_max_open() -> int:
+    """Half of the soft RLIMIT_NOFILE (phần còn lại cho socket, /proc, inotify...)."""
+    try:
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ValueError, OSError):
+        return 512
+    if soft == resource.RLIM_INFINITY:
+        return 4096
+    return max(16, soft // 2)
+
+
+def _ingest_worker(conn, start_at_end: bool, binary: bool, use_inotify: bool,
+                   max_bytes: int, max_lines: int, max_open: int = 0,
+                   resume: Optional[Dict[str, Tuple[str, int, int]]] = None, fields: int = 0,
+                   sample_above: int = 0) -> None:
+    """
+    Worker process: tail its shard of logs and count per domain.
+    Lệnh từ process cha: ("assign", logs) cập nhật shard, ("flush", want_offsets) gửi lại
+    (counts, lag, offsets|None, self-stats, domain lấy mẫu) tích lũy từ lần flush trước, ("stop", None) thoát.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    SELF_STATS.take()  # bỏ số đếm kế thừa từ process cha lúc fork
+    manager = TailManager(start_at_end, binary, max_open, resume)
+    watcher: Optional[InotifyWatcher] = None
+    if use_inotify and InotifyWatcher.available():
+        try:
+            watcher = InotifyWatcher()
+        except OSError:
+            watcher = None
+    reader = TailReader(manager.tails, watcher, max_bytes, max_lines, manager, fields, sample_above)
+    counts: Dict = defaultdict(int)
+
+    try:
+        while True:
+            while conn.poll():
+                cmd, payload = conn.recv()
+                if cmd == "assign":
+                    manager.sync(payload, reader)
+                elif cmd == "flush":
+                    conn.send((dict(counts), dict(reader.lag), manager.offsets() if payload else None,
+                               SELF_STATS.take(), reader.take_sampled()))
+                    counts = defaultdict(int)
+                elif cmd == "stop":
+                    return
+            reader.read_until(time.monotonic() + WORKER_SLICE_SEC, counts)
+    except (EOFError, OSError):
+        # Process cha đã thoát
+        pass
+    finally:
+        if watcher is not None:
+            watcher.close()
+        manager.close()
+
+
+class IngestPool:
+    """
+    Multi-process log ingestion (--workers N).
+    Các tail được chia shard cố định theo crc32(key) cho N worker process; mỗi khoảng đo
+    process cha gửi "flush" và gộp counters theo domain mà các worker gửi về qua Pipe.
+    """
+
+    def __init__(self, workers: int, start_at_end: bool, binary: bool, use_inotify: bool,
+                 max_bytes: int, max_lines: int, max_open: int = 0,
+                 resume: Optional[Dict[str, Tuple[str, int, int]]] = None, fields: int = 0,
+                 sample_above: int = 0):
+        self.logs: Dict[str, str] = {}
+        self.offsets: Dict[str, Tuple[str, int, int]] = {}
+        self.sampled: Set[str] = set()      # domain ước lượng từ mẫu trong lần collect gần nhất
+        self._shards: List[Dict[str, str]] = [{} for _ in range(workers)]
+        self._conns = []
+        self._procs = []
+        resume = resume or {}
+        for i in range(workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            # Mỗi worker chỉ nhận checkpoint của shard của nó (cùng cách chia như assign)
+            shard_resume = {k: v for k, v in resume.items() if zlib.crc32(k.encode()) % workers == i}
+            proc = multiprocessing.Process(
+                target=_ingest_worker,
+                args=(child_conn, start_at_end, binary, use_inotify, max_bytes, max_lines, max_open,
+                      shard_resume, fields, sample_above),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+    def assign(self, logs: Dict[str, str]) -> None:
+        """Shard discovered logs across workers, sending only changed shards."""
+        # Log biến mất khỏi kết quả khám phá cũng bị bỏ khỏi shard (worker đóng tail đó)
+        self.logs = dict(logs)
+        n = len(self._conns)
+        shards: List[Dict[str, str]] = [{} for _ in self._shards]
+        for k, p in logs.items():
+            shards[zlib.crc32(k.encode()) % n][k] = p
+        for i, shard in enumerate(shards):
+            if shard != self._shards[i]:
+                try:
+                    self._conns[i].send(("assign", shard))
+                except OSError:
+                    continue
+                self._shards[i] = shard
+
+    def collect(self, want_offsets: bool = False) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Flush all workers and merge their (counts, lag); want_offsets cập nhật self.offsets,
+        domain ước lượng từ mẫu được gộp vào self.sampled.
+        """
+        counts: Dict[str, int] = defaultdict(int)
+        lag: Dict[str, int] = {}
+        offsets: Dict[str, Tuple[str, int, int]] = {}
+        sampled: Set[str] = set()
+        live = []
+        for conn in self._conns:
+            try:
+                conn.send(("flush", want_offsets))
+                live.append(conn)
+            except OSError:
+                continue
+        for conn in live:
+            try:
+                worker_counts, worker_lag, worker_offsets, worker_stats, worker_sampled = conn.recv()
+            except (EOFError, OSError):
+                continue
+            SELF_STATS.merge(worker_stats)
+            sampled |= worker_sampled
+            for d, c in worker_counts.items():
+                counts[d] += c
+            lag.update(worker_lag)
+            if worker_offsets:
+                offsets.update(worker_offsets)
+        if want_offsets:
+            self.offsets = offsets
+        self.sampled = sampled
+        return counts, lag
+
+    def close(self) -> None:
+        """Stop worker processes."""
+        for conn in self._conns:
+            try:
+                conn.send(("stop", None))
+            except OSError:
                 pass
-        last_rediscover = 0.0
+        for proc in self._procs:
+            proc.join(timeout=1.0)
+            if proc.is_alive():
+                proc.terminate()
+        for conn in self._conns:
+            conn.close()
+
+
+# Đuôi rotate (.1, .2, -20240101, .20240101) và đuôi nén của log cũ cho --replay
+ARCHIVE_SUFFIX_RE: re.Pattern = re.compile(r"(?:[.-]\d{8}|\.\d{1,3})?(?:\.(gz|bz2|xz))?$", re.IGNORECASE)
+ARCHIVE_OPENERS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+
+def discover_archives(dir_list: List[str], max_age_sec: float,
+                      index: Optional[DiscoveryIndex] = None) -> List[Tuple[str, str]]:
+    """
+    Find every generation of the access logs (live, .1, .N.gz, -YYYYMMDD.bz2, .xz ...) for --replay.
+    Tên file bỏ đuôi rotate/nén phải khớp INCLUDE_GLOBS như log thường; key lấy domain từ tên gốc.
+    Trả về [(key, path)], file lớn trước để chia đều cho process pool.
+    """
+    if index is None:
+        index = DiscoveryIndex()
+    now = time.time()
+    found: Dict[str, Tuple[str, str, int]] = {}
+    for d in dict.fromkeys(d for pattern in dir_list for d in index.expand(pattern)):
+        try:
+            entries = list(os.scandir(d))
+        except OSError:
+            continue
+        for entry in entries:
+            name = entry.name
+            base = name[:ARCHIVE_SUFFIX_RE.search(name).start()]
+            if name.startswith(".") or not base or not INCLUDE_RE.match(base):
+                continue
+            base_path = os.path.join(d, base)
+            if is_excluded(base_path):
+                continue
+            try:
+                st = entry.stat()
+                if not entry.is_file() or now - st.st_mtime > max_age_sec:
+                    continue
+                real = os.path.realpath(entry.path)
+            except OSError:
+                continue
+            name_key = log_key(base_path).split(":", 1)[0]
+            found.setdefault(real, (f"{name_key}:{real}", real, st.st_size))
+    return [(key, path) for key, path, _size in sorted(found.values(), key=itemgetter(2), reverse=True)]
+
+
+def _write_run(counts: Dict[Tuple[str, int], int], tmp_dir: str) -> str:
+    """Write {(domain, sec): count} as a run file sorted by (sec, domain)."""
+    fd, path = tempfile.mkstemp(prefix="run-", suffix=".tsv", dir=tmp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        # Giây 0 = dòng không có timestamp, không thuộc chuỗi thời gian
+        f.writelines(f"{sec}\t{d}\t{c}\n" for (sec, d), c in sorted((k[::-1], c) for k, c in counts.items() if k[1]))
+    return path
+
+
+def _read_run(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            sec, d, c = line.rstrip("\n").split("\t")
+            yield int(sec), d, int(c)
 
-    # Process --topip argument
-    topip_enabled = args.topip is not None
-    topip_threshold = args.topip if args.topip is not None else 5
-    TOPIP_LIMIT = 5
 
+def _merged(paths: List[str]):
+    """K-way merge of sorted runs, summing equal (sec, domain)."""
+    last_sec, last_d, total = None, None, 0
+    for sec, d, c in heapq.merge(*(_read_run(p) for p in paths)):
+        if sec == last_sec and d == last_d:
+            total += c
+            continue
+        if last_sec is not None:
+            yield last_sec, last_d, total
+        last_sec, last_d, total = sec, d, c
+    if last_sec is not None:
+        yield last_sec, last_d, total
+
+
+def replay_file(task: Tuple[str, str, str]) -> Tuple[str, int, List[str], Optional[str]]:
+    """
+    Count one (possibly compressed) log per (domain, second) from its timestamps (process pool worker).
+    Đọc theo khối REPLAY_BLOCK_SIZE đã giải nén vào một bytearray tái sử dụng; khi bảng đếm vượt
+    REPLAY_RUN_KEYS thì ghi ra một run đã sắp xếp, nên bộ nhớ không phụ thuộc kích thước file.
+    Returns (path, số dòng, các run file, lỗi hoặc None).
+    """
+    key, path, tmp_dir = task
+    suffix = ARCHIVE_SUFFIX_RE.search(path).group(1)
+    opener = ARCHIVE_OPENERS.get(suffix.lower()) if suffix else None
+    ex = DomainExtractor(key, FIELD_TIME)
+    ex.undated_sec = 0                    # dòng không có timestamp không thuộc giây nào -> bỏ
+    counts: Dict[Tuple[str, int], int] = defaultdict(int)
+    runs: List[str] = []
+    lines = 0
+    buf = bytearray(REPLAY_BLOCK_SIZE)
+    view = memoryview(buf)
+    fill = 0
     try:
+        with (opener or open)(path, "rb") as f:
+            while True:
+                n = f.readinto(view[fill:])
+                if not n:
+                    break
+                fill += n
+                end = buf.rfind(b"\n", 0, fill) + 1
+                if not end:
+                    if fill < len(buf):
+                        continue
+                    end = fill               # dòng dài hơn cả khối
+                lines += ex.count_block(buf, end, counts)
+                rest = fill - end
+                buf[:rest] = buf[end:fill]
+                fill = rest
+                if len(counts) >= REPLAY_RUN_KEYS:
+                    runs.append(_write_run(counts, tmp_dir))
+                    counts = defaultdict(int)
+            if fill:
+                lines += ex.count_block(buf, fill, counts)
+    except (OSError, EOFError, lzma.LZMAError) as e:
+        error: Optional[str] = f"{type(e).__name__}: {e}"
+    else:
+        error = None
+    view.release()
+    if counts:
+        runs.append(_write_run(counts, tmp_dir))
+    return path, lines, runs, error
+
+
+def replay(dir_list: List[str], output: str, workers: int = 0, days: float = REPLAY_DAYS) -> Tuple[int, int, int]:
+    """
+    --replay: rebuild the per-second, per-domain request series from rotated/compressed logs.
+    File được xử lý song song trên process pool; các run đã sắp xếp được trộn k-way (tối đa
+    REPLAY_MERGE_FANIN file mở cùng lúc) thành CSV "epoch,time_utc,domain,requests" theo thời gian.
+    Returns (số file, số dòng, số hàng CSV).
+    """
+    archives = discover_archives(dir_list, days * 86400)
+    out_dir = os.path.dirname(os.path.abspath(output))
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    total_lines = 0
+    with tempfile.TemporaryDirectory(prefix=".replay-", dir=out_dir) as tmp_dir:
+        tasks = [(key, path, tmp_dir) for key, path in archives]
+        runs: List[str] = []
+        pool = multiprocessing.Pool(min(workers, max(1, len(tasks)))) if workers > 1 and len(tasks) > 1 else None
+        try:
+            results = pool.imap_unordered(replay_file, tasks) if pool is not None else map(replay_file, tasks)
+            for i, (path, lines, file_runs, error) in enumerate(results, 1):
+                total_lines += lines
+                runs.extend(file_runs)
+                status = f"lỗi {error}" if error else f"{lines} dòng"
+                print(f"  [{i}/{len(tasks)}] {path}: {status}", file=sys.stderr, flush=True)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # Trộn nhiều tầng nếu quá nhiều run (giới hạn số file mở cùng lúc)
+        while len(runs) > REPLAY_MERGE_FANIN:
+            merged = []
+            for i in range(0, len(runs), REPLAY_MERGE_FANIN):
+                group = runs[i:i + REPLAY_MERGE_FANIN]
+                fd, path = tempfile.mkstemp(prefix="run-", suffix=".tsv", dir=tmp_dir)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.writelines(f"{sec}\t{d}\t{c}\n" for sec, d, c in _merged(group))
+                for p in group:
+                    os.unlink(p)
+                merged.append(path)
+            runs = merged
+
+        rows = 0
+        tmp_out = output + ".tmp"
+        with open(tmp_out, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("epoch", "time_utc", "domain", "requests"))
+            last_sec, stamp = None, ""
+            for sec, d, c in _merged(runs):
+                if sec != last_sec:
+                    last_sec, stamp = sec, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(sec))
+                writer.writerow((sec, stamp, d, c))
+                rows += 1
+        os.replace(tmp_out, output)
+    return len(archives), total_lines, rows
+
+
+def _prom_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_prometheus(payload: Dict) -> bytes:
+    """Format an exporter snapshot as Prometheus text exposition (version 0.0.4)."""
+    p = METRIC_PREFIX
+    out: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str, samples) -> None:
+        out.append(f"# HELP {p}_{name} {help_text}")
+        out.append(f"# TYPE {p}_{name} {kind}")
+        for labels, value in samples:
+            tag = ",".join(f'{k}="{_prom_label(v)}"' for k, v in labels.items())
+            out.append(f"{p}_{name}{{{tag}}} {value}" if tag else f"{p}_{name} {value}")
+
+    conn = payload["connections"]
+    metric("connections", "gauge", "TCP connections by kind",
+           [({"kind": k, "source": conn["source"]}, conn[k])
+            for k in ("port_80", "port_443", "established", "syn_recv")])
+    if payload.get("domains") is not None:
+        metric("domain_rps", "gauge", "Per-domain requests per second over a sliding window",
+               [({"domain": row["domain"], "window": f"{w}s"}, f"{row['rps'][i]:.3f}")
+                for row in payload["domains"] for i, w in enumerate(RATE_WINDOWS)])
+        metric("domain_peak_rps", "gauge", "Per-domain peak 1-second request count in the window",
+               [({"domain": row["domain"]}, row["peak"]) for row in payload["domains"]])
+        metric("domain_rps_estimated", "gauge", "1 if the domain rates are scaled up from a line sample",
+               [({"domain": row["domain"]}, 1) for row in payload["domains"] if row.get("estimated")])
+        metric("logs_tracked", "gauge", "Access log files being tailed", [({}, payload["logs"])])
+        metric("discovery_seconds", "gauge", "Duration of the last log discovery pass",
+               [({}, f"{payload['discovery_seconds']:.6f}")])
+        metric("log_lag_bytes", "gauge", "Unread bytes of log files that are behind",
+               [({"path": path}, lag) for path, lag in payload["lag_bytes"].items()])
+    if payload.get("top_ips") is not None:
+        metric("top_ip_connections", "gauge", "Connections of the top remote IPs",
+               [({"group": group, "ip": item["ip"]}, item["count"])
+                for group, items in payload["top_ips"].items() for item in items])
+    if payload.get("log_ips") is not None:
+        metric("log_ip_rps", "gauge", "Requests per second of the top client IPs seen in access logs",
+               [({"ip": item["ip"]}, f"{item['rps']:.3f}") for item in payload["log_ips"]["ip"]])
+        metric("log_domain_ip_rps", "gauge", "Requests per second of the top (domain, client IP) pairs",
+               [({"domain": item["domain"], "ip": item["ip"]}, f"{item['rps']:.3f}")
+                for item in payload["log_ips"]["domain_ip"]])
+    own = payload.get("self")
+    if own is not None:
+        metric("self_stage_seconds_total", "counter", "Time the monitor spent in each of its own stages",
+               [({"stage": name}, f"{st['seconds_total']:.6f}") for name, st in own["stages"].items()])
+        metric("self_log_lines_total", "counter", "Access log lines read by the monitor", [({}, own["lines_total"])])
+        metric("self_log_bytes_total", "counter", "Access log bytes read by the monitor", [({}, own["bytes_total"])])
+        if own["cpu_seconds_total"] is not None:
+            metric("self_cpu_seconds_total", "counter", "CPU time of the monitor processes",
+                   [({}, f"{own['cpu_seconds_total']:.2f}")])
+        metric("self_rss_bytes", "gauge", "Resident memory of the monitor processes", [({}, own["rss_bytes"])])
+        if own["open_fds"] is not None:
+            metric("self_open_fds", "gauge", "Open file descriptors of the monitor processes",
+                   [({}, own["open_fds"])])
+    metric("snapshot_timestamp_seconds", "gauge", "Unix time the snapshot was taken",
+           [({}, f"{payload['time']:.3f}")])
+    out.append("")
+    return "\n".join(out).encode("utf-8")
+
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    """Serve the exporter's pre-rendered bodies; never touches the collectors."""
+
+    server_version = "httpmon"
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        bodies = self.server.exporter.bodies
+        if path == "/metrics":
+            ctype, body = "text/plain; version=0.0.4; charset=utf-8", bodies[0]
+        elif path == "/json":
+            ctype, body = "application/json", bodies[1]
+        else:
+            self.send_error(404)
+            return
+        if body is None:
+            self.send_error(503, "no snapshot yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class MetricsExporter:
+    """
+    Local HTTP endpoint for --serve: /metrics (Prometheus text) và /json.
+    Vòng lặp chính publish() snapshot mỗi chu kỳ; server (luồng nền) chỉ trả bytes đã render sẵn,
+    một request không bao giờ chạy lại việc thu thập số liệu.
+    """
+
+    def __init__(self, port: int, host: str = SERVE_HOST):
+        self.bodies: Tuple[Optional[bytes], Optional[bytes]] = (None, None)
+        self._server = ThreadingHTTPServer((host, port), _ExporterHandler)
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name="exporter", daemon=True)
+
+    def start(self) -> None:
+        """Serve in a background thread."""
+        self._thread.start()
+
+    def publish(self, payload: Dict) -> None:
+        """Render a snapshot once; gán một tuple nên luồng server luôn thấy cặp body nhất quán."""
+        self.bodies = (render_prometheus(payload),
+                       json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
+
+
+def build_export(stats: ConnectionStats, rows: Optional[List[Tuple[str, List[float], int]]],
+                 top_ips: Optional[Dict[str, List[IPCount]]], lag: Dict[str, int],
+                 tails: Dict[str, TailFile], discoverer: Optional[BackgroundDiscovery],
+                 log_ips: Optional[Tuple[List[Tuple[str, float]], List[Tuple[Tuple[str, str], float]]]] = None,
+                 self_stats: Optional[Dict] = None, sampled: Optional[Set[str]] = None) -> Dict:
+    """Build the exporter payload (also the /json body) from one collection tick."""
+    payload: Dict = {
+        "time": time.time(),
+        "connections": {
+            "source": stats.source,
+            "port_80": stats.port_80,
+            "port_443": stats.port_443,
+            "established": stats.established,
+            "syn_recv": stats.syn_recv,
+        },
+        "windows": list(RATE_WINDOWS),
+        "domains": None,
+        "top_ips": None,
+        "log_ips": None,
+        "self": self_stats,
+    }
+    if rows is not None:
+        sampled = sampled or set()
+        payload["domains"] = [{"domain": d, "rps": [round(r, 3) for r in rps], "peak": peak,
+                               "estimated": d in sampled} for d, rps, peak in rows]
+        payload["logs"] = discoverer.count if discoverer is not None else 0
+        payload["discovery_seconds"] = discoverer.duration if discoverer is not None else 0.0
+        payload["lag_bytes"] = {
+            (tails[key].path if key in tails else key.split(":", 1)[-1]): n for key, n in lag.items()
+        }
+    if log_ips is not None:
+        by_ip, by_pair = log_ips
+        payload["log_ips"] = {
+            "ip": [{"ip": ip, "rps": round(rps, 3)} for ip, rps in by_ip],
+            "domain_ip": [{"domain": d, "ip": ip, "rps": round(rps, 3)} for (d, ip), rps in by_pair],
+        }
+    if top_ips is not None:
+        # Khóa máy đọc được thay cho nhãn hiển thị của TOP_IP_LABELS
+        payload["top_ips"] = {group: [{"ip": item.ip, "count": item.count} for item in top_ips[label]]
+                              for group, label in zip(("port_80", "port_443", "established"), TOP_IP_LABELS)}
+    return payload
+
+
+class MonitorCore:
+    """
+    asyncio core: các task độc lập, mỗi task một nhịp riêng, cùng ghi vào một kho số liệu chung.
+      - ingest: đọc log theo từng giây (luồng executor riêng) -> RateRing
+      - connections: snapshot bảng kết nối mỗi --net-interval (luồng executor riêng)
+      - discovery: tái khám phá log mỗi --rediscover (executor mặc định)
+      - output: màn hình hoặc exporter HTTP mỗi --interval, chỉ đọc số liệu đã có
+    Việc chặn lâu ở một nguồn (parse /proc/net chậm, log trên NFS bị treo) không làm trễ các task khác.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.show_domains = not args.no_domains
+        self.topip_enabled = args.topip is not None
+        self.topip_threshold = args.topip if args.topip is not None else 5
+        start_at_end = not args.start_at_begin
+        max_read_bytes = int(args.max_read_mb * 1024 * 1024)
+        self.fields = (FIELD_TIME if args.by_timestamp else 0) | (FIELD_IP if args.log_ips else 0)
+
+        # Initialize log tails (tiếp tục từ file trạng thái nếu có --state)
+        state = load_state(args.state) if args.state else {}
+        self.manager = TailManager(start_at_end, args.binary, args.max_open, state)
+        self.tails = self.manager.tails
+        self.watcher: Optional[InotifyWatcher] = None
+        self.pool: Optional[IngestPool] = None
+        if self.show_domains and args.workers > 1:
+            # Tạo worker trước khi khởi tạo thread pool (fork an toàn hơn)
+            self.pool = IngestPool(args.workers, start_at_end, args.binary, not args.no_inotify,
+                                   max_read_bytes, args.max_read_lines, args.max_open, state, self.fields,
+                                   args.sample_above)
+        elif self.show_domains and not args.no_inotify and InotifyWatcher.available():
+            try:
+                self.watcher = InotifyWatcher()
+            except OSError:
+                self.watcher = None
+        self.reader = TailReader(self.tails, self.watcher, max_read_bytes, args.max_read_lines,
+                                 self.manager, self.fields, args.sample_above)
+
+        self.net_monitor = NetworkMonitor(args.net_backend, with_ips=self.topip_enabled,
+                                          max_ips=args.topip_max_ips)
+        self.discoverer: Optional[BackgroundDiscovery] = None
+        if self.show_domains:
+            dir_list = list(dict.fromkeys((args.dir or []) + CANDIDATE_DIRS))
+            self.discoverer = BackgroundDiscovery(dir_list, args.rediscover)
+
+        # Kho số liệu chung: chỉ được ghi trên luồng event loop
+        self.rates = RateRing()
+        self.log_ips: Optional[LogIPRates] = LogIPRates(capacity=args.log_ip_max) if args.log_ips else None
+        self.conn: Optional[ConnSnapshot] = None
+        self.lag: Dict[str, int] = {}
+        self.tracked: List[str] = []
+
+        # Mỗi nguồn chặn được một luồng riêng để không giữ chân nhau
+        self._ingest_ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._net_ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="net")
+        self.exporter: Optional[MetricsExporter] = None
+        self.screen: Optional[ScreenRenderer] = None
+        self.self_stats: Optional[Dict] = None
+        self.sampled: Set[str] = set()      # domain có RPS ước lượng từ mẫu (--sample-above)
+        # --profile: một cProfile cho mỗi luồng chạy công việc của monitor (cProfile chỉ đo luồng bật nó)
+        self.profiles: Optional[Dict[int, cProfile.Profile]] = {} if args.profile else None
+        if self.profiles is not None and self.discoverer is not None:
+            discover_now = self.discoverer.discover_now
+            self.discoverer.discover_now = lambda: self._call(discover_now)
+
+    def _call(self, fn, *args):
+        """Run fn on the calling thread, under that thread's profiler when --profile is on."""
+        if self.profiles is None:
+            return fn(*args)
+        prof = self.profiles.get(threading.get_ident())
+        if prof is None:
+            prof = self.profiles[threading.get_ident()] = cProfile.Profile()
+        prof.enable()
+        try:
+            return fn(*args)
+        finally:
+            prof.disable()
+
+    def _sample(self) -> ConnSnapshot:
+        """Take a fresh connection snapshot (luồng net), timed for --self-stats."""
+        t0 = time.perf_counter_ns()
+        snap = self.net_monitor.snapshot(0.0)
+        SELF_STATS.add(STAGE_NET, time.perf_counter_ns() - t0)
+        return snap
+
+    def _apply_logs(self, logs: Dict[str, str]) -> List[str]:
+        """Apply a discovered log set (chạy trên luồng ingest, giữa hai bước đọc)."""
+        if self.pool is not None:
+            self.pool.assign(logs)
+            return list(self.pool.logs.values())
+        self.manager.sync(logs, self.reader)
+        return [tf.path for tf in self.tails.values()]
+
+    def _ingest_step(self, deadline: float, checkpoint: bool) -> Tuple[Dict, Dict[str, int], Set[str]]:
+        """Read until deadline and return (counts, lag, domain lấy mẫu); ghi checkpoint nếu đến hạn."""
+        counts: Dict = defaultdict(int)
+        if self.pool is not None:
+            # Worker đếm liên tục, process cha chỉ chờ hết bước rồi gộp kết quả
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            counts, lag = self.pool.collect(want_offsets=checkpoint)
+            sampled = self.pool.sampled
+        else:
+            self.reader.read_until(deadline, counts)
+            lag = dict(self.reader.lag)
+            sampled = self.reader.take_sampled()
+        if checkpoint:
+            save_state(self.args.state, self.pool.offsets if self.pool is not None else self.manager.offsets())
+        return counts, lag, sampled
+
+    async def _ingest(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_checkpoint = time.monotonic()
         while True:
-            t0 = time.time()
-            counts: Dict[str, int] = defaultdict(int)
-
-            if show_domains:
-                # Read log files during interval
-                while time.time() - t0 < interval:
-                    for key, tf in list(tails.items()):
-                        try:
-                            lines = tf.readlines()
-                        except Exception:
-                            continue
-                        is_apache_vhosts = key.startswith("__apache_vhosts__:")
-                        for ln in lines:
-                            dom = extract_domain(ln, key, is_apache_vhosts)
-                            counts[dom] += 1
-                    time.sleep(POLL_SLEEP)
+            # Mỗi bước đọc kết thúc ở ranh giới giây
+            t0 = time.monotonic()
+            sec = int(time.time())
+            deadline = max(t0 + (sec + 1 - time.time()), t0 + POLL_SLEEP)
+            checkpoint = bool(self.args.state) and deadline - last_checkpoint >= CHECKPOINT_SEC
+            if checkpoint:
+                last_checkpoint = deadline
+            counts, self.lag, sampled = await loop.run_in_executor(self._ingest_ex, self._call, self._ingest_step,
+                                                                   deadline, checkpoint)
+            if self.log_ips is not None:
+                counts, ip_counts = split_ip_counts(counts, self.fields)
+                if self.args.by_timestamp:
+                    self.log_ips.add_timed(ip_counts, sec)
+                else:
+                    self.log_ips.add(ip_counts, sec)
+            if self.args.by_timestamp:
+                # Mỗi request vào đúng giây ghi trong log (backlog cũ hơn cửa sổ bị bỏ qua)
+                self.rates.advance(sec)
+                self.rates.add_timed(counts, sec)
             else:
-                # Just wait for interval
-                remaining = interval - (time.time() - t0)
-                if remaining > 0:
-                    time.sleep(remaining)
-
-            # Rediscover log files periodically
-            if show_domains and last_rediscover is not None:
-                now = time.time()
-                if now - last_rediscover >= rediscover:
-                    last_rediscover = now
-                    latest = discover_logs(dir_list)
-                    for k, p in latest.items():
-                        if k not in tails or p != tails[k].path:
-                            try:
-                                tails[k] = TailFile(p, start_at_end)
-                            except Exception:
-                                pass
-
-            # ===== Render =====
-            clear_screen()
-
-            # 1) Connection overview
-            stats = net_monitor.get_stats()
-            print(f"Tình trạng kết nối ({stats.source}):")
-            print(f"  {'Kết nối :80':<17}: {stats.port_80}")
-            print(f"  {'Kết nối :443':<17}: {stats.port_443}")
-            print(f"  {'ESTABLISHED':<17}: {stats.established}")
-            print(f"  {'SYN_RECV':<17}: {stats.syn_recv}")
-
-            # 2) Domain table
-            if show_domains:
-                print("\nThống kê kết nối theo miền (real-time)\n")
-                print(f"{'Domain':<32}{'RPS':>6}")
-                print("-" * 40)
-                rows = [(d, int(round(counts.get(d, 0) / interval))) for d in counts.keys()]
-                if not args.show_zero:
-                    rows = [(d, r) for d, r in rows if r > 0]
-                rows.sort(key=lambda x: x[1], reverse=True)
-                shown = 0
-                for d, r in rows:
-                    name = (d[:30] + "…") if len(d) > 30 else d
-                    print(f"{name:<32}{r:>6d}")
-                    shown += 1
-                    if shown >= MAX_ROWS:
-                        break
-                if shown == 0:
-                    print("(chưa ghi nhận request mới trong khoảng đo)")
-
-            # 3) Top IPs
-            if topip_enabled:
-                print(f"\nTop IP kết nối (ngưỡng > {topip_threshold}, tối đa {TOPIP_LIMIT} IP)")
-                top_ips = net_monitor.get_top_ips(threshold=topip_threshold, limit=TOPIP_LIMIT)
-
-                for label in ("Top IP :80", "Top IP :443", "Top IP ESTABLISHED"):
-                    print(f"\n{label}")
-                    print("-" * 40)
-                    ip_list = top_ips.get(label, [])
-                    if not ip_list:
-                        print("(không có dữ liệu đạt ngưỡng)")
-                    else:
-                        for ip_count in ip_list:
-                            print(f"  {ip_count.count:>6}  {ip_count.ip}")
-
-            # 4) Log file list
-            if show_domains and args.logfile:
-                print("\nĐang theo dõi các file log (rút gọn):")
-                seen: Set[str] = set()
-                cnt = 0
-                for _, tf in tails.items():
-                    p = os.path.abspath(tf.path)
-                    if p in seen:
-                        continue
-                    seen.add(p)
-                    print("  -", p)
-                    cnt += 1
-                    if cnt >= 20:
-                        break
-                if len(seen) > cnt:
-                    print(f"  ... và {len(seen) - cnt} file khác")
+                self.rates.add(counts, sec)
+            if sampled:
+                self.rates.mark_sampled(sampled, sec)
+
+            # Áp dụng tập log mới nếu task khám phá vừa công bố
+            latest = self.discoverer.take()
+            if latest is not None:
+                self.tracked = await loop.run_in_executor(self._ingest_ex, self._call, self._apply_logs, latest)
+
+    async def _sample_connections(self) -> None:
+        loop = asyncio.get_running_loop()
+        period = self.args.net_interval
+        next_at = time.monotonic()
+        while True:
+            next_at += period
+            try:
+                self.conn = await loop.run_in_executor(self._net_ex, self._call, self._sample)
+            except Exception:
+                pass
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            if next_at < time.monotonic():
+                next_at = time.monotonic()
+
+    async def _output(self) -> None:
+        interval = self.args.interval
+        next_at = time.monotonic()
+        ticks = 0
+        while not self.args.profile or ticks < self.args.profile:
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            if next_at < time.monotonic():
+                next_at = time.monotonic()
+            ticks += 1
+            self._call(self._output_tick)
+
+    def _output_tick(self) -> None:
+        """Publish or draw one frame (luồng event loop), timed as the render stage."""
+        t0 = time.perf_counter_ns()
+        if self.args.self_stats or self.exporter is not None:
+            pids = [os.getpid()] + ([proc.pid for proc in self.pool._procs] if self.pool is not None else [])
+            self.self_stats = SELF_STATS.sample(pids)
+        rows = None
+        self.sampled = set()
+        if self.show_domains:
+            self.rates.advance(int(time.time()))
+            if self.args.sample_above:
+                self.sampled = self.rates.sampled()
+            # Terminal chỉ cần top MAX_ROWS (chọn bằng heap); exporter nhận đủ mọi domain
+            rows = (self.rates.rows() if self.exporter is not None
+                    else self.rates.rows(MAX_ROWS, nonzero=not self.args.show_zero))
+        if self.exporter is not None:
+            # Headless: chỉ cập nhật snapshot cho /metrics và /json
+            self.exporter.publish(build_export(
+                self.conn.stats, rows,
+                self.conn.top_ips(threshold=self.topip_threshold, limit=TOPIP_LIMIT)
+                if self.topip_enabled else None,
+                self.lag, self.tails, self.discoverer,
+                self.log_ips.top(LOG_IP_EXPORT_LIMIT) if self.log_ips is not None else None,
+                self.self_stats, self.sampled))
+        else:
+            self.screen.frame(self.render(rows))
+        SELF_STATS.add(STAGE_RENDER, time.perf_counter_ns() - t0)
+
+    def render(self, rows: Optional[List[Tuple[str, List[float], int]]]) -> str:
+        """Build one terminal frame from the shared metrics store."""
+        args = self.args
+        snap = self.conn
+        stats = snap.stats
+        out: List[str] = []
+
+        # 1) Connection overview
+        age = time.monotonic() - snap.taken_at
+        out.append(f"Tình trạng kết nối ({stats.source}, cập nhật {age:.1f}s trước, "
+                   f"lấy mẫu mỗi {args.net_interval:g}s):")
+        out.append(f"  {'Kết nối :80':<17}: {stats.port_80}")
+        out.append(f"  {'Kết nối :443':<17}: {stats.port_443}")
+        out.append(f"  {'ESTABLISHED':<17}: {stats.established}")
+        out.append(f"  {'SYN_RECV':<17}: {stats.syn_recv}")
+
+        # 2) Domain table
+        if rows is not None:
+            discoverer = self.discoverer
+            basis = "theo timestamp trong log" if args.by_timestamp else "theo thời điểm đọc"
+            out.append(f"\nThống kê kết nối theo miền (real-time, RPS trượt 1s/10s/60s, {basis})")
+            out.append(f"Làm mới mỗi {args.interval:g}s | khám phá log: {discoverer.count} file "
+                       f"trong {discoverer.duration * 1000:.0f} ms (chạy nền mỗi {args.rediscover:g}s)\n")
+            out.append(f"{'Domain':<32}{'1s':>7}{'10s':>9}{'60s':>9}{'Đỉnh':>7}")
+            out.append("-" * 64)
+            sampled = self.sampled
+            for d, (r1, r10, r60), peak in rows[:MAX_ROWS]:
+                name = (d[:30] + "…") if len(d) > 30 else d
+                mark = " ~" if d in sampled else ""
+                out.append(f"{name:<32}{r1:>7.0f}{r10:>9.1f}{r60:>9.1f}{peak:>7d}{mark}")
+            if not rows:
+                out.append("(chưa ghi nhận request mới trong khoảng đo)")
+            elif sampled:
+                out.append(f"~ = ước lượng từ mẫu dòng (quá {args.sample_above} dòng/giây một file), "
+                           f"tổng số dòng vẫn chính xác")
+
+        # 2b) Backlog (lag) của các file đang đọc chậm hơn tốc độ ghi
+        if rows is not None and self.lag:
+            out.append(f"\nLog đang đọc chậm (lag, tối đa {LAG_MAX_ROWS} file)")
+            out.append("-" * 40)
+            lagging = sorted(self.lag.items(), key=lambda x: x[1], reverse=True)
+            for key, nbytes in lagging[:LAG_MAX_ROWS]:
+                tf = self.tails.get(key)
+                path = tf.path if tf is not None else key.split(":", 1)[-1]
+                out.append(f"  {nbytes / (1024 * 1024):>8.1f} MB  {path}")
+
+        # 3) Top IPs
+        if self.topip_enabled:
+            out.append(f"\nTop IP kết nối (ngưỡng > {self.topip_threshold}, tối đa {TOPIP_LIMIT} IP)")
+            top_ips = snap.top_ips(threshold=self.topip_threshold, limit=TOPIP_LIMIT)
+
+            for label in TOP_IP_LABELS:
+                out.append(f"\n{label}")
+                out.append("-" * 40)
+                ip_list = top_ips.get(label, [])
+                if not ip_list:
+                    out.append("(không có dữ liệu đạt ngưỡng)")
+                else:
+                    for ip_count in ip_list:
+                        out.append(f"  {ip_count.count:>6}  {ip_count.ip}")
+
+        # 3b) Top IP theo số request trong log (gồm cả HTTP/2, keep-alive dùng chung một socket)
+        if self.log_ips is not None:
+            by_ip, by_pair = self.log_ips.top(TOPIP_LIMIT)
+            out.append(f"\nTop IP theo request trong log (req/s, cửa sổ {self.log_ips.window}s, "
+                       f"tối đa {TOPIP_LIMIT} IP)")
+            out.append("-" * 40)
+            if not by_ip:
+                out.append("(chưa có dòng log nào có IP)")
+            for ip, rps in by_ip:
+                out.append(f"  {rps:>8.1f}  {ip}")
+            out.append("\nTop domain + IP theo request trong log (req/s)")
+            out.append("-" * 64)
+            if not by_pair:
+                out.append("(chưa có dòng log nào có IP)")
+            for (d, ip), rps in by_pair:
+                name = (d[:30] + "…") if len(d) > 30 else d
+                out.append(f"  {rps:>8.1f}  {name:<32} {ip}")
+
+        # 3c) Chi phí của chính monitor: số liệu có đáng tin khi máy đang quá tải không
+        own = self.self_stats
+        if args.self_stats and own is not None:
+            out.append(f"\nChi phí của monitor ({own['processes']} process, {own['interval_seconds']:.1f}s gần nhất)")
+            out.append("-" * 40)
+            out.append(f"  {'Stage':<10}{'ms':>10}{'% thời gian':>13}{'lượt':>7}")
+            for name, st in own["stages"].items():
+                out.append(f"  {name:<10}{st['ms']:>10.1f}{st['share'] * 100:>12.1f}%{st['calls']:>7}")
+            out.append(f"  Log đã đọc : {own['lines_per_sec']:,.0f} dòng/s, "
+                       f"{own['bytes_per_sec'] / (1024 * 1024):.2f} MB/s")
+            cpu = f"{own['cpu_percent']:.1f}%" if own["cpu_percent"] is not None else "-"
+            fds = own["open_fds"] if own["open_fds"] is not None else "-"
+            out.append(f"  CPU {cpu} | RSS {own['rss_bytes'] / (1024 * 1024):.1f} MB | FD mở {fds}")
+
+        # 4) Log file list
+        if rows is not None and args.logfile:
+            out.append("\nĐang theo dõi các file log (rút gọn):")
+            seen: Set[str] = set()
+            cnt = 0
+            for path in self.tracked:
+                p = os.path.abspath(path)
+                if p in seen:
+                    continue
+                seen.add(p)
+                out.append(f"  - {p}")
+                cnt += 1
+                if cnt >= 20:
+                    break
+            if len(seen) > cnt:
+                out.append(f"  ... và {len(seen) - cnt} file khác")
+
+        return "\n".join(out)
+
+    async def run(self) -> None:
+        """Start every task and run until cancelled (Ctrl+C)."""
+        loop = asyncio.get_running_loop()
+        # Lần đầu khám phá và lấy mẫu kết nối trước khi bắt đầu, để frame đầu tiên có số liệu
+        if self.discoverer is not None:
+            logs = await loop.run_in_executor(None, self.discoverer.discover_now)
+            self.tracked = await loop.run_in_executor(self._ingest_ex, self._apply_logs, logs)
+        self.conn = await loop.run_in_executor(self._net_ex, self._call, self._sample)
+
+        if self.args.serve is not None:
+            self.exporter = MetricsExporter(self.args.serve, self.args.bind)
+            self.exporter.start()
+            host, port = self.exporter.address[:2]
+            print(f"Đang phục vụ http://{host}:{port}/metrics và /json "
+                  f"(làm mới mỗi {self.args.interval:g}s)", flush=True)
+        else:
+            self.screen = ScreenRenderer()
+
+        tasks = [self._sample_connections(), self._output()]
+        if self.discoverer is not None:
+            tasks += [self._ingest(), self.discoverer.run()]
+        # Chỉ output kết thúc được (--profile TICKS): dừng các task còn lại
+        tasks = [asyncio.ensure_future(t) for t in tasks]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    def close(self) -> None:
+        """Stop reading, save offsets (--state) and release every resource."""
+        # Chờ bước đọc đang dở (tối đa ~1 giây) trước khi đóng các tail mà nó đang dùng
+        self._ingest_ex.shutdown(wait=True)
+        if self.show_domains and self.args.state:
+            if self.pool is not None:
+                self.pool.collect(want_offsets=True)
+                save_state(self.args.state, self.pool.offsets)
+            else:
+                save_state(self.args.state, self.manager.offsets())
+        if self.exporter is not None:
+            self.exporter.close()
+        self._net_ex.shutdown(wait=False)
+        self.net_monitor.shutdown()
+        if self.pool is not None:
+            self.pool.close()
+        if self.watcher is not None:
+            self.watcher.close()
+        self.manager.close()
+
+    def dump_profile(self) -> None:
+        """Write the merged --profile stats to PROFILE_OUT and print the top functions."""
+        profiles = [prof for prof in (self.profiles or {}).values()]
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0], stream=sys.stderr)
+        for prof in profiles[1:]:
+            stats.add(prof)
+        stats.dump_stats(PROFILE_OUT)
+        print(f"\ncProfile {self.args.profile} lượt ({len(profiles)} luồng) -> {PROFILE_OUT}", file=sys.stderr)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+
 
+def main() -> None:
+    """Main entry point."""
+    args = parse_args()
+    if args.replay:
+        # Chế độ batch: dựng lại chuỗi RPS theo giây từ log cũ rồi thoát
+        dir_list = list(dict.fromkeys((args.dir or []) + CANDIDATE_DIRS))
+        t0 = time.monotonic()
+        files, lines, rows = replay(dir_list, args.replay, args.workers, args.replay_days)
+        print(f"Đã xử lý {files} file, {lines} dòng -> {rows} hàng (giây, domain) trong "
+              f"{time.monotonic() - t0:.1f}s: {args.replay}")
+        return
+    core = MonitorCore(args)
+    try:
+        asyncio.run(core.run())
     finally:
-        # Cleanup
-        net_monitor.shutdown()
-        for tf in tails.values():
-            tf.close()
+        core.close()
+        core.dump_profile()
 
 
 if __name__ == "__main__":
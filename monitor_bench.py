@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark cho các hot path của monitor.py
+Chạy cùng thư mục với monitor.py:
+
+  python3 monitor_bench.py tail [--size-mb 1024] [--chunk-mb 1]
+      So sánh TailFile text (readlines + extract_domain), text đọc bù qua mmap (readmapped + count_block)
+      và binary (readblock + count_block) trên một access log tổng hợp.
+
+  python3 monitor_bench.py extract [--lines 200000] [--by-timestamp] [--log-ips]
+      Lines/sec của extract_domain() từng dòng so với DomainExtractor cho mỗi format log
+      (--by-timestamp: thêm strptime từng dòng so với parse_log_time có cache).
+
+  python3 monitor_bench.py proc-net [--rows 10000 100000 1000000]
+      Parser /proc/net/tcp{,6} cũ so với parser theo cột (pure-Python và NumPy) trên bảng tổng hợp.
+
+  python3 monitor_bench.py net-backends [--sockets 1000 10000 30000] [--port 80]
+      Thống kê + Top IP (đọc 2 lần vs một snapshot) của backend netlink, /proc và ss với nhiều kết nối loopback thật
+      (cột total = số kết nối :80 đếm được, cần quyền bind port 80).
+
+  python3 monitor_bench.py top-ips [--ips 10000 100000 1000000] [--max-ips 1000]
+      Top-K: sort toàn bộ vs heapq.nlargest vs sketch Space-Saving (số key giữ lại, top 5 có khớp không).
+
+  python3 monitor_bench.py discover [--accounts 2000]
+      discover_logs cũ (17 glob mỗi thư mục) vs DiscoveryIndex lần đầu và lần tái khám phá (cây cPanel/DA giả).
+
+  python3 monitor_bench.py rates [--domains 1000 10000] [--seconds 120]
+      RateRing: thời gian add mỗi giây, rows() (render) và bộ nhớ theo số domain.
+
+  python3 monitor_bench.py suite [--vhosts 200] [--rps 5000] [--duration 10] [--binary]
+                                 [--label REV] [--json FILE] [--compare OLD.json]
+      Load-replay: ghi log tổng hợp (mọi format tên file/dòng) với RPS cố định vào cây vhost tạm,
+      đo discover_logs, TailFile, extract_domain/DomainExtractor, _parse_proc_net, get_top_ips và render;
+      báo cáo JSON throughput, độ trễ p50/p90/p99 và RSS theo stage (RSS đỉnh cho cả process) để so
+      giữa các phiên bản.
+"""
+
+from __future__ import annotations
+import os
+import sys
+import time
+import random
+import re
+import socket
+import argparse
+import json
+import platform
+import resource
+import glob
+import heapq
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import monitor  # noqa: E402
+
+SAMPLE_DOMAINS = ("example.com", "shop.example.net", "blog.test.org", "api.demo.io", "static.cdn.vn")
+
+
+def synth_access_line(rng: random.Random, vhost: bool = False, fmt: str = "") -> str:
+    """
+    Generate one access log line.
+    fmt: "" / "combined" (IP đầu dòng), "vhost" (domain IP ...), "vhost_port" (domain:443 IP ...),
+    "nginx_host" (domain - IP ...). vhost=True tương đương fmt="vhost".
+    """
+    ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+    path = f"/p/{rng.randint(0, 99999)}?q={rng.randint(0, 999)}"
+    line = (
+        f'{ip} - - [18/Oct/2026:10:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} +0700] '
+        f'"GET {path} HTTP/1.1" 200 {rng.randint(200, 90000)} "-" '
+        f'"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36"\n'
+    )
+    if vhost:
+        fmt = "vhost"
+    if fmt == "vhost":
+        line = f"{rng.choice(SAMPLE_DOMAINS)} {line}"
+    elif fmt == "vhost_port":
+        line = f"{rng.choice(SAMPLE_DOMAINS)}:{rng.choice((80, 443))} {line}"
+    elif fmt == "nginx_host":
+        line = f"{rng.choice(SAMPLE_DOMAINS)} - {line}"
+    return line
+
+
+# (tên format, fmt cho synth_access_line, key như discover_logs tạo ra)
+LOG_FORMATS: Tuple[Tuple[str, str, str], ...] = (
+    ("combined", "combined", "example.com:/bench/example.com.access.log"),
+    ("combined_ssl", "combined", "example.com-ssl:/bench/example.com-ssl_access_log"),
+    ("apache_vhost", "vhost", "__apache_vhosts__:/bench/other_vhosts_access.log"),
+    ("apache_vhost_port", "vhost_port", "__apache_vhosts__:/bench/other_vhosts_access.log"),
+    ("nginx_host", "nginx_host", "example.com:/bench/example.com.access.log"),
+)
+
+
+def write_synthetic_log(path: str, size_bytes: int, vhost: bool = False, seed: int = 1) -> int:
+    """Write a synthetic access log of about size_bytes. Returns number of lines."""
+    rng = random.Random(seed)
+    # Lặp lại một khối dòng ngẫu nhiên cho nhanh, nội dung vẫn đủ đa dạng cho regex
+    block_lines = [synth_access_line(rng, vhost) for _ in range(4096)]
+    block = "".join(block_lines).encode()
+    written = 0
+    lines = 0
+    with open(path, "wb") as f:
+        while written < size_bytes:
+            f.write(block)
+            written += len(block)
+            lines += len(block_lines)
+    return lines
+
+
+def _time_run(fn: Callable[[], int]) -> Tuple[float, int]:
+    t0 = time.perf_counter()
+    n = fn()
+    return time.perf_counter() - t0, n
+
+
+def bench_tail(args: argparse.Namespace) -> None:
+    """Text vs text+mmap vs binary TailFile on a synthetic access log."""
+    size = int(args.size_mb * 1024 * 1024)
+    monitor.READ_CHUNK_SIZE = int(args.chunk_mb * 1024 * 1024)
+    catchup = monitor.MMAP_CATCHUP_BYTES
+
+    with tempfile.TemporaryDirectory(prefix="monitor-bench-") as tmp:
+        results: Dict[str, Dict[str, float]] = {}
+        for label, vhost, base in (
+            ("combined", False, "example.com.access.log"),
+            ("vhost", True, "other_vhosts_access.log"),
+        ):
+            path = os.path.join(tmp, base)
+            total_lines = write_synthetic_log(path, size, vhost=vhost)
+            key = (f"__apache_vhosts__:{path}" if vhost else f"example.com:{path}")
+
+            for mode, binary, mapped in (("text", False, False), ("text-mmap", False, True), ("binary", True, False)):
+                # text: đọc bằng readlines dù backlog lớn; text-mmap: ngưỡng mặc định (file lớn hơn -> mmap)
+                monitor.MMAP_CATCHUP_BYTES = catchup if mapped else size + 1
+                counts: Dict[str, int] = defaultdict(int)
+                with monitor.TailFile(path, start_at_end=False, binary=binary) as tf:
+                    elapsed, n = _time_run(lambda: monitor.read_tail(key, tf, counts)[0])
+                assert n == total_lines, (mode, n, total_lines)
+                results[f"{label}/{mode}"] = {
+                    "seconds": elapsed,
+                    "lines_per_sec": n / elapsed,
+                    "mb_per_sec": size / elapsed / (1024 * 1024),
+                }
+            os.unlink(path)
+
+    print(f"{'case':<20}{'sec':>10}{'lines/s':>14}{'MB/s':>10}")
+    print("-" * 54)
+    for name, r in results.items():
+        print(f"{name:<20}{r['seconds']:>10.2f}{r['lines_per_sec']:>14,.0f}{r['mb_per_sec']:>10.1f}")
+
+
+def bench_extract(args: argparse.Namespace) -> None:
+    """
+    Microbenchmark domain extraction per log format:
+    before = extract_domain() từng dòng, after = DomainExtractor (text lines / binary chunk).
+    """
+    rng = random.Random(1)
+    time_re = re.compile(monitor._LOG_TIME)
+    print(f"{'format':<20}{'before l/s':>14}{'text l/s':>14}{'binary l/s':>14}{'x text':>8}{'x bin':>8}")
+    print("-" * 78)
+    for name, fmt, key in LOG_FORMATS:
+        lines = [synth_access_line(rng, fmt=fmt) for _ in range(args.lines)]
+        data = bytearray("".join(lines).encode())
+        is_apache_vhosts = key.startswith("__apache_vhosts__:")
+
+        def before() -> int:
+            counts: Dict = defaultdict(int)
+            if args.by_timestamp:
+                # Cách ngây thơ: regex + strptime cho từng dòng
+                for ln in lines:
+                    stamp = time_re.search(ln)
+                    sec = int(datetime.strptime(stamp.group(1), "%d/%b/%Y:%H:%M:%S %z").timestamp())
+                    counts[(monitor.extract_domain(ln, key, is_apache_vhosts), sec)] += 1
+                return len(lines)
+            for ln in lines:
+                counts[monitor.extract_domain(ln, key, is_apache_vhosts)] += 1
+            return len(lines)
+
+        fields = (monitor.FIELD_TIME if args.by_timestamp else 0) | (monitor.FIELD_IP if args.log_ips else 0)
+        ex = monitor.DomainExtractor(key, fields)
+        t_before, n = _time_run(before)
+        t_text, n_text = _time_run(lambda: ex.count_lines(lines, defaultdict(int)))
+        t_bin, n_bin = _time_run(lambda: ex.count_block(data, len(data), defaultdict(int)))
+        assert n == n_text == n_bin, (name, n, n_text, n_bin)
+        print(f"{name:<20}{n / t_before:>14,.0f}{n / t_text:>14,.0f}{n / t_bin:>14,.0f}"
+              f"{t_before / t_text:>7.1f}x{t_before / t_bin:>7.1f}x")
+
+
+PROC_NET_HEADER_V4 = (
+    "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt"
+    "   uid  timeout inode\n"
+)
+PROC_NET_HEADER_V6 = (
+    "  sl  local_address                         remote_address                        st tx_queue"
+    " rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+)
+
+
+def _proc_hex_v4(ip: int) -> str:
+    return f"{int.from_bytes(ip.to_bytes(4, 'big'), 'little'):08X}"
+
+
+def synth_proc_net_tcp(rows: int, v6: bool = False, attackers: int = 5000, seed: int = 1) -> bytes:
+    """
+    Generate a synthetic /proc/net/tcp (or tcp6) table.
+    Phần lớn socket tới :80/:443 từ một tập IP tấn công (ESTABLISHED/SYN_RECV), còn lại ngẫu nhiên.
+    """
+    rng = random.Random(seed)
+    pool = [rng.randint(0x01000000, 0xDFFFFFFF) for _ in range(attackers)]
+    states = ("01", "01", "01", "03", "03", "06", "0A", "08")
+    out = [PROC_NET_HEADER_V6 if v6 else PROC_NET_HEADER_V4]
+    local = _proc_hex_v4(0x0A000005)
+    if v6:
+        local = "0000000000000000FFFF0000" + local
+    for i in range(rows):
+        lport = rng.choice((80, 443, 443, 22, 3306))
+        rip = _proc_hex_v4(rng.choice(pool))
+        if v6:
+            if rng.random() < 0.1:
+                rip = "".join(f"{rng.getrandbits(32):08X}" for _ in range(4))
+            else:
+                rip = "0000000000000000FFFF0000" + rip
+        out.append(
+            f"{i:>4}: {local}:{lport:04X} {rip}:{rng.randint(1024, 65535):04X} {rng.choice(states)} "
+            f"00000000:00000000 00:00000000 00000000    33        0 {rng.randint(1, 10**7)} 1 "
+            f"0000000000000000 20 4 30 10 -1\n"
+        )
+    return "".join(out).encode()
+
+
+def legacy_parse_proc_net(data: bytes) -> List[Tuple[str, int, str, int, str]]:
+    """Parser /proc/net/tcp cũ (split từng dòng + _hex_to_ip), dùng làm mốc so sánh."""
+    def hex_to_ip(hex_ip: str) -> str:
+        if len(hex_ip) == 8:
+            return ".".join(str(int(hex_ip[i:i + 2], 16)) for i in (6, 4, 2, 0))
+        if len(hex_ip) == 32 and hex_ip[:24] == "0000000000000000FFFF0000":
+            ipv4_hex = hex_ip[24:]
+            return ".".join(str(int(ipv4_hex[i:i + 2], 16)) for i in (6, 4, 2, 0))
+        return hex_ip
+
+    connections = []
+    for line in data.decode().splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 4:
+            continue
+        local_addr = parts[1].split(":")
+        remote_addr = parts[2].split(":")
+        connections.append((
+            hex_to_ip(local_addr[0]), int(local_addr[1], 16),
+            hex_to_ip(remote_addr[0]), int(remote_addr[1], 16),
+            monitor.TCP_STATES.get(parts[3], "UNKNOWN"),
+        ))
+    return connections
+
+
+def bench_proc_net(args: argparse.Namespace) -> None:
+    """Legacy vs pure-Python vs NumPy /proc/net/tcp parsing + aggregation."""
+    has_numpy = monitor.np is not None
+    print(f"{'rows':>10}{'family':>8}{'legacy s':>12}{'python s':>12}{'numpy s':>12}")
+    print("-" * 54)
+    for rows in args.rows:
+        for v6 in (False, True):
+            data = synth_proc_net_tcp(rows, v6=v6)
+
+            def legacy() -> int:
+                conns = legacy_parse_proc_net(data)
+                c80: Dict[str, int] = defaultdict(int)
+                for _, lp, rip, rp, st in conns:
+                    if lp == 80 or rp == 80:
+                        c80[rip] += 1
+                return len(conns)
+
+            def run(np_mod) -> int:
+                saved, monitor.np = monitor.np, np_mod
+                try:
+                    table = monitor.parse_proc_net(data, v6=v6)
+                    table.counts()
+                    table.ip_counts()
+                    return table.size
+                finally:
+                    monitor.np = saved
+
+            t_legacy, n_legacy = _time_run(legacy) if rows <= args.legacy_max else (float("nan"), rows)
+            t_py, n_py = _time_run(lambda: run(None))
+            t_np, n_np = _time_run(lambda: run(monitor.np)) if has_numpy else (float("nan"), rows)
+            assert n_legacy == n_py == n_np == rows, (n_legacy, n_py, n_np, rows)
+            print(f"{rows:>10,}{'tcp6' if v6 else 'tcp':>8}{t_legacy:>12.3f}{t_py:>12.3f}{t_np:>12.3f}")
+    if not has_numpy:
+        print("(NumPy chưa cài: cột numpy bỏ qua)")
+
+
+def _open_loopback_connections(count: int, port: int) -> List[socket.socket]:
+    """
+    Open count established loopback connections to a listener on port.
+    Nguồn kết nối rải trên 127.x.y.z để bảng top IP có nhiều IP khác nhau.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = 2 * count + 256
+    if soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(4096)
+    socks = [listener]
+    try:
+        for i in range(count):
+            c = socket.socket()
+            socks.append(c)
+            c.bind((f"127.{(i >> 16) & 0xFF}.{(i >> 8) & 0xFF}.{(i % 250) + 2}", 0))
+            c.connect(("127.0.0.1", port))
+            socks.append(listener.accept()[0])
+    except OSError:
+        for sock in socks:
+            sock.close()
+        raise
+    return socks
+
+
+def bench_net_backends(args: argparse.Namespace) -> None:
+    """
+    Stats + top IPs per NetworkMonitor backend with many live sockets.
+    "2 reads" đọc bảng kết nối hai lần như trước (stats rồi top IP), "snapshot" đọc một lần.
+    """
+    print(f"{'sockets':>10}{'backend':>10}{'2 reads ms':>12}{'snapshot ms':>13}{'total':>10}")
+    print("-" * 55)
+    for count in args.sockets:
+        try:
+            socks = _open_loopback_connections(count, args.port)
+        except OSError as e:
+            print(f"Không mở được {count} kết nối tới :{args.port}: {e}")
+            return
+        try:
+            for backend in args.backends:
+                if backend == "netlink" and not monitor.NetlinkDiag.available():
+                    print(f"{count:>10,}{backend:>10}  (không khả dụng)")
+                    continue
+                mon = monitor.NetworkMonitor(backend)
+                try:
+                    t_two = t_one = 0.0
+                    for _ in range(args.repeat):
+                        t, _top = _time_run(lambda: (mon.snapshot(max_age=0).stats,
+                                                     mon.snapshot(max_age=0).top_ips(threshold=0)))
+                        t_two += t
+                        t0 = time.perf_counter()
+                        snap = mon.snapshot(max_age=0)
+                        snap.top_ips(threshold=0)
+                        t_one += time.perf_counter() - t0
+                finally:
+                    mon.shutdown()
+                print(f"{count:>10,}{backend:>10}{t_two / args.repeat * 1000:>12.1f}"
+                      f"{t_one / args.repeat * 1000:>13.1f}{snap.stats.port_80:>10,}")
+        finally:
+            for sock in socks:
+                sock.close()
+
+
+def legacy_discover_logs(dir_list: List[str]) -> Dict[str, str]:
+    """discover_logs cũ: glob từng INCLUDE_GLOBS trong từng thư mục, getmtime từng file."""
+    found: Dict[str, str] = {}
+    expanded: List[str] = []
+    for d in dir_list:
+        if "*" in d:
+            expanded.extend(m for m in glob.glob(d) if os.path.isdir(m))
+        else:
+            expanded.append(d)
+    for d in dict.fromkeys(expanded):
+        if not os.path.isdir(d):
+            continue
+        for pat in monitor.INCLUDE_GLOBS:
+            for path in glob.glob(os.path.join(d, pat)):
+                if not os.path.isfile(path) or monitor.is_excluded(path):
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) > 86400:
+                        continue
+                except OSError:
+                    continue
+                found.setdefault(monitor.log_key(path), path)
+    return found
+
+
+def build_log_tree(root: str, accounts: int) -> List[str]:
+    """
+    Create a fake hosting tree (cPanel/DirectAdmin layout) and return its dir patterns.
+    Mỗi account: access log, error log (bị loại) và một log cũ hơn 24h.
+    """
+    old = time.time() - 3 * 86400
+    for i in range(accounts):
+        domain = f"site{i}.example.com"
+        for d, name in ((f"home/user{i}/domains/{domain}/logs", f"{domain}.log"),
+                        (f"home/user{i}/access-logs", f"{domain}-ssl_log"),
+                        (f"home/user{i}/logs", f"{domain}-access_log")):
+            path = os.path.join(root, d)
+            os.makedirs(path, exist_ok=True)
+            for fname in (name, "error.log"):
+                with open(os.path.join(path, fname), "w") as f:
+                    f.write("x\n")
+            stale = os.path.join(path, f"old-{name}")
+            with open(stale, "w") as f:
+                f.write("x\n")
+            os.utime(stale, (old, old))
+    return [os.path.join(root, p) for p in
+            ("home/*/logs", "home/*/access-logs", "home/*/domains/*/logs", "var/log/nginx", "www/wwwlogs")]
+
+
+def bench_discover(args: argparse.Namespace) -> None:
+    """Legacy glob discovery vs DiscoveryIndex (cold and warm)."""
+    root = tempfile.mkdtemp(prefix="monitor-bench-")
+    try:
+        print(f"Tạo cây {args.accounts} account trong {root} ...")
+        patterns = build_log_tree(root, args.accounts)
+        # Giống máy thật: thư mục đã "ổn định" (mtime cũ) trước khi monitor chạy
+        settled = time.time() - 60
+        for dirpath, _dirs, _files in os.walk(root):
+            os.utime(dirpath, (settled, settled))
+
+        t_legacy, legacy = _time_run(lambda: legacy_discover_logs(patterns))
+        index = monitor.DiscoveryIndex()
+        t_cold, cold = _time_run(lambda: index.discover(patterns))
+        scans_cold = index.scans
+        t_warm, warm = _time_run(lambda: index.discover(patterns))
+        assert legacy == cold == warm, (len(legacy), len(cold), len(warm))
+        print(f"{'pass':<12}{'seconds':>10}{'scandir':>10}{'logs':>8}")
+        print("-" * 40)
+        print(f"{'legacy':<12}{t_legacy:>10.3f}{'-':>10}{len(legacy):>8}")
+        print(f"{'index cold':<12}{t_cold:>10.3f}{scans_cold:>10}{len(cold):>8}")
+        print(f"{'index warm':<12}{t_warm:>10.3f}{index.scans - scans_cold:>10}{len(warm):>8}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_rates(args: argparse.Namespace) -> None:
+    """RateRing cost per simulated second, full export vs top-N render, and memory per domain."""
+    print(f"{'domains':>10}{'add ms/s':>11}{'rows ms':>10}{'top ms':>9}{'MB':>8}{'B/domain':>10}")
+    print("-" * 58)
+    for n in args.domains:
+        names = [f"site{i}.example.com" for i in range(n)]
+
+        def simulate() -> Tuple[monitor.RateRing, float]:
+            # Khoảng 1/3 domain có request mỗi giây
+            rng = random.Random(n)
+            ring = monitor.RateRing()
+            t_add = 0.0
+            for sec in range(args.seconds):
+                counts = {d: rng.randint(1, 500) for d in rng.sample(names, n // 3)}
+                t0 = time.perf_counter()
+                ring.add(counts, 1000 + sec)
+                t_add += time.perf_counter() - t0
+            return ring, t_add
+
+        # Đo thời gian và bộ nhớ ở hai lượt riêng: tracemalloc làm chậm mọi phép cấp phát
+        ring, t_add = simulate()
+        tracemalloc.start()
+        traced = simulate()
+        mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del traced
+        t_rows, rows = _time_run(ring.rows)
+        assert len(rows) == len(ring)
+        # Terminal chỉ lấy top MAX_ROWS (heap), phải trùng với đầu danh sách đầy đủ
+        t_top, top = _time_run(lambda: ring.rows(monitor.MAX_ROWS, nonzero=True))
+        assert [r[1][1] for r in top] == [r[1][1] for r in rows[:len(top)]]
+        print(f"{n:>10,}{t_add / args.seconds * 1000:>11.2f}{t_rows * 1000:>10.1f}{t_top * 1000:>9.1f}"
+              f"{mem / 1e6:>8.1f}{mem / max(1, len(ring)):>10.0f}")
+
+
+def bench_top_ips(args: argparse.Namespace) -> None:
+    """Full sort vs heap top-K vs Space-Saving sketch on a flood with many distinct IPs."""
+    limit = 5
+    print(f"{'ips':>10}{'count ms':>10}{'sort ms':>10}{'heap ms':>10}{'sketch ms':>11}{'exact keys':>12}"
+          f"{'sketch keys':>13}{'top5 ok':>9}")
+    print("-" * 85)
+    for n in args.ips:
+        rng = random.Random(n)
+        # Phân bố lệch: vài IP tấn công nặng + rất nhiều IP 1-3 kết nối (DDoS phân tán)
+        stream = [rng.randint(1, 10**9) for _ in range(n)]
+        heavy = [rng.randint(1, 10**9) for _ in range(limit)]
+        for i, ip in enumerate(heavy):
+            stream.extend([ip] * (200 + 50 * i))
+        rng.shuffle(stream)
+
+        def count_exact() -> Dict[int, int]:
+            counter: Dict[int, int] = defaultdict(int)
+            for ip in stream:
+                counter[ip] += 1
+            return counter
+
+        t_count, exact = _time_run(count_exact)
+
+        t_sort, top_sort = _time_run(lambda: sorted(exact.items(), key=lambda x: x[1], reverse=True)[:limit])
+        t_heap, top_heap = _time_run(lambda: heapq.nlargest(limit, exact.items(), key=lambda x: x[1]))
+
+        def sketch() -> Dict[int, int]:
+            counter = monitor.new_ip_counter(args.max_ips)
+            for ip in stream:
+                counter[ip] += 1
+            return counter
+
+        t_sketch, sk = _time_run(sketch)
+        top_sketch = heapq.nlargest(limit, sk.items(), key=lambda x: x[1])
+        assert top_sort == top_heap
+        ok = [ip for ip, _ in top_sketch] == [ip for ip, _ in top_heap]
+        print(f"{n:>10,}{t_count * 1000:>10.1f}{t_sort * 1000:>10.1f}{t_heap * 1000:>10.1f}{t_sketch * 1000:>11.1f}"
+              f"{len(exact):>12,}{len(sk):>13,}{'yes' if ok else 'no':>9}")
+
+
+# (file mẫu, fmt dòng) cho bench suite: mọi dạng tên file FILENAME_DOMAIN_RE nhận ra và mọi dạng dòng
+# LOG_LINE_DOMAIN_PATTERNS / APACHE_VHOST_LINE_DOMAIN_RE đọc domain từ nội dung
+SUITE_LOG_LAYOUTS: Tuple[Tuple[str, str], ...] = (
+    ("{d}.access.log", "combined"),          # Nginx / aaPanel
+    ("{d}-access_log", "combined"),          # Apache
+    ("{d}-ssl_access_log", "combined"),      # Apache SSL vhost
+    ("{d}_ols.access_log", "combined"),      # OpenLiteSpeed
+    ("{d}.log", "combined"),                 # DirectAdmin
+    ("{d}-access.log", "nginx_host"),        # Nginx log_format có $host
+    ("{d}.access.log", "vhost"),             # combined có vhost đầu dòng
+    ("other_vhosts_access.log", "vhost_port"),  # Apache vhost_combined (một file chung)
+)
+SUITE_PERCENTILES: Tuple[int, ...] = (50, 90, 99)
+# Đơn vị item của từng stage (mặc định: dòng log)
+SUITE_STAGE_UNITS: Dict[str, str] = {
+    "discover_logs.cold": "files", "discover_logs.warm": "files", "TailFile.readblock": "bytes",
+    "_parse_proc_net": "sockets", "get_top_ips": "sockets", "render": "frames",
+}
+
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+_PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+
+def _current_rss_kb() -> int:
+    # RSS hiện tại (không phải đỉnh như ru_maxrss, vốn không bao giờ giảm): /proc/self/statm, 0 nếu không có
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class StageStats:
+    """
+    Latency samples, item count and RSS of one measured stage.
+    RSS đo bằng RSS hiện tại trước/sau mỗi lần gọi nên không phụ thuộc thứ tự các stage;
+    rss_growth_kb là tổng thay đổi (có thể âm), rss_peak_kb là RSS lớn nhất ngay sau một lần gọi.
+    """
+
+    __slots__ = ("latencies", "items", "rss_peak_kb", "rss_growth_kb")
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.items = 0
+        self.rss_peak_kb = 0
+        self.rss_growth_kb = 0
+
+    def measure(self, fn: Callable[[], int]) -> int:
+        """Run fn once; fn trả về số item (dòng, socket, file...) đã xử lý."""
+        rss = _current_rss_kb()
+        t0 = time.perf_counter()
+        n = fn()
+        self.latencies.append(time.perf_counter() - t0)
+        after = _current_rss_kb()
+        self.items += n
+        self.rss_peak_kb = max(self.rss_peak_kb, after)
+        self.rss_growth_kb += after - rss
+        return n
+
+    def summary(self) -> Dict:
+        lat = sorted(self.latencies)
+        total = sum(lat)
+        out = {
+            "calls": len(lat),
+            "items": self.items,
+            "seconds": total,
+            "items_per_sec": self.items / total if total > 0 else 0.0,
+            "latency_ms": {"mean": total / len(lat) * 1000 if lat else 0.0,
+                           "max": lat[-1] * 1000 if lat else 0.0},
+            "rss_peak_kb": self.rss_peak_kb,
+            "rss_growth_kb": self.rss_growth_kb,
+        }
+        for p in SUITE_PERCENTILES:
+            # nearest-rank
+            out["latency_ms"][f"p{p}"] = lat[max(0, -(-len(lat) * p // 100) - 1)] * 1000 if lat else 0.0
+        return out
+
+
+def build_suite_tree(root: str, vhosts: int) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Create vhost dirs with one log each, cycling through SUITE_LOG_LAYOUTS.
+    Trả về (dir pattern cho discover_logs, [(đường dẫn log, fmt dòng)]).
+    """
+    logs: Dict[str, str] = {}
+    for i in range(vhosts):
+        domain = f"site{i}.example.com"
+        name, fmt = SUITE_LOG_LAYOUTS[i % len(SUITE_LOG_LAYOUTS)]
+        sub = "apache2" if "{d}" not in name else domain
+        path = os.path.join(root, "vhosts", sub, "logs", name.format(d=domain))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logs.setdefault(path, fmt)
+    for path in logs:
+        open(path, "w").close()
+    settled = time.time() - 60
+    for dirpath, _dirs, _files in os.walk(root):
+        os.utime(dirpath, (settled, settled))
+    return [os.path.join(root, "vhosts", "*", "logs")], list(logs.items())
+
+
+class LogWriter(threading.Thread):
+    """Append synthetic lines to every log at a fixed total RPS (mỗi 10ms một đợt, timestamp hiện tại)."""
+
+    def __init__(self, logs: List[Tuple[str, str]], rps: int, seed: int = 1):
+        super().__init__(daemon=True)
+        rng = random.Random(seed)
+        self.rps = rps
+        self.lines = 0
+        self.elapsed = 0.0
+        self._done = threading.Event()
+        # Mỗi file một kho dòng mẫu (bỏ phần timestamp để thay bằng giờ hiện tại lúc ghi)
+        self._files = [(open(path, "a"), [synth_access_line(rng, fmt=fmt).split("[", 1) for _ in range(256)])
+                       for path, fmt in logs]
+
+    def run(self) -> None:
+        t0 = time.monotonic()
+        i = 0
+        while not self._done.wait(0.01):
+            due = int((time.monotonic() - t0) * self.rps) - self.lines
+            stamp = time.strftime("[%d/%b/%Y:%H:%M:%S +0000", time.gmtime())
+            for _ in range(max(0, due)):
+                f, samples = self._files[i % len(self._files)]
+                head, tail = samples[i % len(samples)]
+                f.write(f"{head}{stamp}{tail[tail.index(']'):]}")
+                i += 1
+            for f, _samples in self._files:
+                f.flush()
+            self.lines += max(0, due)
+        self.elapsed = time.monotonic() - t0
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+        for f, _samples in self._files:
+            f.close()
+
+
+def run_suite(args: argparse.Namespace, root: str) -> Dict:
+    """Drive every hot-path stage against a live synthetic tree and return the JSON report."""
+    stages: Dict[str, StageStats] = defaultdict(StageStats)
+    patterns, logs = build_suite_tree(root, args.vhosts)
+
+    # 1) Khám phá log: cold (index mới mỗi lần) và warm (index dùng lại, chỉ stat thư mục)
+    for _ in range(args.repeat):
+        stages["discover_logs.cold"].measure(lambda: len(monitor.discover_logs(patterns)))
+    index = monitor.DiscoveryIndex()
+    monitor.discover_logs(patterns, index)
+    for _ in range(args.repeat):
+        stages["discover_logs.warm"].measure(lambda: len(monitor.discover_logs(patterns, index)))
+    found = monitor.discover_logs(patterns, index)
+    assert len(found) == len(logs), (len(found), len(logs))
+
+    # 2) Bảng kết nối tổng hợp: parse /proc/net/tcp{,6} và Top IP trên snapshot
+    proc_dir = os.path.join(root, "proc")
+    os.makedirs(proc_dir)
+    for name, v6 in (("tcp", False), ("tcp6", True)):
+        with open(os.path.join(proc_dir, name), "wb") as f:
+            f.write(synth_proc_net_tcp(args.conn_rows // 2, v6=v6))
+    proc_paths = [os.path.join(proc_dir, name) for name in ("tcp", "tcp6")]
+    net = monitor.NetworkMonitor("proc", with_ips=True)
+    net.get_all_connections = lambda: [monitor.NetworkMonitor._parse_proc_net(p) for p in proc_paths]
+
+    # 3) Lõi monitor thật (không chạy event loop) để đo render từ kho số liệu
+    argv = sys.argv
+    sys.argv = ["monitor.py", "--topip", "--no-inotify", "--dir", patterns[0]]
+    try:
+        core = monitor.MonitorCore(monitor.parse_args())
+    finally:
+        sys.argv = argv
+    core.net_monitor.shutdown()
+    core.net_monitor = net
+    devnull = open(os.devnull, "w")
+    core.screen = monitor.ScreenRenderer(devnull)
+
+    tails = {key: monitor.TailFile(path, start_at_end=False, binary=args.binary) for key, path in found.items()}
+    extractors = {key: monitor.DomainExtractor(key) for key in found}
+    per_table = args.conn_rows // 2
+
+    def read_text(tf: monitor.TailFile, out: List[str]) -> int:
+        out.extend(tf.readlines())
+        return len(out)
+
+    def read_binary(tf: monitor.TailFile, out: List) -> int:
+        out.extend(tf.readblock())
+        return out[1]
+
+    def extract_each(lines: List[str], key: str) -> int:
+        apache = key.startswith("__apache_vhosts__:")
+        for ln in lines:
+            monitor.extract_domain(ln, key, apache)
+        return len(lines)
+
+    def parse_table(path: str) -> int:
+        monitor.NetworkMonitor._parse_proc_net(path)
+        return per_table
+
+    def top_ips() -> int:
+        net._snapshot = None
+        net.get_top_ips()
+        return per_table * len(proc_paths)
+
+    def render() -> int:
+        core.rates.advance(int(time.time()))
+        rows = core.rates.rows(monitor.MAX_ROWS, nonzero=True)
+        core.screen.frame(core.render(rows))
+        return 1
+
+    writer = LogWriter(logs, args.rps)
+    writer.start()
+    try:
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            tick = time.monotonic()
+            counts: Dict[str, int] = defaultdict(int)
+            for key, tf in tails.items():
+                ex = extractors[key]
+                if args.binary:
+                    block: List = []
+                    stages["TailFile.readblock"].measure(lambda: read_binary(tf, block))
+                    stages["DomainExtractor.count_block"].measure(lambda: ex.count_block(block[0], block[1], counts))
+                else:
+                    lines: List[str] = []
+                    stages["TailFile.readlines"].measure(lambda: read_text(tf, lines))
+                    stages["extract_domain"].measure(lambda: extract_each(lines, key))
+                    stages["DomainExtractor.count_lines"].measure(lambda: ex.count_lines(lines, counts))
+            core.rates.add(counts, int(time.time()))
+            for path in proc_paths:
+                stages["_parse_proc_net"].measure(lambda: parse_table(path))
+            stages["get_top_ips"].measure(top_ips)
+            core.conn = net.snapshot()
+            stages["render"].measure(render)
+            time.sleep(max(0.0, args.tick - (time.monotonic() - tick)))
+    finally:
+        writer.stop()
+        for tf in tails.values():
+            tf.close()
+        core.close()
+        devnull.close()
+
+    return {
+        "bench": "suite",
+        "label": args.label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "numpy": getattr(monitor.np, "__version__", None),
+        "params": {k: getattr(args, k) for k in ("vhosts", "rps", "duration", "tick", "conn_rows", "repeat",
+                                                   "binary")},
+        "writer": {"lines": writer.lines, "rps": writer.lines / max(writer.elapsed, 1e-9)},
+        "rss_peak_kb": _peak_rss_kb(),
+        "stages": {name: dict(st.summary(), unit=SUITE_STAGE_UNITS.get(name, "lines"))
+                   for name, st in stages.items()},
+    }
+
+
+def bench_suite(args: argparse.Namespace) -> None:
+    """Load-replay suite: throughput, latency percentiles and peak RSS per stage, as JSON."""
+    root = tempfile.mkdtemp(prefix="monitor-bench-")
+    try:
+        report = run_suite(args, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.json == "-":
+        print(text)
+    else:
+        if args.json:
+            with open(args.json, "w") as f:
+                f.write(text + "\n")
+        w = report["writer"]
+        print(f"Ghi {w['lines']:,} dòng ({w['rps']:,.0f} req/s) vào {args.vhosts} vhost trong {args.duration:g}s, "
+              f"RSS đỉnh {report['rss_peak_kb'] / 1024:.1f} MB")
+        print(f"{'stage':<30}{'calls':>7}{'items/s':>14}{'unit':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+              f"{'max ms':>9}{'+RSS KB':>9}")
+        print("-" * 104)
+        for name, st in report["stages"].items():
+            lat = st["latency_ms"]
+            print(f"{name:<30}{st['calls']:>7}{st['items_per_sec']:>14,.0f}{st['unit']:>8}{lat['p50']:>9.3f}"
+                  f"{lat['p90']:>9.3f}{lat['p99']:>9.3f}{lat['max']:>9.3f}{st['rss_growth_kb']:>9}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        # So sánh với lần chạy trước (phiên bản khác): >1 là nhanh hơn, p99 <1 là trễ thấp hơn
+        out = sys.stderr if args.json == "-" else sys.stdout
+        print(f"\nSo với {args.compare} ({base.get('label') or base.get('created')}):", file=out)
+        print(f"{'stage':<30}{'items/s':>10}{'p99':>10}", file=out)
+        print("-" * 50, file=out)
+        for name, st in report["stages"].items():
+            old = base.get("stages", {}).get(name)
+            if not old or not old["items_per_sec"] or not old["latency_ms"]["p99"]:
+                print(f"{name:<30}{'-':>10}{'-':>10}", file=out)
+                continue
+            print(f"{name:<30}{st['items_per_sec'] / old['items_per_sec']:>9.2f}x"
+                  f"{st['latency_ms']['p99'] / old['latency_ms']['p99']:>9.2f}x", file=out)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    p = argparse.ArgumentParser(description="Benchmark monitor.py hot paths")
+    sub = p.add_subparsers(dest="bench", required=True)
+
+    t = sub.add_parser("tail", help="TailFile text vs text+mmap vs binary")
+    t.add_argument("--size-mb", type=float, default=1024, help="Kích thước log tổng hợp (MB)")
+    t.add_argument("--chunk-mb", type=float, default=1, help="Kích thước chunk binary mode (MB)")
+    t.set_defaults(func=bench_tail)
+
+    e = sub.add_parser("extract", help="extract_domain vs DomainExtractor theo từng format log")
+    e.add_argument("--lines", type=int, default=200000, help="Số dòng mỗi format")
+    e.add_argument("--by-timestamp", action="store_true",
+                   help="Đếm theo (domain, giây trong log): strptime từng dòng vs timestamp cache")
+    e.add_argument("--log-ips", action="store_true", help="DomainExtractor lấy thêm IP client (FIELD_IP)")
+    e.set_defaults(func=bench_extract)
+
+    n = sub.add_parser("proc-net", help="Parser /proc/net/tcp: cũ vs pure-Python vs NumPy")
+    n.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000],
+                   help="Số dòng của bảng tổng hợp")
+    n.add_argument("--legacy-max", type=int, default=1000000, help="Bỏ qua parser cũ khi vượt số dòng này")
+    n.set_defaults(func=bench_proc_net)
+
+    b = sub.add_parser("net-backends", help="NetworkMonitor: netlink vs /proc vs ss với nhiều socket thật")
+    b.add_argument("--sockets", type=int, nargs="+", default=[1000, 10000, 30000],
+                   help="Số kết nối loopback (mỗi kết nối = 2 socket)")
+    b.add_argument("--port", type=int, default=80, help="Port listener (80 hoặc 443 để được đếm)")
+    b.add_argument("--backends", nargs="+", default=["netlink", "proc", "ss"])
+    b.add_argument("--repeat", type=int, default=3)
+    b.set_defaults(func=bench_net_backends)
+
+    k = sub.add_parser("top-ips", help="Top-K IP: sort vs heap vs Space-Saving")
+    k.add_argument("--ips", type=int, nargs="+", default=[10000, 100000, 1000000], help="Số IP khác nhau")
+    k.add_argument("--max-ips", type=int, default=1000, help="Dung lượng sketch Space-Saving")
+    k.set_defaults(func=bench_top_ips)
+
+    d = sub.add_parser("discover", help="discover_logs: glob cũ vs DiscoveryIndex")
+    d.add_argument("--accounts", type=int, default=2000, help="Số account giả lập")
+    d.set_defaults(func=bench_discover)
+
+    r = sub.add_parser("rates", help="RateRing: add/rows/bộ nhớ theo số domain")
+    r.add_argument("--domains", type=int, nargs="+", default=[1000, 10000], help="Số domain")
+    r.add_argument("--seconds", type=int, default=120, help="Số giây mô phỏng")
+    r.set_defaults(func=bench_rates)
+
+    s = sub.add_parser("suite", help="Load-replay toàn bộ hot path, báo cáo JSON (p50/p90/p99, RSS đỉnh)")
+    s.add_argument("--vhosts", type=int, default=200, help="Số vhost (mỗi vhost một file log)")
+    s.add_argument("--rps", type=int, default=5000, help="Tổng số dòng ghi mỗi giây vào các log")
+    s.add_argument("--duration", type=float, default=10, help="Thời gian chạy (giây)")
+    s.add_argument("--tick", type=float, default=0.25, help="Chu kỳ một lượt đọc/parse/render (giây)")
+    s.add_argument("--conn-rows", type=int, default=20000, help="Tổng số socket của /proc/net/tcp{,6} tổng hợp")
+    s.add_argument("--repeat", type=int, default=20, help="Số lần đo discover_logs (cold và warm)")
+    s.add_argument("--binary", action="store_true", help="Đọc log dạng bytes (readblock + count_block)")
+    s.add_argument("--label", default="", help="Nhãn phiên bản ghi vào báo cáo (vd: git commit)")
+    s.add_argument("--json", metavar="FILE", default="", help="Ghi báo cáo JSON ra FILE ('-' = stdout)")
+    s.add_argument("--compare", metavar="FILE", default="", help="So sánh với báo cáo JSON của lần chạy trước")
+    s.set_defaults(func=bench_suite)
+
+    return p.parse_args()
+
+
+def main() -> None:
+    """Main entry point."""
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# monitor.py và monitor_bench.py nằm ở thư mục gốc repo (không phải package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
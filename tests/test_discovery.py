@@ -0,0 +1,87 @@
+"""DiscoveryIndex (cached scandir) vs the legacy per-pattern glob discovery."""
+
+import os
+import time
+
+import pytest
+
+import monitor
+from monitor_bench import build_log_tree, legacy_discover_logs
+
+# Tên file phủ INCLUDE_GLOBS và các luật loại trừ, đặt trong thư mục không có wildcard
+EXTRA_NAMES = (
+    "example.com.access.log", "shop.vn-access.log", "blog_access.log", "access.log.1",
+    "api.vn-access_log", "access_log.2", "other_vhosts_access.log", "secure.vn-ssl_access_log",
+    "lite_ols.access_log", "lsws.main.log", "forum.vn-bytes_log", "mail.vn.log", "www-https.log",
+    "access.log", "error.log", "php-fpm.log", "modsec_audit.log", "cdn.vn.access.log.gz",
+    "cdn.vn.access.log.20260101", ".hidden.access.log", "notes.txt",
+)
+
+
+def _settle(root):
+    # Như máy thật: mtime thư mục đã cũ hơn DIR_MTIME_SETTLE_SEC nên cache được dùng lại
+    settled = time.time() - 60
+    for dirpath, _dirs, _files in os.walk(root):
+        os.utime(dirpath, (settled, settled))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path)
+    patterns = build_log_tree(root, 6)
+    for d in ("var/log/nginx", "www/wwwlogs"):
+        path = os.path.join(root, d)
+        os.makedirs(path)
+        for name in EXTRA_NAMES:
+            with open(os.path.join(path, name), "w") as f:
+                f.write("x\n")
+    # Thư mục con có tên giống log không được coi là file
+    os.makedirs(os.path.join(root, "var/log/nginx/dir.access.log"))
+    patterns.append(os.path.join(root, "missing/*/logs"))
+    _settle(root)
+    return root, patterns
+
+
+def test_discover_matches_legacy_glob(tree):
+    _root, patterns = tree
+    index = monitor.DiscoveryIndex()
+    found = index.discover(patterns)
+    assert found == legacy_discover_logs(patterns)
+    assert len(found) > 20
+    # Lần hai không đổi gì: cùng kết quả, không scandir lại thư mục nào
+    scans = index.scans
+    assert index.discover(patterns) == found
+    assert index.scans == scans
+
+
+def test_stale_file_written_again_without_dir_change(tree):
+    root, patterns = tree
+    index = monitor.DiscoveryIndex()
+    logs = os.path.join(root, "home/user0/logs")
+    stale = os.path.join(logs, "old-site0.example.com-access_log")
+    assert stale not in index.discover(patterns).values()
+
+    # Ghi tiếp vào file cũ: mtime file đổi nhưng mtime thư mục thì không
+    dir_mtime = os.stat(logs).st_mtime_ns
+    with open(stale, "a") as f:
+        f.write("y\n")
+    assert os.stat(logs).st_mtime_ns == dir_mtime
+    scans = index.scans
+    found = index.discover(patterns)
+    assert index.scans == scans
+    assert stale in found.values()
+    assert found == legacy_discover_logs(patterns)
+
+
+def test_new_and_removed_files_rescan_directory(tree):
+    root, patterns = tree
+    index = monitor.DiscoveryIndex()
+    index.discover(patterns)
+    logs = os.path.join(root, "var/log/nginx")
+    with open(os.path.join(logs, "new.vn.access.log"), "w") as f:
+        f.write("x\n")
+    os.remove(os.path.join(logs, "shop.vn-access.log"))
+    found = index.discover(patterns)
+    assert found == legacy_discover_logs(patterns)
+    assert os.path.join(logs, "new.vn.access.log") in found.values()
+    assert os.path.join(logs, "shop.vn-access.log") not in found.values()
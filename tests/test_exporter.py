@@ -0,0 +1,125 @@
+"""--serve: Prometheus text exposition (render_prometheus) and the MetricsExporter HTTP endpoint."""
+
+import json
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+import monitor
+
+ODD_DOMAIN = 'we"ird\\host\nx.vn'
+ODD_PATH = '/var/log/a"b\\c.log'
+
+SAMPLE_RE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+LABEL_RE = re.compile(r'(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)="(?P<value>(?:[^"\\\n]|\\[\\"n])*)"(?:,|$)')
+
+
+def _unescape(value):
+    return re.sub(r'\\([\\"n])', lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def _payload():
+    stats = monitor.ConnectionStats(port_80=3, port_443=5, established=7, syn_recv=1)
+    rows = [("example.com", [1.0, 2.5, 0.25], 4), (ODD_DOMAIN, [0.0, 0.1, 0.0], 1)]
+    top_ips = {label: [monitor.IPCount("10.0.0.1", 9)] for label in monitor.TOP_IP_LABELS}
+    log_ips = ([("10.0.0.2", 3.0)], [((ODD_DOMAIN, "10.0.0.3"), 1.5)])
+    return monitor.build_export(stats, rows, top_ips, {"k:" + ODD_PATH: 42}, {}, None, log_ips,
+                                sampled={"example.com"})
+
+
+def _parse(text):
+    """Return ({name: (help, type)}, [(name, labels, value)]) and check the line grammar."""
+    meta, samples = {}, []
+    help_seen = None
+    for line in text.split("\n"):
+        if line.startswith("# HELP "):
+            name, help_text = line[7:].split(" ", 1)
+            assert name not in meta, f"HELP trùng cho {name}"
+            meta[name] = [help_text, None]
+            help_seen = name
+        elif line.startswith("# TYPE "):
+            name, kind = line[7:].split(" ")
+            assert name == help_seen and meta[name][1] is None
+            assert kind in ("gauge", "counter")
+            meta[name][1] = kind
+        elif line:
+            m = SAMPLE_RE.match(line)
+            assert m, line
+            labels = {}
+            raw = m.group("labels") or ""
+            pos = 0
+            while pos < len(raw):
+                lm = LABEL_RE.match(raw, pos)
+                assert lm, raw
+                labels[lm.group("key")] = _unescape(lm.group("value"))
+                pos = lm.end()
+            # Mẫu nằm ngay sau HELP/TYPE của metric đó
+            assert m.group("name") == help_seen, line
+            float(m.group("value"))
+            samples.append((m.group("name"), labels, m.group("value")))
+    assert text.endswith("\n")
+    return meta, samples
+
+
+def test_render_prometheus_help_type_and_samples():
+    meta, samples = _parse(monitor.render_prometheus(_payload()).decode("utf-8"))
+    p = monitor.METRIC_PREFIX
+    assert all(kind is not None and help_text for help_text, kind in meta.values())
+    assert meta[f"{p}_domain_rps"][1] == "gauge"
+    assert meta[f"{p}_snapshot_timestamp_seconds"][1] == "gauge"
+    by_name = {}
+    for name, labels, value in samples:
+        by_name.setdefault(name, []).append((labels, value))
+    assert ({"kind": "port_443", "source": "/proc"}, "5") in by_name[f"{p}_connections"]
+    assert ({"domain": "example.com", "window": "10s"}, "2.500") in by_name[f"{p}_domain_rps"]
+    assert by_name[f"{p}_domain_rps_estimated"] == [({"domain": "example.com"}, "1")]
+    assert ({"group": "port_80", "ip": "10.0.0.1"}, "9") in by_name[f"{p}_top_ip_connections"]
+
+
+def test_render_prometheus_escapes_label_values():
+    text = monitor.render_prometheus(_payload()).decode("utf-8")
+    # Xuống dòng trong nhãn không được cắt mẫu thành hai dòng
+    assert 'domain="we\\"ird\\\\host\\nx.vn"' in text
+    _meta, samples = _parse(text)
+    p = monitor.METRIC_PREFIX
+    domains = {labels["domain"] for name, labels, _v in samples if name == f"{p}_domain_peak_rps"}
+    assert domains == {"example.com", ODD_DOMAIN}
+    assert ({"domain": ODD_DOMAIN, "ip": "10.0.0.3"}, "1.500") in [
+        (labels, v) for name, labels, v in samples if name == f"{p}_log_domain_ip_rps"]
+    assert [labels["path"] for name, labels, _v in samples if name == f"{p}_log_lag_bytes"] == [ODD_PATH]
+
+
+def _get(exporter, path):
+    host, port = exporter.address
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}{path}", timeout=5) as resp:
+            return resp.status, resp.headers.get("Content-Type"), resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, None, None
+
+
+@pytest.fixture
+def exporter():
+    exp = monitor.MetricsExporter(0)
+    exp.start()
+    yield exp
+    exp.close()
+
+
+def test_exporter_503_before_first_snapshot_and_404(exporter):
+    assert _get(exporter, "/metrics")[0] == 503
+    assert _get(exporter, "/json")[0] == 503
+    assert _get(exporter, "/")[0] == 404
+    assert _get(exporter, "/metricsx")[0] == 404
+
+    payload = _payload()
+    exporter.publish(payload)
+    status, ctype, body = _get(exporter, "/metrics?x=1")
+    assert status == 200 and ctype.startswith("text/plain; version=0.0.4")
+    assert body == monitor.render_prometheus(payload)
+    status, ctype, body = _get(exporter, "/json")
+    assert status == 200 and ctype == "application/json"
+    assert json.loads(body)["domains"][1]["domain"] == ODD_DOMAIN
+    assert _get(exporter, "/nope")[0] == 404
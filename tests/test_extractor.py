@@ -0,0 +1,118 @@
+"""DomainExtractor (merged regex, block counting) vs the per-line extract_domain baseline."""
+
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import pytest
+
+import monitor
+from monitor_bench import LOG_FORMATS, synth_access_line
+
+
+def _baseline(lines, key):
+    is_vhosts = key.startswith("__apache_vhosts__:")
+    return Counter(monitor.extract_domain(line, key, is_vhosts) for line in lines)
+
+
+def _lines(fmt, n=2000, seed=7):
+    rng = random.Random(seed)
+    lines = [synth_access_line(rng, fmt=fmt) for _ in range(n)]
+    # Host viết hoa, dòng rác và dòng trống cũng phải đếm giống baseline
+    lines[3] = lines[3].replace("example.com", "Example.COM")
+    lines[10] = "garbage without any host\n"
+    lines[11] = "\n"
+    return lines
+
+
+@pytest.mark.parametrize("name,fmt,key", LOG_FORMATS)
+def test_count_lines_matches_extract_domain(name, fmt, key):
+    lines = _lines(fmt)
+    counts = defaultdict(int)
+    assert monitor.DomainExtractor(key).count_lines(lines, counts) == len(lines)
+    assert dict(counts) == dict(_baseline(lines, key))
+
+
+@pytest.mark.parametrize("name,fmt,key", LOG_FORMATS)
+def test_count_block_matches_extract_domain(name, fmt, key):
+    lines = _lines(fmt)
+    data = "".join(lines).encode()
+    # Khối không kết thúc bằng "\n": dòng cuối vẫn là một dòng
+    for buf in (bytearray(data), bytearray(data[:-1])):
+        counts = defaultdict(int)
+        assert monitor.DomainExtractor(key).count_block(buf, len(buf), counts) == len(lines)
+        assert dict(counts) == dict(_baseline(lines, key))
+
+
+def test_key_domain_strips_ssl_suffix():
+    assert monitor.key_domain("Example.com-ssl:/var/log/x") == "example.com"
+    assert monitor.DomainExtractor("shop.vn_ssl:/x").key_domain == "shop.vn"
+
+
+# --by-timestamp (user-015): parse_log_time cắt chuỗi bằng tay, so với strptime
+LOG_TIMES = (
+    "18/Oct/2026:10:15:30 +0000",
+    "18/Oct/2026:10:15:30 +0700",
+    "18/Oct/2026:10:15:30 -0530",
+    "01/Jan/2027:00:00:00 +0700",   # sang năm mới theo giờ địa phương, vẫn là 2026 theo UTC
+    "31/Dec/2026:23:59:59 -0530",   # đã là 2027 theo UTC
+    "28/Feb/2027:23:59:59 +0000",
+    "01/Mar/2027:00:00:00 +0000",
+    "29/Feb/2028:12:00:00 +0700",   # năm nhuận
+    "31/Jan/2026:20:00:00 -1200",
+    "01/Nov/2026:01:30:00 +1345",
+)
+
+
+@pytest.mark.parametrize("stamp", LOG_TIMES)
+def test_parse_log_time_matches_strptime(stamp):
+    want = int(datetime.strptime(stamp, "%d/%b/%Y:%H:%M:%S %z").timestamp())
+    assert monitor.parse_log_time(stamp) == want
+    assert monitor.parse_log_time(stamp.encode()) == want
+
+
+@pytest.mark.parametrize("stamp", [
+    "", "-", "18/Foo/2026:10:15:30 +0700", "18/Oct/2026:10:15 +0700", "18/oct/2026:10:15:30 +0700",
+    "xx/Oct/2026:10:15:30 +0700", "18/Oct/2026:10:15:30 +07", "18/Oct/2026:25:15:30 +0700",
+    "32/Oct/2026:10:15:30 +0700", "29/Feb/2027:10:15:30 +0000",
+])
+def test_parse_log_time_malformed_is_zero(stamp):
+    assert monitor.parse_log_time(stamp) == 0
+    assert monitor.parse_log_time(stamp.encode()) == 0
+
+
+def test_timed_counts_use_log_second_and_clamp_future():
+    ex = monitor.DomainExtractor("__apache_vhosts__:/x", monitor.FIELD_TIME)
+    lines = [
+        'a.com 1.2.3.4 - - [18/Oct/2024:10:15:30 +0700] "GET / HTTP/1.1" 200 1\n',
+        'a.com 1.2.3.4 - - [18/Oct/2024:03:15:30 +0000] "GET / HTTP/1.1" 200 1\n',
+        'b.com 1.2.3.4 - - [01/Jan/2100:00:00:00 +0000] "GET / HTTP/1.1" 200 1\n',
+    ]
+    sec = int(datetime.strptime("18/Oct/2024:10:15:30 +0700", "%d/%b/%Y:%H:%M:%S %z").timestamp())
+    for count in ("lines", "block"):
+        counts = defaultdict(int)
+        before = int(time.time())
+        if count == "lines":
+            ex.count_lines(lines, counts)
+        else:
+            buf = bytearray("".join(lines).encode())
+            ex.count_block(buf, len(buf), counts)
+        after = int(time.time())
+        assert counts.pop(("a.com", sec)) == 2
+        [(domain, future)] = counts
+        # Giây trong tương lai (đồng hồ lệch) bị kẹp về lúc đọc
+        assert domain == "b.com" and before <= future <= after
+
+
+def test_rate_ring_add_timed_drops_old_and_clamps_future():
+    ring = monitor.RateRing(10, (1, 10))
+    ring.advance(1000)
+    ring.add_timed({("a.com", 900): 50, ("a.com", 995): 10, ("b.com", 1005): 7}, 1000)
+    # Giây tương lai vào giây hiện tại, không đẩy head vượt đồng hồ
+    assert ring.head == 1000
+    ring.advance(1001)
+    rows = {d: (rates, peak) for d, rates, peak in ring.rows()}
+    # Giây 900 cũ hơn cửa sổ bị bỏ: peak là 10, không phải 50
+    assert rows["a.com"] == ([0.0, 1.0], 10)
+    assert rows["b.com"] == ([7.0, 0.7], 7)
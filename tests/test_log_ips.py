@@ -0,0 +1,34 @@
+"""LogIPRates (--log-ips): fixed windows over SpaceSaving sketches, read-time and log-time (--by-timestamp)."""
+
+from collections import defaultdict
+
+import monitor
+
+
+def test_split_ip_counts_keeps_log_second_when_timed():
+    fields = monitor.FIELD_TIME | monitor.FIELD_IP
+    counts = {("a.com", 100, "1.1.1.1"): 2, ("a.com", 101, "1.1.1.1"): 1, ("a.com", 101, ""): 5}
+    rates, ips = monitor.split_ip_counts(counts, fields)
+    assert dict(rates) == {("a.com", 100): 2, ("a.com", 101): 6}
+    assert dict(ips) == {("a.com", "1.1.1.1", 100): 2, ("a.com", "1.1.1.1", 101): 1}
+
+
+def test_add_timed_buckets_backlog_by_log_second():
+    r = monitor.LogIPRates(window=10, capacity=100)
+    r.add({}, 1000)
+    # Backlog: 1000 request cũ hơn một cửa sổ (bỏ), 20 request ở cửa sổ đang đếm, 5 ở tương lai (= now)
+    r.add_timed({("a.com", "1.1.1.1", 970): 1000, ("a.com", "2.2.2.2", 1003): 20,
+                 ("a.com", "3.3.3.3", 1500): 5}, 1004)
+    by_ip, _pairs = r.top(5, now=1005.0)
+    assert dict(by_ip) == {"2.2.2.2": 4.0, "3.3.3.3": 1.0}
+
+
+def test_add_timed_late_seconds_go_to_previous_window():
+    r = monitor.LogIPRates(window=10, capacity=100)
+    r.add({("a.com", "1.1.1.1"): 10}, 1000)
+    r.add({}, 1010)                          # cửa sổ [1000, 1010) đã trọn
+    r.add_timed({("a.com", "1.1.1.1", 1009): 10, ("a.com", "2.2.2.2", 1012): 3}, 1012)
+    by_ip, _pairs = r.top(5, now=1013.0)
+    assert dict(by_ip) == {"1.1.1.1": 2.0}
+    current = defaultdict(int, r.current[0])
+    assert current["2.2.2.2"] == 3
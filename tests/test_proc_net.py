@@ -0,0 +1,68 @@
+"""parse_proc_net (pure-Python and NumPy tables) vs the legacy split-per-line parser."""
+
+from collections import Counter
+
+import pytest
+
+import monitor
+from monitor_bench import legacy_parse_proc_net, synth_proc_net_tcp
+
+LOCAL_IPS = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+
+BACKENDS = [pytest.param(None, id="python")]
+if monitor.np is not None:
+    BACKENDS.append(pytest.param(monitor.np, id="numpy"))
+
+
+def _table(v6):
+    data = synth_proc_net_tcp(3000, v6=v6, attackers=200)
+    # Thêm socket tới IP local (phải bị bỏ khỏi bảng IP) và một dòng hỏng
+    remote = ("0000000000000000FFFF00000100007F" if v6 else "0100007F") + ":D431"
+    local = ("0000000000000000FFFF00000500000A" if v6 else "0500000A") + ":0050"
+    extra = "".join(f"{3000 + i:>4}: {local} {remote} 01 00000000:00000000 00:00000000 00000000  0 0 1 1\n"
+                    for i in range(3))
+    return data + extra.encode() + b"  bad line\n"
+
+
+def _ip_text(ip):
+    # Parser cũ trả IPv6 thật dạng hex thô -> đưa về cùng dạng chữ với format_ip_key
+    return ip if "." in ip else monitor.format_ip_key(monitor.proc_hex_ip_key(ip.encode()))
+
+
+def _legacy(data):
+    conns = legacy_parse_proc_net(data)
+    c80, c443, cest = Counter(), Counter(), Counter()
+    p80 = p443 = est = syn = 0
+    for _lip, lp, rip, rp, st in conns:
+        rip = _ip_text(rip)
+        if lp == 80 or rp == 80:
+            p80 += 1
+            c80[rip] += 1
+        if lp == 443 or rp == 443:
+            p443 += 1
+            c443[rip] += 1
+        if st == "ESTABLISHED":
+            est += 1
+            cest[rip] += 1
+        elif st == "SYN_RECV":
+            syn += 1
+    ips = tuple({ip: c for ip, c in counter.items() if ip not in LOCAL_IPS} for counter in (c80, c443, cest))
+    return (p80, p443, est, syn), ips
+
+
+@pytest.mark.parametrize("np_mod", BACKENDS)
+@pytest.mark.parametrize("v6", [False, True], ids=["tcp", "tcp6"])
+def test_parse_proc_net_matches_legacy(monkeypatch, np_mod, v6):
+    monkeypatch.setattr(monitor, "np", np_mod)
+    data = _table(v6)
+    table = monitor.parse_proc_net(data, v6=v6)
+    counts, ips = _legacy(data)
+    assert table.counts() == counts
+    got = tuple({monitor.format_ip_key(k): c for k, c in d.items()} for d in table.ip_counts())
+    assert got == ips
+    assert table.aggregate() == (table.counts(), table.ip_counts())
+
+
+def test_conn_table_is_abstract():
+    with pytest.raises(TypeError):
+        monitor.ConnTable()
@@ -0,0 +1,116 @@
+"""RateRing (sliding-window RPS) incremental totals, peaks and top-N vs a brute-force model over raw counts."""
+
+import random
+from collections import defaultdict
+
+import pytest
+
+import monitor
+
+
+class Model:
+    """Keeps every (domain, second) count and recomputes rows() from scratch."""
+
+    def __init__(self, seconds, windows):
+        self.size = seconds + 1
+        self.windows = windows
+        self.head = self.start = None
+        self.data = defaultdict(int)
+
+    def _advance(self, sec):
+        if self.head is None:
+            # Giây đầu tiên được tính như giây trọn
+            self.head, self.start = sec, sec - 1
+        self.head = max(self.head, sec)
+
+    def add(self, counts, sec):
+        self._advance(sec)
+        if self.head - sec > self.size - 1:
+            return
+        for d, c in counts.items():
+            self.data[d, sec] += c
+
+    def add_timed(self, counts):
+        if not counts:
+            return
+        secs = sorted({s for _d, s in counts})
+        self._advance(secs[-1])
+        self.start = min(self.start, max(secs[0], self.head - self.size + 1) - 1)
+        for (d, s), c in counts.items():
+            self.add({d: c}, s)
+
+    def rows(self, by):
+        head = self.head
+        avail = min(self.size - 1, max(0, head - self.start - 1))
+        out = {}
+        for d in {d for d, _s in self.data}:
+            rates = [sum(self.data.get((d, s), 0) for s in range(max(head - w, self.start + 1), head))
+                     / max(1, min(w, avail)) if avail else 0.0
+                     for w in self.windows]
+            peak = max((self.data.get((d, s), 0) for s in range(head - avail, head)), default=0)
+            if rates[by]:
+                out[d] = (rates, peak)
+        return out
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_rows_match_brute_force(seed):
+    rng = random.Random(seed)
+    ring, model = monitor.RateRing(60, (1, 10, 60)), Model(60, (1, 10, 60))
+    sec = 1_000_000 + rng.randrange(100)
+    for step in range(300):
+        # Đa số giây liền nhau, thỉnh thoảng nhảy xa hơn cả ring (dọn id, tái sử dụng id)
+        sec += rng.choice((0, 1, 1, 1, 2, 3, 30, 70, 150)) if rng.random() < 0.9 else 0
+        counts = {f"d{rng.randrange(40)}.com": rng.randint(1, 9) for _ in range(rng.randint(0, 6))}
+        if rng.random() < 0.25:
+            timed = {(d, sec - rng.randrange(80)): c for d, c in counts.items()}
+            ring.advance(sec)
+            model._advance(sec)
+            ring.add_timed(timed)
+            model.add_timed(timed)
+        else:
+            late = sec - rng.choice((0, 0, 0, 1, 5, 59, 60, 61))
+            ring.add(counts, late)
+            model.add(counts, late)
+        if step % 3:
+            continue
+        by = rng.randrange(3)
+        expected = model.rows(by)
+        got = {d: (rates, peak) for d, rates, peak in ring.rows(nonzero=True, by=by)}
+        assert got.keys() == expected.keys()
+        for d, (rates, peak) in got.items():
+            assert rates == pytest.approx(expected[d][0]) and peak == expected[d][1], d
+        # top-N (heap) = N giá trị lớn nhất của cửa sổ `by`
+        top = [rates[by] for _d, rates, _p in ring.rows(5, nonzero=True, by=by)]
+        assert top == pytest.approx(sorted((r[by] for r, _p in expected.values()), reverse=True)[:5])
+
+
+def test_first_second_is_counted():
+    ring = monitor.RateRing(60, (1, 10, 60))
+    ring.add({"a.com": 100}, 1000)          # backlog đọc ngay trong giây đầu (--start-at-begin, --state)
+    assert ring.rows(nonzero=True) == []    # giây hiện tại chưa trọn
+    ring.add({"a.com": 4}, 1001)
+    assert ring.rows(nonzero=True) == [("a.com", [100.0, 100.0, 100.0], 100)]
+    ring.advance(1002)
+    assert ring.rows(nonzero=True) == [("a.com", [4.0, 52.0, 52.0], 100)]
+
+
+def test_idle_domain_ids_are_released_and_reused():
+    ring = monitor.RateRing(10, (1, 10))
+    ring.add({"a.com": 5, "b.com": 1}, 100)
+    ring.add({"a.com": 1}, 101)
+    assert len(ring) == 2
+    ring.add({"c.com": 3}, 150)          # quá một vòng ring: a, b không còn request nào
+    assert len(ring) == 1
+    ring.add({"c.com": 3}, 151)
+    ring.add({"d.com": 2}, 152)          # id của a/b được cấp lại, không mang số đếm cũ
+    rows = {d: (rates, peak) for d, rates, peak in ring.rows()}
+    assert set(rows) == {"c.com", "d.com"}
+    assert rows["d.com"][1] == 0 and rows["c.com"][1] == 3
+
+
+def test_registry_reuses_ids():
+    reg = monitor.DomainRegistry()
+    a, b = reg.get("a.com"), reg.get("b.com")
+    reg.release(a)
+    assert len(reg) == 1 and reg.get("c.com") == a and reg.get("b.com") == b
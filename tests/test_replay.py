@@ -0,0 +1,128 @@
+"""--replay: rotated/compressed archive discovery, per-file counting and the k-way merge into CSV."""
+
+import bz2
+import csv
+import gzip
+import lzma
+import os
+import random
+import time
+from collections import Counter
+
+import pytest
+
+import monitor
+
+T0 = 1792281600  # 2026-10-18T00:00:00Z
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def _line(rng, sec):
+    stamp = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(sec))
+    return f'1.2.3.{rng.randint(1, 254)} - - [{stamp}] "GET / HTTP/1.1" 200 {rng.randint(1, 999)} "-" "x"\n'
+
+
+def _write(path, lines, age_days=0.0):
+    ext = os.path.splitext(path)[1]
+    with OPENERS.get(ext, open)(path, "wt") as f:
+        f.writelines(lines)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+
+
+# (tên file, domain, tuổi theo ngày, có trong kết quả với --replay-days 7)
+ARCHIVES = (
+    ("example.com.access.log", "example.com", 0, True),
+    ("example.com.access.log.1", "example.com", 1, True),
+    ("example.com.access.log.2.gz", "example.com", 2, True),
+    ("example.com.access.log-20261010.gz", "example.com", 3, True),
+    ("example.com.access.log.20261009.bz2", "example.com", 4, True),
+    ("example.com.access.log-20261008.xz", "example.com", 5, True),
+    ("shop.vn-access_log.3.xz", "shop.vn", 6, True),
+    ("shop.vn-access_log-20260901.gz", "shop.vn", 30, False),   # cũ hơn --replay-days
+    ("error.log.1.gz", "", 1, False),                           # log lỗi bị loại
+    ("notes.txt.gz", "", 1, False),                             # không khớp INCLUDE_GLOBS
+)
+
+
+@pytest.fixture
+def logs(tmp_path):
+    rng = random.Random(5)
+    d = tmp_path / "logs"
+    d.mkdir()
+    expected = Counter()
+    for i, (name, domain, age, included) in enumerate(ARCHIVES):
+        # Các generation chồng lấn nhau về thời gian để phép trộn phải cộng dồn
+        secs = [T0 + rng.randint(0, 40) + 10 * i for _ in range(300)]
+        lines = [_line(rng, s) for s in secs]
+        lines.insert(7, "garbage line without a timestamp\n")
+        _write(str(d / name), lines, age)
+        if included:
+            expected.update((s, domain) for s in secs)
+    return str(d), expected
+
+
+def _csv_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["epoch", "time_utc", "domain", "requests"]
+    return rows[1:]
+
+
+def _expected_rows(expected):
+    return [[str(s), time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(s)), d, str(c)]
+            for (s, d), c in sorted(expected.items())]
+
+
+def test_discover_archives_names_and_cutoff(logs):
+    d, _expected = logs
+    found = monitor.discover_archives([d], 7 * 86400)
+    names = {os.path.basename(path): key.split(":", 1)[0] for key, path in found}
+    assert names == {name: domain for name, domain, _age, included in ARCHIVES if included}
+    # Cửa sổ ngắn hơn: chỉ còn các generation mới
+    assert {os.path.basename(p) for _k, p in monitor.discover_archives([d], 1.5 * 86400)} == {
+        "example.com.access.log", "example.com.access.log.1"}
+
+
+@pytest.mark.parametrize("name", [n for n, _d, _a, included in ARCHIVES if included])
+def test_replay_file_reads_each_format(logs, tmp_path, name):
+    d, _expected = logs
+    path = os.path.join(d, name)
+    _path, lines, runs, error = monitor.replay_file((f"x:{path}", path, str(tmp_path)))
+    assert error is None
+    assert lines == 301
+    [run] = runs
+    rows = list(monitor._read_run(run))
+    assert rows == sorted(rows)
+    assert sum(c for _s, _d, c in rows) == 300
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_replay_csv_matches_expected(logs, tmp_path, workers):
+    d, expected = logs
+    out = str(tmp_path / "out.csv")
+    files, lines, rows = monitor.replay([d], out, workers=workers, days=7)
+    assert (files, lines) == (7, 7 * 301)
+    assert _csv_rows(out) == _expected_rows(expected)
+    assert rows == len(expected)
+    assert not [n for n in os.listdir(tmp_path) if n.startswith(".replay-") or n.endswith(".tmp")]
+
+
+def test_replay_merges_many_small_runs(logs, tmp_path, monkeypatch):
+    # Run nhỏ và fan-in 2: nhiều run mỗi file, trộn nhiều tầng vẫn phải cho cùng CSV
+    monkeypatch.setattr(monitor, "REPLAY_BLOCK_SIZE", 512)
+    monkeypatch.setattr(monitor, "REPLAY_RUN_KEYS", 3)
+    monkeypatch.setattr(monitor, "REPLAY_MERGE_FANIN", 2)
+    d, expected = logs
+    out = str(tmp_path / "out.csv")
+    monitor.replay([d], out, workers=1, days=7)
+    assert _csv_rows(out) == _expected_rows(expected)
+
+
+def test_merged_sums_equal_keys_across_runs(tmp_path):
+    runs = []
+    for i, data in enumerate(([(1, "a", 1), (1, "b", 2), (3, "a", 1)], [(1, "a", 5), (2, "a", 1)], [])):
+        path = tmp_path / f"run{i}.tsv"
+        path.write_text("".join(f"{s}\t{d}\t{c}\n" for s, d, c in data))
+        runs.append(str(path))
+    assert list(monitor._merged(runs)) == [(1, "a", 6), (1, "b", 2), (2, "a", 1), (3, "a", 1)]
@@ -0,0 +1,51 @@
+"""SpaceSaving sketch vs exact counting (Counter) on skewed and churning streams."""
+
+import random
+from collections import Counter
+
+import pytest
+
+import monitor
+
+
+def _stream(seed, n=20000, keys=5000):
+    rng = random.Random(seed)
+    # Vài IP nặng + rất nhiều IP một lần (kiểu flood phân tán)
+    heavy = [f"10.0.0.{i}" for i in range(5)]
+    out = []
+    for _ in range(n):
+        if rng.random() < 0.3:
+            out.append(rng.choice(heavy))
+        else:
+            out.append(f"192.168.{rng.randrange(keys) // 250}.{rng.randrange(keys) % 250}")
+    return out
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_bounds_bracket_true_counts(seed):
+    stream = _stream(seed)
+    exact = Counter(stream)
+    sketch = monitor.SpaceSaving(50)
+    for ip in stream:
+        sketch[ip] += 1
+    assert len(sketch) <= 2 * sketch.capacity
+    lower = sketch.lower_bounds()
+    for ip, est in sketch.items():
+        assert lower.get(ip, 0) <= exact[ip] <= est
+    # Mọi IP có số đếm thật lớn hơn floor đều còn trong bảng
+    assert all(ip in sketch for ip, c in exact.items() if c > sketch.floor)
+    top = [ip for ip, _c in exact.most_common(5)]
+    assert sorted(lower, key=lower.get, reverse=True)[:5] == top
+
+
+def test_batched_increments_match_exact_below_capacity():
+    exact = Counter({f"1.1.1.{i}": i + 1 for i in range(40)})
+    sketch = monitor.SpaceSaving(50)
+    for ip, c in exact.items():
+        sketch[ip] += c
+    assert sketch.floor == 0 and dict(sketch) == dict(exact) == sketch.lower_bounds()
+
+
+def test_new_ip_counter_is_exact_by_default():
+    assert not isinstance(monitor.new_ip_counter(), monitor.SpaceSaving)
+    assert isinstance(monitor.new_ip_counter(10), monitor.SpaceSaving)
@@ -0,0 +1,72 @@
+"""TailManager: LRU cap on open descriptors; suspended tails lose no lines."""
+
+import os
+import time
+from collections import defaultdict
+
+import pytest
+
+import monitor
+
+LINE = '1.2.3.4 - - [17/Oct/2025:10:00:00 +0000] "GET / HTTP/1.1" 200 1 "-" "-"\n'
+
+
+def _append(path, n):
+    with open(path, "a") as f:
+        f.write(LINE * n)
+
+
+def _read(reader, counts):
+    reader.read_until(time.monotonic() + 3 * monitor.POLL_SLEEP, counts)
+
+
+@pytest.mark.parametrize("binary", [False, True], ids=["text", "binary"])
+def test_lru_cap_keeps_every_line(tmp_path, binary):
+    logs = {f"site{i}.com:{tmp_path}/site{i}.com.access.log": str(tmp_path / f"site{i}.com.access.log")
+            for i in range(5)}
+    for p in logs.values():
+        _append(p, 3)
+    manager = monitor.TailManager(start_at_end=False, binary=binary, max_open=2)
+    reader = monitor.TailReader(manager.tails, None, manager=manager)
+    manager.sync(logs, reader)
+    assert manager.open_count <= 2
+
+    counts = defaultdict(int)
+    expected = defaultdict(int)
+    for round_no in range(1, 4):
+        for i, p in enumerate(logs.values()):
+            _append(p, i + round_no)
+            expected[f"site{i}.com"] += i + round_no
+        _read(reader, counts)
+        assert manager.open_count <= 2
+        assert sum(tf.is_open for tf in manager.tails.values()) <= 2
+    for i in range(5):
+        expected[f"site{i}.com"] += 3
+    assert dict(counts) == dict(expected)
+
+
+def test_sync_closes_removed_and_replaced(tmp_path):
+    a, b, c = (str(tmp_path / f"{n}.com.access.log") for n in "abc")
+    for p in (a, b, c):
+        _append(p, 1)
+    manager = monitor.TailManager(start_at_end=True, binary=False, max_open=8)
+    reader = monitor.TailReader(manager.tails, None, manager=manager)
+    manager.sync({"a.com:x": a, "b.com:x": b}, reader)
+    old_b = manager.tails["b.com:x"]
+    manager.sync({"b.com:x": c}, reader)
+    assert set(manager.tails) == {"b.com:x"}
+    assert manager.tails["b.com:x"].path == c and old_b._file.closed
+    assert manager.open_count == 1
+
+
+def test_suspend_resume_continues_from_offset(tmp_path):
+    p = str(tmp_path / "s.com.access.log")
+    _append(p, 2)
+    tf = monitor.TailFile(p, start_at_end=False)
+    assert len(tf.readlines()) == 2
+    tf.suspend()
+    assert not tf.is_open and not tf.resume()   # file không đổi -> không mở lại
+    _append(p, 3)
+    assert tf.resume() and len(tf.readlines()) == 3
+    assert tf.checkpoint() == (os.stat(p).st_ino, os.path.getsize(p))
+    tf.close()
@@ -0,0 +1,49 @@
+"""TailReader with an inotify watcher that cannot watch some files (poll fallback + re-watch back-off)."""
+
+import time
+from collections import defaultdict
+
+import monitor
+
+
+class FailingWatcher:
+    """Stand-in for InotifyWatcher that never gets a watch (như khi hết max_user_watches)."""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+
+    def watch(self, key, path):
+        self.calls[key] += 1
+        return False
+
+    def unwatch(self, key):
+        pass
+
+    def is_watched(self, key):
+        return False
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return set(), set()
+
+
+def test_unwatchable_files_are_polled_and_retried_with_backoff(tmp_path, monkeypatch):
+    path = tmp_path / "a.com.access.log"
+    path.write_text("")
+    tails = {"a.com:x": monitor.TailFile(str(path), start_at_end=True)}
+    watcher = FailingWatcher()
+    reader = monitor.TailReader(tails, watcher)
+    reader.add("a.com:x")
+    with open(path, "a") as f:
+        f.write('1.2.3.4 - - [17/Oct/2025:10:00:00 +0000] "GET / HTTP/1.1" 200 1\n' * 3)
+    counts = defaultdict(int)
+    reader.read_until(time.monotonic() + 5 * monitor.POLL_SLEEP, counts)
+    assert dict(counts) == {"a.com": 3}
+    # Chỉ lần add(); các lượt poll trong thời gian back-off không gọi inotify_add_watch lại
+    assert watcher.calls["a.com:x"] == 1
+
+    monkeypatch.setattr(monitor, "WATCH_RETRY_SEC", 0.0)
+    reader.add("a.com:x")
+    reader.read_until(time.monotonic() + 3 * monitor.POLL_SLEEP, counts)
+    assert watcher.calls["a.com:x"] > 2
+    tails["a.com:x"].close()
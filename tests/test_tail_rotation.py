@@ -0,0 +1,115 @@
+"""TailFile rotation, copytruncate and checkpoint resume (--state) in text, mmap-text and binary mode."""
+
+import os
+from collections import defaultdict
+
+import pytest
+
+import monitor
+
+MODES = ["text", "text-mmap", "binary"]
+
+
+def _line(domain):
+    return f'{domain} 1.2.3.4 - - [17/Oct/2025:10:00:00 +0000] "GET / HTTP/1.1" 200 1 "-" "-"\n'
+
+
+def _write(path, domain, n, mode="a"):
+    with open(path, mode) as f:
+        f.write(_line(domain) * n)
+
+
+@pytest.fixture(params=MODES)
+def mode(request, monkeypatch):
+    if request.param == "text-mmap":
+        # Mọi backlog đều đọc qua TailFile.readmapped
+        monkeypatch.setattr(monitor, "MMAP_CATCHUP_BYTES", 1)
+    return request.param
+
+
+def _open(path, mode, **kw):
+    return monitor.TailFile(path, binary=mode == "binary", **kw)
+
+
+def _drain(tf):
+    """Read until nothing is left (mỗi lượt kiểm tra rotate như khi poll)."""
+    counts = defaultdict(int)
+    key = f"__apache_vhosts__:{tf.path}"
+    for _ in range(4):
+        monitor.read_tail(key, tf, counts)
+    return dict(counts)
+
+
+def test_rotation_reads_rest_of_old_file_then_new(tmp_path, mode):
+    path = str(tmp_path / "other_vhosts_access.log")
+    _write(path, "old.com", 3)
+    tf = _open(path, mode, start_at_end=False)
+    assert _drain(tf) == {"old.com": 3}
+    _write(path, "late.com", 2)
+    os.rename(path, path + ".1")
+    _write(path, "new.com", 4)
+    assert _drain(tf) == {"late.com": 2, "new.com": 4}
+    tf.close()
+
+
+def test_copytruncate_restarts_from_beginning(tmp_path, mode):
+    path = str(tmp_path / "other_vhosts_access.log")
+    _write(path, "old.com", 5)
+    tf = _open(path, mode, start_at_end=False)
+    assert _drain(tf) == {"old.com": 5}
+    _write(path, "new.com", 2, mode="w")
+    assert _drain(tf) == {"new.com": 2}
+    tf.close()
+
+
+def test_resume_from_checkpoint(tmp_path, mode):
+    path = str(tmp_path / "other_vhosts_access.log")
+    _write(path, "old.com", 3)
+    tf = _open(path, mode, start_at_end=False)
+    _drain(tf)
+    cp = tf.checkpoint()
+    tf.close()
+    assert cp == (os.stat(path).st_ino, os.path.getsize(path))
+    _write(path, "down.com", 2)
+    tf = _open(path, mode, resume=cp)
+    assert _drain(tf) == {"down.com": 2}
+    tf.close()
+
+
+def test_resume_after_rotation_while_stopped(tmp_path, mode):
+    path = str(tmp_path / "other_vhosts_access.log")
+    _write(path, "old.com", 3)
+    tf = _open(path, mode, start_at_end=False)
+    _drain(tf)
+    cp = tf.checkpoint()
+    tf.close()
+    _write(path, "late.com", 2)
+    os.rename(path, path + ".1")
+    _write(path, "new.com", 4)
+    tf = _open(path, mode, resume=cp)
+    assert _drain(tf) == {"late.com": 2, "new.com": 4}
+    tf.close()
+
+
+def test_resume_after_truncate_while_stopped(tmp_path, mode):
+    path = str(tmp_path / "other_vhosts_access.log")
+    _write(path, "old.com", 5)
+    tf = _open(path, mode, start_at_end=False)
+    _drain(tf)
+    cp = tf.checkpoint()
+    tf.close()
+    _write(path, "new.com", 2, mode="w")
+    tf = _open(path, mode, resume=cp)
+    assert _drain(tf) == {"new.com": 2}
+    tf.close()
+
+
+def test_state_file_roundtrip(tmp_path):
+    state = str(tmp_path / "state.json")
+    tails = {"a.com:/x": ("/x", 12, 345), "__apache_vhosts__:/y": ("/y", 6, 0)}
+    monitor.save_state(state, tails)
+    assert monitor.load_state(state) == tails
+    with open(state, "w") as f:
+        f.write("{not json")
+    assert monitor.load_state(state) == {}
+    assert monitor.load_state(str(tmp_path / "missing.json")) == {}